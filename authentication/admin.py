@@ -1,5 +1,5 @@
 from django.contrib import admin
-from authentication.models import CustomUser, OTP, WebPushInfo, Group, PushInformation
+from authentication.models import CustomUser, OTP, WebPushInfo, Group, PushInformation, PushNotification
 
 class CustomUserAdmin(admin.ModelAdmin):
     list_display = ('id', 'email', 'phone_number', 'role', 'is_active', 'is_staff', 'created_at', 'updated_at')
@@ -22,3 +22,4 @@ admin.site.register(OTP)
 admin.site.register(WebPushInfo)
 admin.site.register(Group)
 admin.site.register(PushInformation)
+admin.site.register(PushNotification)
@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand
+from authentication.models import WebPushInfo
+from project.push import broadcast
+
+
+class Command(BaseCommand):
+    help = 'Send a web push notification to every subscription, or to the subscriptions of a group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--title', required=True)
+        parser.add_argument('--body', required=True)
+        parser.add_argument('--url', default='https://app.tacoza.co/')
+        parser.add_argument('--group', help='Only send to the subscriptions of this group')
+        parser.add_argument('--ttl', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=64, help='Pushes sent concurrently')
+        parser.add_argument('--per-origin', type=int, default=16, help='Pushes sent concurrently to the same push service')
+
+    def handle(self, *args, **options):
+        subscriptions = WebPushInfo.objects.all()
+        if options['group']:
+            subscriptions = subscriptions.filter(push_information__group__name=options['group']).distinct()
+        payload = json.dumps({"title": options['title'], "body": options['body'], "url": options['url']})
+
+        report = broadcast(
+            subscriptions,
+            payload,
+            ttl=options['ttl'],
+            workers=options['workers'],
+            per_origin=options['per_origin'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['sent']} sent, {report['failed']} failed, {report['gone']} expired subscriptions removed "
+            f"in {report['seconds']}s ({report['per_second']}/s)"
+        ))
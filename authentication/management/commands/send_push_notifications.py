@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from project.push import (
+    NOTIFICATION_RETENTION,
+    PRUNE_INTERVAL,
+    dispatch_notifications,
+    get_push_backend,
+    prune_notifications,
+)
+
+
+class Command(BaseCommand):
+    help = 'Send the queued web push notifications, and prune the ones done with'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send the due notifications and exit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=10, help='Notifications sent concurrently')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds to wait when nothing is due')
+        parser.add_argument('--retention', type=int, default=NOTIFICATION_RETENTION,
+                            help='Seconds sent and failed notifications are kept')
+
+    def handle(self, *args, **options):
+        backend = get_push_backend()
+        pruned_at = None
+        while True:
+            if pruned_at is None or time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned = prune_notifications(options['retention'])
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f"{pruned} notifications pruned")
+            counts = dispatch_notifications(backend, options['batch_size'], options['workers'])
+            if any(counts.values()):
+                self.stdout.write(', '.join(f"{count} {outcome}" for outcome, count in counts.items()))
+            if not any(counts.values()):
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
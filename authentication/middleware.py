@@ -1,7 +1,12 @@
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.status import HTTP_403_FORBIDDEN
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 
 class ABACMiddleware(MiddlewareMixin):
     def process_request(self, request):
@@ -25,3 +30,29 @@ class ABACMiddleware(MiddlewareMixin):
         if request.method == "PUT" and "live-orders" in request.path:
             return user_attributes["role"] == "outlet_manager"
         return True
+
+
+@database_sync_to_async
+def get_token_user(raw_token):
+    """Return the user of a JWT access token, None if it is not valid."""
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+class QueryTokenAuthMiddleware(BaseMiddleware):
+    """
+    Authenticate WebSocket connections with a JWT access token passed as
+    ?token=, browsers cannot set headers on them. Without one the user is the
+    session's, see AuthMiddlewareStack.
+    """
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if token:
+            user = await get_token_user(token[0])
+            if user is not None:
+                scope = dict(scope, user=user)
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-19 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0007_pushnotification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pushnotification',
+            index=models.Index(condition=models.Q(('status__in', ['sent', 'failed'])), fields=['updated_at'], name='push_done_idx'),
+        ),
+    ]
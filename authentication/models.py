@@ -90,6 +90,38 @@ class WebPushInfo(models.Model):
         return f"WebPushInfo for {self.user.email}: {self.endpoint}"
 
 
+class PushNotification(models.Model):
+    """A web push queued for a subscription, sent by the send_push_notifications worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    subscription = models.ForeignKey(WebPushInfo, on_delete=models.CASCADE, related_name='notifications')
+    payload = models.TextField()
+    ttl = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"PushNotification to {self.subscription_id}: {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='push_due_idx'),
+            # Pruning deletes the notifications done with long ago
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(status__in=['sent', 'failed']),
+                name='push_done_idx',
+            ),
+        ]
+
+
 class Group(models.Model):
     name = models.CharField(max_length=255)
 
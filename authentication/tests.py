@@ -1,3 +1,103 @@
+import datetime
 from django.test import TestCase
+from django.utils import timezone
+from authentication.models import CustomUser, PushNotification, WebPushInfo
+from project.push import (
+    MAX_ATTEMPTS,
+    NOTIFICATION_RETENTION,
+    RETRY_DELAY,
+    LocalPushBackend,
+    broadcast,
+    dispatch_notifications,
+    prune_notifications,
+)
+from project.utils import send_notification_to_user
 
-# Create your tests here.
+
+class DispatchNotificationsTests(TestCase):
+    """Queued notifications are sent once, retried on errors and dropped with expired subscriptions."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='customer@example.com', phone_number='+912222222222', password='p', role='customer',
+            name='Customer')
+        self.subscriptions = [
+            WebPushInfo.objects.create(
+                user=self.user, endpoint=f'https://push.example.com/{name}', p256dh='k', auth='a')
+            for name in ('ok', 'down', 'gone')
+        ]
+        self.ok, self.down, self.gone = self.subscriptions
+        self.backend = LocalPushBackend({self.down.endpoint: 500, self.gone.endpoint: 410})
+        send_notification_to_user(self.user, 'hello')
+
+    def notification(self, subscription):
+        return PushNotification.objects.get(subscription=subscription)
+
+    def make_due(self):
+        PushNotification.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+    def test_dispatch(self):
+        started = timezone.now()
+        self.assertEqual(dispatch_notifications(self.backend, workers=2),
+                         {'sent': 1, 'retried': 1, 'failed': 0, 'gone': 1})
+        self.assertEqual([push['subscription_info']['endpoint'] for push in self.backend.outbox], [self.ok.endpoint])
+
+        sent = self.notification(self.ok)
+        self.assertEqual((sent.status, sent.attempts), ('sent', 1))
+        retried = self.notification(self.down)
+        self.assertEqual((retried.status, retried.attempts), ('pending', 1))
+        self.assertIn('500', retried.last_error)
+        self.assertGreaterEqual(retried.next_attempt_at, started + datetime.timedelta(seconds=RETRY_DELAY))
+        # The expired subscription is deleted along with its notifications
+        self.assertFalse(WebPushInfo.objects.filter(pk=self.gone.pk).exists())
+        self.assertFalse(PushNotification.objects.filter(subscription_id=self.gone.pk).exists())
+
+    def test_dispatch_twice(self):
+        dispatch_notifications(self.backend)
+        # Nothing is due before the retry delay, and what was sent is not sent again
+        self.assertEqual(dispatch_notifications(self.backend), {'sent': 0, 'retried': 0, 'failed': 0, 'gone': 0})
+        self.assertEqual(len(self.backend.outbox), 1)
+
+    def test_retries_until_failed(self):
+        for _ in range(1, MAX_ATTEMPTS):
+            self.assertEqual(dispatch_notifications(self.backend)['retried'], 1)
+            self.make_due()
+        self.assertEqual(dispatch_notifications(self.backend)['failed'], 1)
+        failed = self.notification(self.down)
+        self.assertEqual((failed.status, failed.attempts), ('failed', MAX_ATTEMPTS))
+        self.make_due()
+        self.assertEqual(dispatch_notifications(self.backend), {'sent': 0, 'retried': 0, 'failed': 0, 'gone': 0})
+
+    def test_retry_sent_once_recovered(self):
+        dispatch_notifications(self.backend)
+        del self.backend.responses[self.down.endpoint]
+        self.make_due()
+        self.assertEqual(dispatch_notifications(self.backend), {'sent': 1, 'retried': 0, 'failed': 0, 'gone': 0})
+        self.assertEqual([push['subscription_info']['endpoint'] for push in self.backend.outbox],
+                         [self.ok.endpoint, self.down.endpoint])
+        self.assertEqual(self.notification(self.down).attempts, 2)
+
+    def test_backends_do_not_share_state(self):
+        dispatch_notifications(self.backend)
+        other = LocalPushBackend()
+        self.assertEqual((other.outbox, other.responses), ([], {}))
+
+    def test_prune(self):
+        dispatch_notifications(self.backend)
+        PushNotification.objects.update(
+            updated_at=timezone.now() - datetime.timedelta(seconds=NOTIFICATION_RETENTION + 60))
+        recent = PushNotification.objects.create(subscription=self.ok, payload='again', status='sent')
+        # The sent notification goes, the one still being retried stays
+        self.assertEqual(prune_notifications(), 1)
+        self.assertEqual(set(PushNotification.objects.values_list('pk', flat=True)),
+                         {self.notification(self.down).pk, recent.pk})
+        PushNotification.objects.filter(subscription=self.down).update(
+            status='failed', updated_at=timezone.now() - datetime.timedelta(seconds=NOTIFICATION_RETENTION + 60))
+        self.assertEqual(prune_notifications(), 1)
+        self.assertEqual(list(PushNotification.objects.values_list('pk', flat=True)), [recent.pk])
+
+    def test_broadcast_drops_gone_subscriptions(self):
+        self.backend.responses[self.ok.endpoint] = 404
+        counts = broadcast(WebPushInfo.objects.all(), 'hello', backend=self.backend, workers=2)
+        self.assertEqual((counts['sent'], counts['failed'], counts['gone']), (0, 1, 2))
+        self.assertEqual(list(WebPushInfo.objects.values_list('pk', flat=True)), [self.down.pk])
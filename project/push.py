@@ -0,0 +1,289 @@
+"""
+Web push delivery.
+
+Notifications are not sent from the request that triggers them, they are
+queued as PushNotification rows (see project.utils) and sent by the
+send_push_notifications worker through the backend named by the
+WEBPUSH_BACKEND setting:
+
+- WebPushBackend (the default) sends them to the push services with
+  pywebpush, reusing one HTTP session per worker thread and one VAPID
+  signature per push service.
+- LocalPushBackend sends nothing and keeps them in its ``outbox``, to be
+  inspected by tests. Its ``responses`` map an endpoint to the status code
+  its push service should answer with.
+
+Broadcasts to many subscriptions skip the queue, see broadcast().
+Subscriptions the push service answers 404 or 410 for are deleted, along
+with the notifications queued for them.
+
+Sent and failed notifications are kept for NOTIFICATION_RETENTION, then
+deleted by prune_notifications(), which the send_push_notifications worker
+runs every PRUNE_INTERVAL.
+"""
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from py_vapid import Vapid
+from pywebpush import WebPusher, WebPushException
+from authentication.models import PushNotification, WebPushInfo
+
+logger = logging.getLogger(__name__)
+
+# Status codes of a push service for a subscription that no longer exists
+GONE_STATUS_CODES = (404, 410)
+PUSH_TIMEOUT = 10  # seconds
+
+# VAPID signatures are valid for 12 hours and renewed an hour before they expire
+VAPID_LIFETIME = 12 * 60 * 60
+VAPID_RENEWAL = 60 * 60
+
+MAX_ATTEMPTS = 5
+# Retries wait RETRY_DELAY, then twice as long each time
+RETRY_DELAY = 30  # seconds
+# How long a claimed notification is left to a worker before another may retry it
+CLAIM_TIMEOUT = 5 * 60  # 5 minutes in seconds
+# How long sent and failed notifications are kept, and how often they are pruned
+NOTIFICATION_RETENTION = 7 * 24 * 60 * 60  # 7 days in seconds
+PRUNE_INTERVAL = 60 * 60  # 1 hour in seconds
+
+
+class PushError(Exception):
+    """A push that failed and may be retried."""
+
+
+class SubscriptionGone(PushError):
+    """A push to a subscription the push service no longer knows."""
+
+
+def push_origin(endpoint):
+    """Return the origin of the push service of an endpoint, the audience of its VAPID signature."""
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+class VapidSigner:
+    """Sign the VAPID headers once per push service and reuse them until they are about to expire."""
+
+    def __init__(self, private_key, admin_email):
+        self._vapid = Vapid.from_string(private_key=private_key) if private_key else None
+        self._subject = f"mailto:{admin_email}"
+        self._signed = {}
+        self._lock = threading.Lock()
+
+    def headers(self, endpoint):
+        if self._vapid is None:
+            raise PushError("VAPID_PRIVATE_KEY is not set")
+        origin = push_origin(endpoint)
+        now = int(time.time())
+        with self._lock:
+            expires, headers = self._signed.get(origin, (0, None))
+            if expires - VAPID_RENEWAL < now:
+                expires = now + VAPID_LIFETIME
+                headers = self._vapid.sign({'sub': self._subject, 'aud': origin, 'exp': expires})
+                self._signed[origin] = (expires, headers)
+        return dict(headers)
+
+
+class WebPushBackend:
+    """Send notifications to the push services."""
+
+    def __init__(self):
+        self._local = threading.local()
+        vapid_settings = getattr(settings, 'WEBPUSH_SETTINGS', {})
+        self._signer = VapidSigner(vapid_settings.get('VAPID_PRIVATE_KEY'), vapid_settings.get('VAPID_ADMIN_EMAIL'))
+
+    def _session(self):
+        # requests sessions are not thread safe, each worker thread keeps its own
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def send(self, subscription_info, payload, ttl=0):
+        headers = self._signer.headers(subscription_info['endpoint'])
+        try:
+            pusher = WebPusher(subscription_info, requests_session=self._session())
+            response = pusher.send(payload, headers, ttl=ttl, timeout=PUSH_TIMEOUT)
+        except (WebPushException, ValueError) as e:
+            # Malformed subscription keys
+            raise PushError(str(e)) from e
+        except requests.RequestException as e:
+            raise PushError(str(e)) from e
+        if response.status_code in GONE_STATUS_CODES:
+            raise SubscriptionGone(f"Push service answered {response.status_code}")
+        if response.status_code > 202:
+            raise PushError(f"Push service answered {response.status_code} {response.reason}")
+        return response.status_code
+
+
+class LocalPushBackend:
+    """Keep notifications in memory instead of sending them."""
+
+    def __init__(self, responses=None):
+        self.outbox = []
+        self.responses = responses if responses is not None else {}
+
+    def send(self, subscription_info, payload, ttl=0):
+        status_code = self.responses.get(subscription_info['endpoint'], 201)
+        if status_code in GONE_STATUS_CODES:
+            raise SubscriptionGone(f"Push service answered {status_code}")
+        if status_code >= 400:
+            raise PushError(f"Push service answered {status_code}")
+        self.outbox.append({'subscription_info': subscription_info, 'payload': payload, 'ttl': ttl})
+        return status_code
+
+
+def get_push_backend():
+    """Return an instance of the configured push backend."""
+    return import_string(getattr(settings, 'WEBPUSH_BACKEND', 'project.push.WebPushBackend'))()
+
+
+def subscription_info(subscription):
+    """Return the pywebpush subscription info of a WebPushInfo."""
+    return {
+        "endpoint": subscription.endpoint,
+        "keys": {
+            "p256dh": subscription.p256dh,
+            "auth": subscription.auth
+        }
+    }
+
+
+def _claim(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        notifications = list(
+            PushNotification.objects.select_for_update(skip_locked=True)
+            .select_related('subscription')
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        PushNotification.objects.filter(pk__in=[n.pk for n in notifications]).update(
+            next_attempt_at=now + datetime.timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    return notifications
+
+
+def _deliver(backend, notification):
+    try:
+        backend.send(subscription_info(notification.subscription), notification.payload, notification.ttl)
+    except SubscriptionGone:
+        return notification, 'gone', None
+    except PushError as e:
+        return notification, 'error', str(e)
+    return notification, 'sent', None
+
+
+def dispatch_notifications(backend=None, batch_size=100, workers=10):
+    """
+    Send a batch of due notifications concurrently.
+
+    Returns how many were sent, will be retried, failed for good, and were
+    dropped along with their expired subscription.
+    """
+    backend = backend or get_push_backend()
+    notifications = _claim(batch_size)
+    counts = {'sent': 0, 'retried': 0, 'failed': 0, 'gone': 0}
+    if not notifications:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda notification: _deliver(backend, notification), notifications))
+
+    now = timezone.now()
+    gone_subscriptions = set()
+    for notification, outcome, error in results:
+        if notification.subscription_id in gone_subscriptions:
+            # Deleted along with its subscription
+            counts['gone'] += 1
+            continue
+        if outcome == 'gone':
+            # The subscription and its queued notifications go away with it
+            notification.subscription.delete()
+            gone_subscriptions.add(notification.subscription_id)
+            counts['gone'] += 1
+            continue
+        notification.attempts += 1
+        if outcome == 'sent':
+            notification.status = 'sent'
+            counts['sent'] += 1
+        elif notification.attempts >= MAX_ATTEMPTS:
+            notification.status = 'failed'
+            counts['failed'] += 1
+        else:
+            delay = RETRY_DELAY * 2 ** (notification.attempts - 1)
+            notification.next_attempt_at = now + datetime.timedelta(seconds=delay)
+            counts['retried'] += 1
+        notification.last_error = error
+        notification.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'updated_at'])
+    return counts
+
+
+def prune_notifications(retention=NOTIFICATION_RETENTION):
+    """Delete the notifications sent or failed for good more than ``retention`` seconds ago, return how many."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=retention)
+    deleted, _ = PushNotification.objects.filter(status__in=['sent', 'failed'], updated_at__lt=cutoff).delete()
+    return deleted
+
+
+def broadcast(subscriptions, payload, ttl=0, backend=None, workers=64, per_origin=16, chunk_size=1000):
+    """
+    Send a notification to every subscription of the queryset right away.
+
+    The subscriptions are streamed from the database and sent on a pool of
+    ``workers`` threads, with at most ``per_origin`` pushes in flight to the
+    same push service. Expired subscriptions are deleted. Returns how many
+    pushes were sent, failed or went to an expired subscription, along with
+    the time taken and the throughput.
+    """
+    backend = backend or get_push_backend()
+    counts = {'sent': 0, 'failed': 0, 'gone': 0}
+    gone_subscriptions = []
+    lock = threading.Lock()
+    # Bounds the subscriptions read ahead of the pushes in flight
+    pending = threading.BoundedSemaphore(workers * 2)
+    origin_limits = defaultdict(lambda: threading.BoundedSemaphore(per_origin))
+
+    def push(subscription, origin_limit):
+        try:
+            with origin_limit:
+                backend.send(subscription_info(subscription), payload, ttl)
+            outcome = 'sent'
+        except SubscriptionGone:
+            outcome = 'gone'
+        except Exception as e:
+            logger.warning("Push to %s failed: %s", subscription.endpoint, e)
+            outcome = 'failed'
+        finally:
+            pending.release()
+        with lock:
+            counts[outcome] += 1
+            if outcome == 'gone':
+                gone_subscriptions.append(subscription.pk)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for subscription in subscriptions.only('endpoint', 'p256dh', 'auth').iterator(chunk_size=chunk_size):
+            pending.acquire()
+            executor.submit(push, subscription, origin_limits[push_origin(subscription.endpoint)])
+    seconds = time.monotonic() - started
+
+    for start in range(0, len(gone_subscriptions), chunk_size):
+        WebPushInfo.objects.filter(pk__in=gone_subscriptions[start:start + chunk_size]).delete()
+
+    total = sum(counts.values())
+    return dict(
+        counts,
+        total=total,
+        seconds=round(seconds, 2),
+        per_second=round(total / seconds, 1) if seconds else total,
+    )
@@ -0,0 +1,98 @@
+import time
+import datetime
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+# Counters of scopes nobody reads anymore eventually expire
+VERSION_TIMEOUT = 30 * 24 * 60 * 60  # 30 days in seconds
+
+
+def _version_key(scope):
+    return f"version_{scope}"
+
+
+def _modified_key(scope):
+    return f"version_{scope}_modified"
+
+
+def _initial_version():
+    # Seed with the current time so a counter that was evicted from the cache
+    # never restarts at a value an older snapshot may still be stored under.
+    return int(time.time() * 1000)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def get_version(scope):
+    """Return the current version number of the given scope."""
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def get_last_modified(scope, default=None):
+    """
+    Return when the given scope last changed.
+
+    On a cold cache the time is taken from ``default()``, if given, which is
+    expected to derive it from the database.
+    """
+    key = _modified_key(scope)
+    last_modified = cache.get(key)
+    if last_modified is None:
+        last_modified = (default() if default else None) or _now()
+        if timezone.is_naive(last_modified):
+            last_modified = timezone.make_aware(last_modified)
+        cache.add(key, last_modified, VERSION_TIMEOUT)
+    return last_modified
+
+
+def bump_version(scope):
+    """Move the given scope to a new version, making data keyed on the old one stale."""
+    cache.set(_modified_key(scope), _now(), VERSION_TIMEOUT)
+    key = _version_key(scope)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter is missing (never read or evicted), start a fresh one
+        cache.add(key, _initial_version(), VERSION_TIMEOUT)
+        return cache.get(key)
+
+
+def invalidate_scopes(scopes):
+    """Bump the given scopes once the current transaction commits."""
+    scopes = set(scopes)
+    if not scopes:
+        return
+
+    def bump():
+        for scope in scopes:
+            bump_version(scope)
+
+    transaction.on_commit(bump)
+
+
+def conditional_get(scope_func, last_modified_func=None):
+    """
+    Decorate an APIView method to answer conditional GETs.
+
+    The ETag is the version of ``scope_func(**kwargs)`` and Last-Modified the
+    time it was last bumped, so a client holding the current version gets a
+    304 without the view running at all.
+    """
+    def etag(request, *args, **kwargs):
+        return str(get_version(scope_func(*args, **kwargs)))
+
+    def last_modified(request, *args, **kwargs):
+        default = (lambda: last_modified_func(*args, **kwargs)) if last_modified_func else None
+        return get_last_modified(scope_func(*args, **kwargs), default)
+
+    return method_decorator(condition(etag_func=etag, last_modified_func=last_modified))
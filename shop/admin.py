@@ -23,7 +23,11 @@ from shop.models import (
     DiscountCoupon,
     OrderTimelineItem,
     ItemRelation,
-    OutletDocument
+    OutletDocument,
+    DailyOutletStats,
+    OutboxEvent,
+    WebhookEvent,
+    CouponRedemption
 )
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
@@ -120,3 +124,7 @@ admin.site.register(DiscountCoupon)
 admin.site.register(OrderTimelineItem)
 admin.site.register(ItemRelation, ItemRelationAdmin)
 admin.site.register(OutletDocument)
+admin.site.register(DailyOutletStats)
+admin.site.register(OutboxEvent)
+admin.site.register(WebhookEvent)
+admin.site.register(CouponRedemption)
@@ -20,10 +20,31 @@ from shop.models import (
     TableArea,
     Menu,
     DiscountCoupon)
+from shop.variants import VariantTree, prefetch_variant_data
 from authentication.api.serializers import UserSerializer
-from django.db.models import Count
+from django.db import models
 from django.utils import timezone
 
+class DynamicFieldsMixin:
+    """
+    Serializer taking the ``fields`` to keep and the fields to ``expand``.
+
+    Fields that can be expanded are left out unless asked for, they are
+    listed in Meta.expandable_fields by name, as a callable returning the
+    field.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expandable_fields = getattr(self.Meta, 'expandable_fields', {})
+        for name in expand or ():
+            if name in expandable_fields:
+                self.fields[name] = expandable_fields[name]()
+        if fields:
+            for name in set(self.fields) - set(fields) - set(expand or ()):
+                self.fields.pop(name)
+
+
 class FoodTagSerializer(serializers.ModelSerializer):
     class Meta:
         model = FoodTag
@@ -72,6 +93,14 @@ class ItemVariantSerializer(serializers.ModelSerializer):
         return '-'.join([str(variant.id) for variant in sorted(obj.variant.all(), key=lambda v: v.id)])
 
 
+class FoodItemListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """Load the variant data of the whole batch before serializing it."""
+        food_items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        prefetch_variant_data(food_items)
+        return super().to_representation(food_items)
+
+
 class FoodItemSerializer(serializers.ModelSerializer):
     addons = AddonSerializer(many=True, read_only=True)
     tags = FoodTagSerializer(many=True, read_only=True)
@@ -85,6 +114,7 @@ class FoodItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = FoodItem
+        list_serializer_class = FoodItemListSerializer
         fields = [
             'id',
             'name',
@@ -114,100 +144,13 @@ class FoodItemSerializer(serializers.ModelSerializer):
         return obj.food_subcategory.name if obj.food_subcategory else None
 
     def get_variant(self, obj):
-        # Fetch all variant categories associated with the food item
-        categories = obj.variant.all()
-        # Fetch all item variants for the food item
-        item_variants = ItemVariant.objects.filter(food_item=obj)
-        # If there are no variants, return None
-        if not categories.exists():
-            return None
-        # Get the first variant category
-        category = categories.first()
-        # Find all options under this category
-        options = Variant.objects.filter(category=category)
-
-
-        # Build a list to hold the options data
-        options_data = []
-        for option in options:
-            # List to hold the included categories
-            included_categories = [category]
-            # List to hold the included options
-            included_options = [option]
-            # Get the related item variant for the current option
-            num_included = len(included_options)
-            related_item_variant = item_variants.filter(variant__in=included_options).annotate(num_included=Count('variant')).filter(num_included=num_included).first()
-
-            # Check if there are next-level variants for the current option
-            next_variants_data = None
-            if related_item_variant:
-                # Get the nested options for the next variant
-                next_variants_data = self._build_next_variant_data(included_categories, included_options, categories, item_variants)
-            
-                # Build option data
-                option_data = {
-                    "id": option.id,
-                    "name": option.name,
-                    "price": float(related_item_variant.price) if len(categories) == 1 else None,  # Only show price at the final level
-                    "variant": next_variants_data
-                }
-                options_data.append(option_data)
-
-        # Build the structure for the current variant category
-        variant_data = {
-            "id": category.id,
-            "name": category.name,
-            "options": options_data
-        }
-        
-        return variant_data
+        """Return the nested variant options of the food item."""
+        return VariantTree(obj).build()
 
     def get_steps(self, obj):
         """Return the preparation steps."""
         return len(obj.variant.all())
 
-    def _build_next_variant_data(self, included_categories, included_options, categories, item_variants):
-        """Helper method to recursively build the next variant options."""
-        if len(included_categories) == len(categories):
-            return None
-
-        # Find the next category that has not been included yet
-        next_category = None
-        for category in categories:
-            if category not in included_categories:
-                next_category = category
-                break
-        if not next_category:
-            return None
-
-        options = Variant.objects.filter(category=next_category)
-        included_categories.append(next_category)
-
-        options_data = []
-        for option in options:
-            included_options.append(option)
-            num_included = len(included_options)
-            related_item_variant = item_variants.filter(variant__in=included_options).annotate(num_included=Count('variant')).filter(num_included=num_included).first()
-
-            next_variants_data = None
-            if related_item_variant:
-                next_variants_data = self._build_next_variant_data(included_categories, included_options, categories, item_variants)
-            
-                option_data = {
-                    "id": option.id,
-                    "name": option.name,
-                    "price": float(related_item_variant.price) if len(categories) == len(included_categories) else None,  # Show price only at the final level
-                    "variant": next_variants_data
-                }
-                options_data.append(option_data)
-            included_options.pop()
-        
-        return {
-            "id": next_category.id,
-            "name": next_category.name,
-            "options": options_data
-        }
-
     def get_rating(self, obj):
         """Return the average rating of the food item."""
         return 4.5
@@ -215,9 +158,9 @@ class FoodItemSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """Override to_representation to handle empty addons."""
         representation = super().to_representation(instance)
-        if not instance.addons.exists():
+        if not representation['addons']:
             representation['addons'] = None
-        if not instance.variant.exists():
+        if representation['variant'] is None:
             representation['variants'] = None
         return representation
 
@@ -263,7 +206,9 @@ class FoodCategorySerializer(serializers.ModelSerializer):
 
     def get_food_items(self, obj):
         """Return food items directly under this category (those without a subcategory)."""
-        return FoodItemSerializer(obj.food_items.filter(food_subcategory__isnull=True), many=True).data
+        # Filter in memory so prefetched food items are reused
+        food_items = [food_item for food_item in obj.food_items.all() if food_item.food_subcategory_id is None]
+        return FoodItemSerializer(food_items, many=True).data
 
 
 class OutletSerializer(serializers.ModelSerializer):
@@ -322,7 +267,8 @@ class OutletSerializer(serializers.ModelSerializer):
 
     def get_menu_slug(self, obj):
         """Return the menu slug."""
-        menu = Menu.objects.filter(outlet=obj).first()
+        # Read through the relation so menus prefetched along with orders are reused
+        menu = next(iter(obj.menu_set.all()), None)
         return menu.menu_slug if menu else None
 
     def get_logo(self, obj):
@@ -333,7 +279,7 @@ class OutletSerializer(serializers.ModelSerializer):
 
     def get_gallery(self, obj):
         """Return the image URLs of the gallery."""
-        images = OutletImage.objects.filter(outlet=obj)
+        images = obj.images.all()
         return [f"https://api.tacoza.co{image.image.url}" for image in images]
 
     def to_representation(self, instance):
@@ -429,14 +375,14 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.get_total_price()
 
 
-class OrderTimelineSerializer(serializers.Serializer):
+class OrderTimelineSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderTimelineItem
-        ordering = ['created_at']
         fields = ['stage', 'done', 'content', 'created_at']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Full order, for its detail page."""
     items = OrderItemSerializer(many=True)
     user = UserSerializer()
     table = serializers.SerializerMethodField()
@@ -473,7 +419,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     def get_order_timeline(self, obj):
         """Return the order timeline."""
-        order_timelines = OrderTimelineItem.objects.filter(order=obj)
+        order_timelines = obj.timeline.all()
         return [{
             "stage": order_timeline.stage,
             "done": order_timeline.done,
@@ -502,6 +448,147 @@ class OrderSerializer(serializers.ModelSerializer):
         return obj.outlet.average_preparation_time
 
 
+class LiveOrderItemSerializer(serializers.ModelSerializer):
+    food_item = serializers.SerializerMethodField()
+    variant = serializers.SerializerMethodField()
+    addons = serializers.SlugRelatedField(many=True, read_only=True, slug_field='name')
+    totalPrice = serializers.SerializerMethodField()
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'food_item', 'variant', 'quantity', 'addons', 'totalPrice']
+
+    def get_food_item(self, obj):
+        """Return the food item id, name and type."""
+        return {"id": obj.food_item.id, "name": obj.food_item.name, "food_type": obj.food_item.food_type}
+
+    def get_variant(self, obj):
+        """Return the variant name."""
+        if not obj.variant:
+            return None
+        return '-'.join([str(variant.name) for variant in obj.variant.variant.all()])
+
+    def get_totalPrice(self, obj):
+        """Return the total price of the order item."""
+        return obj.get_total_price()
+
+
+class LiveOrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Slim order for the live board and kitchen tickets, without the outlet and the timeline."""
+    items = LiveOrderItemSerializer(many=True)
+    user = UserSerializer()
+    table = serializers.SerializerMethodField()
+    total = serializers.SerializerMethodField()
+    created_at = serializers.SerializerMethodField()
+    updated_at = serializers.SerializerMethodField()
+    avg_preparation_time = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = [
+            'order_id',
+            'user',
+            'items',
+            'table',
+            'cooking_instructions',
+            'order_type',
+            'total',
+            'status',
+            'payment_status',
+            'payment_method',
+            'avg_preparation_time',
+            'created_at',
+            'updated_at'
+        ]
+
+    def get_total(self, obj):
+        return float(obj.total)
+
+    def get_created_at(self, obj):
+        """Return the created_at as an ISO 8601 string."""
+        return obj.created_at.isoformat() if obj.created_at else None
+
+    def get_updated_at(self, obj):
+        """Return the updated_at as an ISO 8601 string."""
+        return obj.updated_at.isoformat() if obj.updated_at else None
+
+    def get_table(self, obj):
+        """Return the table name."""
+        return obj.table.name if obj.table else None
+
+    def get_avg_preparation_time(self, obj):
+        """Return the average preparation time of the order."""
+        return obj.outlet.average_preparation_time
+
+
+class OrderOutletSerializer(serializers.ModelSerializer):
+    """Outlet of an order in a list, just enough to name and link it."""
+    logo = serializers.SerializerMethodField()
+    menu_slug = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Outlet
+        fields = ['id', 'name', 'slug', 'menu_slug', 'logo']
+
+    def get_logo(self, obj):
+        """Return the image URL if it exists, else None."""
+        if obj.logo:
+            return f"https://api.tacoza.co{obj.logo.url}"
+        return None
+
+    def get_menu_slug(self, obj):
+        """Return the menu slug."""
+        menu = next(iter(obj.menu_set.all()), None)
+        return menu.menu_slug if menu else None
+
+
+class OrderSummarySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Order as a row of a list, its items and timeline are left to expand."""
+    user = UserSerializer()
+    outlet = OrderOutletSerializer()
+    table = serializers.SerializerMethodField()
+    total = serializers.SerializerMethodField()
+    item_count = serializers.IntegerField()
+    created_at = serializers.SerializerMethodField()
+    updated_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = [
+            'order_id',
+            'user',
+            'outlet',
+            'table',
+            'order_type',
+            'total',
+            'item_count',
+            'status',
+            'payment_status',
+            'payment_method',
+            'created_at',
+            'updated_at'
+        ]
+        expandable_fields = {
+            'items': lambda: LiveOrderItemSerializer(many=True),
+            'timeline': lambda: OrderTimelineSerializer(many=True),
+        }
+
+    def get_total(self, obj):
+        return float(obj.total)
+
+    def get_created_at(self, obj):
+        """Return the created_at as an ISO 8601 string."""
+        return obj.created_at.isoformat() if obj.created_at else None
+
+    def get_updated_at(self, obj):
+        """Return the updated_at as an ISO 8601 string."""
+        return obj.updated_at.isoformat() if obj.updated_at else None
+
+    def get_table(self, obj):
+        """Return the table name."""
+        return obj.table.name if obj.table else None
+
+
 class CheckoutSerializer(serializers.Serializer):
     class Meta:
         model = Order
@@ -539,7 +626,7 @@ class AreaSerializer(serializers.ModelSerializer):
 
 class DiscountCouponDetailSerializer(serializers.ModelSerializer):
     is_active = serializers.SerializerMethodField()
-    usage = serializers.SerializerMethodField()
+    usage = serializers.IntegerField(source='usage_count', read_only=True)
     class Meta:
         model = DiscountCoupon
         fields = ['id', 
@@ -557,10 +644,6 @@ class DiscountCouponDetailSerializer(serializers.ModelSerializer):
                   'usage',
                   'is_active']
     
-    def get_usage(self, obj):
-        """Return the usage count of the coupon."""
-        return obj.get_usage_count()
-
     def get_is_active(self, obj):
         """Calculate if the coupon is active."""
         today = timezone.now().date()
@@ -568,8 +651,10 @@ class DiscountCouponDetailSerializer(serializers.ModelSerializer):
 
 
 class DiscountCouponSerializer(serializers.ModelSerializer):
-    is_applicable = serializers.SerializerMethodField()
-    is_active = serializers.SerializerMethodField()
+    """An offer for the customer's cart, evaluated by shop.offers."""
+    is_applicable = serializers.BooleanField(read_only=True)
+    is_active = serializers.BooleanField(read_only=True)
+    discount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = DiscountCoupon
@@ -582,26 +667,5 @@ class DiscountCouponSerializer(serializers.ModelSerializer):
             'application_type',
             'is_applicable',
             'is_active',
+            'discount',
         ]
-
-    def get_is_applicable(self, obj):
-        """
-        Checks if the coupon is applicable for the user and their cart.
-        """
-        user = self.context['user']
-        cart = self.context['cart']
-        return obj.is_applicable(user, cart)
-
-    def get_is_active(self, obj):
-        """
-        Checks if the coupon is active based on the cart's total value and usage limits.
-        """
-        cart = self.context['cart']
-        cart_total = sum([item.get_total_price() for item in cart.items.all()])
-
-        # Check if the coupon is within usage limits
-        if obj.get_usage_count() >= obj.use_limit:
-            return False
-
-        # Check if the cart total is within the minimum and maximum order value limits
-        return obj.minimum_order_value <= cart_total <= obj.max_order_value
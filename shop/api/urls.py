@@ -10,6 +10,7 @@ from shop.api.views import (
     CheckoutAPIView,
     PaymentStatusAPIView,
     CashfreeWebhookView,
+    OrderExportView,
     OrderList,
     LiveOrders,
     OrderDetailAPIView,
@@ -55,6 +56,7 @@ urlpatterns = [
     path('cashfree/webhook/', CashfreeWebhookView.as_view(), name='cashfree-webhook'),
 
     path('orders/', OrderList.as_view(), name='orders'),
+    path('orders/export/<slug:export_format>/', OrderExportView.as_view(), name='orders-export'),
     path('live-orders/', LiveOrders.as_view(), name='live-orders'),
     path('live-orders/<slug:order_id>/', LiveOrders.as_view(), name='live-orders-detail'),
     path('order/<slug:order_id>/', OrderDetailAPIView.as_view(), name='orders'),
@@ -77,7 +79,7 @@ urlpatterns = [
     path('subscription/', SocketSeller.as_view(), name='subscription'),
 
     path('discount-coupons/', DiscountCouponListCreateView.as_view(), name='discount-coupon'),
-    path('offers/', ApplicableOffersAPIView.as_view(), name='offers'),
+    path('offers/<slug:menu_slug>/', ApplicableOffersAPIView.as_view(), name='offers'),
 ]
 
 if not settings.DEBUG:
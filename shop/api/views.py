@@ -17,16 +17,18 @@ from shop.models import (
     Payouts,
     TableArea,
     OrderTimelineItem,
-    DiscountCoupon,)
-from authentication.models import CustomUser
+    DiscountCoupon,
+    DailyOutletStats,
+    WebhookEvent,)
 from shop.api.serializers import (
     FoodCategorySerializer,
     OutletSerializer,
     CustomerOutletSerializer,
     OwnerOutletSerializer,
-    CartItemSerializer,
     FoodItemSerializer,
     OrderSerializer,
+    OrderSummarySerializer,
+    LiveOrderSerializer,
     CheckoutSerializer,
     TableSerializer,
     AreaSerializer,
@@ -34,23 +36,20 @@ from shop.api.serializers import (
     DiscountCouponDetailSerializer,
     DiscountCouponSerializer,)
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.generics import ListAPIView
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny
 from django.shortcuts import get_object_or_404
 from django.db import transaction, IntegrityError
-from django.db.models import Q
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.decorators import method_decorator
 from django.utils.dateparse import parse_date
-from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters
 from authentication.utils import RoleBasedSerializer
 
 from cashfree_pg.models.create_order_request import CreateOrderRequest
@@ -59,23 +58,43 @@ from cashfree_pg.models.customer_details import CustomerDetails
 from cashfree_pg.models.order_meta import OrderMeta
 
 from project.utils import send_notification_to_user
-from django.db.models import Count, Sum
+from shop.snapshot import get_menu_snapshot
+from shop.dashboard import get_dashboard_data, dashboard_cache_key, invalidate_dashboard, DASHBOARD_TIMEOUT
+from shop.rollups import record_order_transition
+from shop.utils import day_range
+from shop.versions import (
+    menu_scope,
+    outlet_scope,
+    tables_scope,
+    menu_last_modified,
+    outlet_last_modified,
+    tables_last_modified,)
+from project.versioning import conditional_get
+from shop.loaders import (
+    load_categories,
+    load_food_items,
+    load_orders,
+    load_checkout_items,
+    load_live_orders,
+    load_order_summaries)
+from shop.live import get_live_board, publish_order_event
+from shop.outbox import enqueue
+from shop.tracking import update_timeline
+from shop.carts import get_cart_store, get_menu_outlet_id, render_cart, compact_cart, resolve_line
+from shop.pricing import price_cart, item_lines
+from shop.offers import get_offers, get_offer, best_offer
+from shop.redemptions import reserve_coupon, sync_coupon_use
+from shop.payments import apply_payment_status, cache_payments, get_payment_status, x_api_version
 from django.utils import timezone
 from django.db import models
 
 from django.core.cache import cache
 from datetime import timedelta
+import csv
 import datetime
+import itertools
 import json
 
-# Cashfree API credentials
-Cashfree.XClientId = settings.CASHFREE_CLIENT_ID
-Cashfree.XClientSecret = settings.CASHFREE_SECRET_KEY
-Cashfree.XEnvironment = Cashfree.PRODUCTION
-if settings.DEBUG:
-    Cashfree.XEnvironment = Cashfree.SANDBOX
-x_api_version = "2023-08-01"
-
 CUSTOMER = 'customer'
 OWNER = 'owner'
 
@@ -107,136 +126,18 @@ class DashboardDataAPIView(APIView):
     def get(self, request, *args, **kwargs):
         # Get the current user
         user = request.user
-        user_outlet_ids = Outlet.objects.filter(outlet_manager=user).values_list('id', flat=True)
+        user_outlets = Outlet.objects.filter(outlet_manager=user)
 
-        # Key for cache
-        cache_key = f"dashboard_data_{user.id}"
-        cache_timeout = 6 * 60 * 60  # 6 hours in seconds
+        # Key for cache, moves on to a new one whenever an order of the outlets changes
+        cache_key = dashboard_cache_key(user)
 
         # Try to get cached data
         demoData = cache.get(cache_key)
 
         if not demoData:
             # Compute data if not cached
-            today = timezone.now().date()
-            start_of_today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            start_of_last_week = today - timedelta(days=7)
-            start_of_week_before_last = start_of_last_week - timedelta(days=7)
-            start_of_month = today.replace(day=1)
-
-            todays_revenue = Order.objects.filter(
-                outlet_id__in=user_outlet_ids,
-                created_at__gte=start_of_today,
-                payment_status='success',
-            ).aggregate(total=Sum('total'))['total'] or 0
-
-            total_orders_last_week = Order.objects.filter(
-                outlet_id__in=user_outlet_ids,
-                created_at__date__gte=start_of_week_before_last,
-                created_at__date__lt=start_of_last_week,
-                payment_status='success',
-            ).count()
-            
-            total_orders_this_month = Order.objects.filter(
-                outlet_id__in=user_outlet_ids,
-                created_at__month=today.month,
-                created_at__year=today.year,
-                payment_status='success',
-            ).count()
-
-            total_revenue = Order.objects.filter(
-                outlet_id__in=user_outlet_ids,
-                payment_status='success'
-            ).aggregate(total=Sum('total'))['total'] or 0
-
-            total_days = Order.objects.filter(
-                outlet_id__in=user_outlet_ids,
-                payment_status='success',
-            ).values('created_at__date').distinct().count()
-
-            average_revenue = total_revenue / total_days if total_days else 0
-
-            orders_data = (
-                Order.objects.filter(
-                    outlet_id__in=user_outlet_ids,
-                    payment_status='success',
-                ).values('created_at__date')
-                .annotate(orderCount=Count('order_id'))
-                .order_by('created_at__date')
-            )[:7]
-            
-            revenue_data = (
-                Order.objects.filter(
-                    outlet_id__in=user_outlet_ids,
-                    payment_status='success',
-                ).values('created_at__date')
-                .annotate(dailyRevenue=Sum('total'))
-                .order_by('created_at__date')
-            )[:7]
-
-            orders = [
-                {'date': order['created_at__date'].strftime('%Y-%m-%d'), 'orderCount': order['orderCount']}
-                for order in orders_data
-            ]
-            revenue = [
-                {'date': revenue['created_at__date'].strftime('%Y-%m-%d'), 'revenue': float(revenue['dailyRevenue'])}
-                for revenue in revenue_data
-            ]
-            
-            user_outlet_ids = Outlet.objects.filter(outlet_manager=user).values_list('id', flat=True)
-            
-            new_users_this_month = CustomUser.objects.filter(
-                order__outlet_id__in=user_outlet_ids,
-                # order__created_at__gte=start_of_month,
-            ).annotate(
-                order_count_in_month=Count('order', filter=Q(order__created_at__gte=start_of_month, order__outlet_id__in=user_outlet_ids))
-            ).filter(
-                order_count_in_month=1
-            ).distinct().count()
-            
-            print('new_users_this_month')
-            print(new_users_this_month)
-            
-            active_users_this_month = CustomUser.objects.filter(
-                order__outlet_id__in=user_outlet_ids,
-                # order__created_at__month=today.month,
-                # order__created_at__year=today.year,
-            ).annotate(
-                previous_orders=Count('order', filter=Q(order__created_at__lt=start_of_month, order__outlet_id__in=user_outlet_ids))
-            ).filter(
-                previous_orders__gt=0
-            ).distinct().count()
-            
-            print('active_users_this_month')
-            print(active_users_this_month)
-            
-            # Data to cache
-            demoData = {
-                # graph
-                'orders': orders,
-                'revenue': revenue,
-                # stats
-                'total_revenue': total_revenue,
-                'new_users_this_month': new_users_this_month,
-                'active_users_this_month': active_users_this_month,
-                'total_orders_this_month': total_orders_this_month,
-                'todaysRevenue': round(float(todays_revenue), 2),
-                'totalOrdersLastWeek': total_orders_last_week,
-                'averageRevenue': round(float(average_revenue), 2),
-            }
-
-            # Cache the data for 24 hours
-            cache.set(cache_key, demoData, cache_timeout)
-
-        # Fetch today's total orders (not cached)
-        start_of_today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        todays_orders = Order.objects.filter(
-            outlet_id__in=user_outlet_ids,
-            created_at__gte=start_of_today
-        ).count()
-
-        # Add today's orders to the response data
-        demoData['todaysOrders'] = todays_orders
+            demoData = get_dashboard_data(user_outlets)
+            cache.set(cache_key, demoData, DASHBOARD_TIMEOUT)
 
         return Response(demoData, status=status.HTTP_200_OK)
 
@@ -244,32 +145,11 @@ class DashboardDataAPIView(APIView):
 class FoodCategoryListCreateView(APIView):
     permission_classes = []
 
+    @conditional_get(menu_scope, menu_last_modified)
     def get(self, request, menu_slug):
-        menu = get_object_or_404(Menu, menu_slug=menu_slug)
-        categories = FoodCategory.objects.filter(menu=menu).order_by('order', 'name')
-        serializer = FoodCategorySerializer(categories, many=True)
-        category_data = serializer.data
-
-        # Add the recommended category
-        recommended_category = self.get_recommended_category(menu)
-        if recommended_category:
-            category_data.insert(0, recommended_category)
-
-        return Response(category_data)
-
-    def get_recommended_category(self, menu):
-        """Create a 'Recommended' category with all featured food items."""
-        featured_items = FoodItem.objects.filter(menu=menu, featured=True)
-        if featured_items.exists():
-            food_items_data = FoodItemSerializer(featured_items, many=True).data
-            recommended_category = {
-                "id": -1,  # You can choose to leave it `None` or set a specific ID
-                "name": "Recommended",
-                "sub_categories": [],  # No subcategories in recommended
-                "food_items": food_items_data
-            }
-            return recommended_category
-        return None
+        # The menu is served from its precompiled snapshot, rebuilt only when the menu changes
+        version, blob = get_menu_snapshot(menu_slug, lambda: get_object_or_404(Menu, menu_slug=menu_slug))
+        return HttpResponse(blob, content_type='application/json')
 
 
 class FoodItemListCreateView(APIView):
@@ -277,7 +157,7 @@ class FoodItemListCreateView(APIView):
         user = request.user
         outlet = Outlet.objects.filter(outlet_manager=user).first()
         menu = Menu.objects.filter(outlet=outlet).first()
-        categories = FoodCategory.objects.filter(menu=menu).order_by('order', 'name')
+        categories = load_categories(FoodCategory.objects.filter(menu=menu).order_by('order', 'name'))
         serializer = FoodCategorySerializer(categories, many=True)
         return Response(serializer.data)
 
@@ -292,9 +172,7 @@ class FoodItemByCategory(APIView):
     permission_classes = []
     def get(self, request, slug):
         category = get_object_or_404(FoodCategory, slug=slug)
-        print(category, 'category')
-        food_items = FoodItem.objects.filter(food_category=category)
-        print(food_items, 'food_items')
+        food_items = load_food_items(FoodItem.objects.filter(food_category=category))
         serializer = FoodItemSerializer(food_items, many=True)
         return Response(serializer.data)
 
@@ -302,7 +180,7 @@ class FoodItemDetailView(APIView):
     parser_classes = (MultiPartParser, FormParser, JSONParser)
 
     def get(self, request, slug):
-        food_item = get_object_or_404(FoodItem, slug=slug)
+        food_item = get_object_or_404(load_food_items(FoodItem.objects.all()), slug=slug)
         serializer = FoodItemSerializer(food_item)
         return Response(serializer.data)
     
@@ -371,94 +249,72 @@ class AddonCategoryDetailView(APIView):
 
 
 class CartView(APIView):
+    """
+    The customer's cart at the menu's outlet.
+
+    The cart is returned in its compact form, a change returns the line
+    changed and the new totals only. ?full=1 returns every line with its
+    food item instead.
+    """
     def get(self, request, menu_slug):
         user = request.user
-        menu = get_object_or_404(Menu, menu_slug=menu_slug)
-        outlet = menu.outlet
-        cart = self.get_cart(user, outlet)
-        serializer = CartItemSerializer(cart.items.all(), many=True)
-        return Response(serializer.data)
+        outlet_id = get_menu_outlet_id(menu_slug)
+        lines = get_cart_store().lines(user, outlet_id)
+        return self.cart_response(menu_slug, lines)
 
     def post(self, request, menu_slug):
         user = request.user
-        menu = get_object_or_404(Menu, menu_slug=menu_slug)
-        outlet = menu.outlet
-        cart = self.get_cart(user, outlet)
+        outlet_id = get_menu_outlet_id(menu_slug)
+        store = get_cart_store()
 
         data = request.data
-        food_item = get_object_or_404(FoodItem, id=data['food_item_id'])
-        item_variant = get_object_or_404(ItemVariant, id=data['variant_id']) if data.get('variant_id') else None
-        addons = Addon.objects.filter(id__in=data.get('addons', []))
+        food_item_id = data['food_item_id']
+        variant_id = data.get('variant_id') or None
+        addon_ids = resolve_line(menu_slug, food_item_id, variant_id, data.get('addons', []))
         quantity = data.get('quantity', 1)
         id = data.get('id')
 
-        cart_item, item_created = CartItem.objects.get_or_create(
-            item_id=id, cart=cart, food_item=food_item, variant=item_variant, defaults={'quantity': quantity}
-        )
-        if not item_created:
-            cart_item.quantity += quantity
-            cart_item.save()
-
-        cart_item.addons.set(addons)
-
-        # Return all the cart items
-        serializer = CartItemSerializer(cart.items.all(), many=True)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def get_cart(self, user, outlet):
-        try:
-            with transaction.atomic():  # Ensure atomic transaction
-                cart, created = Cart.objects.get_or_create(user=user, outlet=outlet)
-        except IntegrityError:
-            # Handle duplicate cart creation here (optional)
-            cart = Cart.objects.filter(user=user, outlet=outlet).first()
-        return cart
+        store.add(user, outlet_id, id, food_item_id, variant_id, addon_ids, quantity)
+        return self.cart_response(menu_slug, store.lines(user, outlet_id), id, status.HTTP_201_CREATED)
 
     def delete(self, request, menu_slug, item_id):
         user = request.user
-        menu = get_object_or_404(Menu, menu_slug=menu_slug)
-        outlet = menu.outlet
-        cart = get_object_or_404(Cart, user=user, outlet=outlet)
-        cart_item = get_object_or_404(CartItem, item_id=item_id, cart=cart)
-        cart_item.delete()
-
-        # Return all the cart items
-        serializer = CartItemSerializer(cart.items.all(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        outlet_id = get_menu_outlet_id(menu_slug)
+        store = get_cart_store()
+        store.remove(user, outlet_id, item_id)
+        return self.cart_response(menu_slug, store.lines(user, outlet_id), item_id)
 
     def put(self, request, menu_slug, item_id):
         user = request.user
-        menu = get_object_or_404(Menu, menu_slug=menu_slug)
-        outlet = menu.outlet
-        cart = get_object_or_404(Cart, user=user, outlet=outlet)
-        cart_item = get_object_or_404(CartItem, item_id=item_id, cart=cart)
+        outlet_id = get_menu_outlet_id(menu_slug)
+        store = get_cart_store()
         quantity = request.data.get('quantity', 1)
+        store.set_quantity(user, outlet_id, item_id, quantity)
+        return self.cart_response(menu_slug, store.lines(user, outlet_id), item_id)
 
-        if quantity <= 0:
-            cart_item.delete()
-        else:
-            cart_item.quantity = quantity
-            cart_item.save()
-
-        # Return all the cart items
-        serializer = CartItemSerializer(cart.items.all(), many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def cart_response(self, menu_slug, lines, item_id=None, status_code=status.HTTP_200_OK):
+        if self.request.query_params.get('full') == '1':
+            # Return all the cart items
+            return Response(render_cart(menu_slug, lines), status=status_code)
+        return Response(compact_cart(menu_slug, lines, item_id), status=status_code)
 
 
 class CheckoutAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def post(self, request, menu_slug):
         user = request.user
 
         # Get the cart
         menu = get_object_or_404(Menu, menu_slug=menu_slug)
         outlet = menu.outlet
+        # A cart kept out of the database is written to it to be checked out
+        cart_store = get_cart_store()
+        cart_store.persist(user, outlet.pk)
         cart = get_object_or_404(Cart, user=user, outlet=outlet)
-        cart_items = CartItem.objects.filter(cart=cart)
+        cart_items = list(load_checkout_items(CartItem.objects.filter(cart=cart)))
 
-        if cart_items.count() == 0:
+        if not cart_items:
             return Response({"detail": "Cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
 
         order_type = request.data.get('order_type', 'dine_in')
@@ -473,11 +329,20 @@ class CheckoutAPIView(APIView):
 
         cooking_instructions = request.data.get('cooking_instructions', None)
 
-        # Prepare order data
-        total_price = sum(item.get_total_price() for item in cart_items)
+        # Prepare order data, priced from the price table of the menu
+        cart_price = price_cart(menu_slug, item_lines(cart_items))
+        total_price = cart_price['total']
+        offer = None
+        coupon_code = request.data.get('coupon_code')
+        if coupon_code:
+            offer = get_offer(user, outlet.pk, coupon_code, cart_price)
+            if offer is None or not (offer.is_applicable and offer.is_active):
+                return Response({"detail": "Coupon is not applicable."}, status=status.HTTP_400_BAD_REQUEST)
+            total_price = cart_price['subtotal'] - offer.discount
         order_data = {
             "user": user,
             "outlet": cart.outlet,
+            "offer": offer,
             "total": total_price,
             "status": "pending",
             "order_type": order_type,
@@ -485,65 +350,61 @@ class CheckoutAPIView(APIView):
             "cooking_instructions": cooking_instructions,
             "payment_method": payment_method
         }
-
-        # Create the order in your database
         order_serializer = CheckoutSerializer(data=order_data)
         order_serializer.is_valid(raise_exception=True)
-        order = Order.objects.create(**order_data)
-
-         # Create or update the OrderTimelineItem for "Order Placed"
-        timeline_item, created = OrderTimelineItem.objects.get_or_create(
-            order=order,
-            stage="Order Placed",
-            defaults={
-                'content': "Order has been placed successfully.",
-                'done': True
-            }
-        )
-        if not created:
-            timeline_item.updated_at = timezone.now()
-            timeline_item.save()
-
-        # Create OrderItems from CartItems
-        for cart_item in cart_items:
-            order_item = OrderItem(
+        pay_at_outlet = payment_method == 'cash' or payment_method == 'upi'
+
+        # Only the database work runs in the transaction, side effects are
+        # queued in the outbox and sent once it commits
+        with transaction.atomic():
+            # Take a use of the coupon first, checkouts racing for its last use
+            # wait on each other and only the first one gets it
+            if offer is not None and not reserve_coupon(offer, user):
+                return Response({"detail": "Coupon is no longer available."}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Create the order in your database
+            order = Order.objects.create(**order_data)
+            invalidate_dashboard(outlet)
+
+            # The order is new, so is its "Order Placed" OrderTimelineItem
+            OrderTimelineItem.objects.create(
                 order=order,
-                food_item=cart_item.food_item,
-                variant=cart_item.variant,
-                quantity=cart_item.quantity
-            )
-            order_item.save()
-            order_item.addons.set(cart_item.addons.all())
-
-        # Clear the cart
-        cart.delete()
-
-        if payment_method == 'cash' or payment_method == 'upi':
-            menu = Menu.objects.get(outlet=order.outlet)
-            channel_layer = get_channel_layer()
-            order_data = OrderSerializer(order).data
-
-            async_to_sync(channel_layer.group_send)(
-                f'seller_{menu.menu_slug}',
-                {
-                    'type': 'seller_notification',
-                    'message': order_data
-                }
+                stage="Order Placed",
+                content="Order has been placed successfully.",
+                done=True
             )
 
-            # notify outlet owner
-            owner = menu.outlet.outlet_manager
-            payload = json.dumps({
-                "title": "New Order", 
-                "body": "You have received a new order.", 
-                "url": "https://seller.tacoza.co/orders"})
-            send_notification_to_user(owner, payload)
-
+            # Create OrderItems from CartItems, then their addons, in one insert each
+            order_items = OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    food_item=cart_item.food_item,
+                    variant=cart_item.variant,
+                    quantity=cart_item.quantity
+                )
+                for cart_item in cart_items
+            ])
+            OrderItem.addons.through.objects.bulk_create([
+                OrderItem.addons.through(orderitem_id=order_item.pk, addon_id=addon.pk)
+                for order_item, cart_item in zip(order_items, cart_items)
+                for addon in cart_item.addons.all()
+            ])
+
+            publish_order_event(order, 'created')
+            if pay_at_outlet:
+                # Clear the cart and notify the outlet owner
+                cart.delete()
+                cart_store.discard(user, outlet.pk)
+                enqueue('shop.live.notify_new_order', order_id=str(order.order_id))
+
+        if pay_at_outlet:
             return Response({
                 "order_id": order.order_id,
                 "payment_session_id": None
             }, status=status.HTTP_201_CREATED)
 
+        # Online payments: the payment order is created with Cashfree after the
+        # commit, the cart is kept until it succeeds so checkout can be retried
         customer_details = CustomerDetails(
                     customer_id=user.get_user_id(),
                     customer_phone=user.phone_number[3:],
@@ -563,24 +424,27 @@ class CheckoutAPIView(APIView):
         order_meta.notify_url = f"https://api.tacoza.co/api/shop/cashfree/webhook/"
         create_order_request.order_meta = order_meta
 
-        # try:
-        api_response = Cashfree().PGCreateOrder(x_api_version, create_order_request, None, None)
-        order.payment_id = api_response.data.cf_order_id
-        order.payment_session_id = api_response.data.payment_session_id
-        order.save()
-
-        # Create or update the OrderTimelineItem for "Payment Initiated"
-        timeline_item, created = OrderTimelineItem.objects.get_or_create(
-            order=order,
-            stage="Payment Initiated",
-            defaults={
-                'content': "Payment has been initiated.",
-                'done': True
-            }
-        )
-        if not created:
-            timeline_item.updated_at = timezone.now()
-            timeline_item.save()
+        try:
+            api_response = Cashfree().PGCreateOrder(x_api_version, create_order_request, None, None)
+        except Exception as e:
+            with transaction.atomic():
+                previous_payment_status = order.payment_status
+                order.payment_status = 'terminated'
+                order.save()
+                # The order will never be paid, its coupon is free to use again
+                sync_coupon_use(order, previous_payment_status, order.status)
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            order.payment_id = api_response.data.cf_order_id
+            order.payment_session_id = api_response.data.payment_session_id
+            order.save()
+
+            update_timeline(order, "Payment Initiated", "Payment has been initiated.")
+
+            # Clear the cart
+            cart.delete()
+            cart_store.discard(user, outlet.pk)
 
         # Return the payment session id to the client to initiate payment
         return Response({
@@ -588,9 +452,6 @@ class CheckoutAPIView(APIView):
             "payment_session_id": api_response.data.payment_session_id
         }, status=status.HTTP_201_CREATED)
 
-        # except Exception as e:
-        #     return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CashfreeWebhookView(APIView):
@@ -610,61 +471,27 @@ class CashfreeWebhookView(APIView):
         transaction_status = body['data']['payment']['payment_status']
 
         order = get_object_or_404(Order, order_id=order_id)
-        stage = ""
-        content = ""
-
-        # Handle payment status
-        if transaction_status == "SUCCESS":
-            order.payment_status = 'success'
-            order.payment_method = body['data']['payment']['payment_group']
-            stage = "Payment Success"
-            content = "Payment has been completed successfully."
-        elif transaction_status == "PENDING":
-            order.payment_status = 'pending'
-            stage = "Payment Pending"
-            content = "Payment is pending."
-        else:
-            order.payment_status = 'failed'
-            stage = "Payment Failed"
-            content = "Payment has failed."
-
-        order.save()
-
-        # Create or update the OrderTimelineItem for the payment status
-        timeline_item, created = OrderTimelineItem.objects.get_or_create(
-            order=order,
-            stage=stage,
-            defaults={
-                'content': content,
-                'done': True
-            }
-        )
-        if not created:
-            timeline_item.content = content
-            timeline_item.updated_at = timezone.now()
-            timeline_item.save()
-
-        # Notify the shop owner if payment was successful
-        if transaction_status == "SUCCESS":
-            menu = Menu.objects.get(outlet=order.outlet)
-            channel_layer = get_channel_layer()
-            order_data = OrderSerializer(order).data
-
-            async_to_sync(channel_layer.group_send)(
-                f'seller_{menu.menu_slug}',
-                {
-                    'type': 'seller_notification',
-                    'message': order_data
-                }
-            )
+        payment = body['data']['payment']
 
-            # notify outlet owner
-            owner = menu.outlet.outlet_manager
-            payload = json.dumps({
-                "title": "New Order", 
-                "body": "You have received a new order.", 
-                "url": "https://seller.tacoza.co/orders"})
-            send_notification_to_user(owner, payload)
+        # Cashfree retries a delivery until it is acknowledged, a retry finds
+        # its event in the ledger and is acknowledged without doing anything
+        event_id = request.headers.get('x-idempotency-key') or ':'.join(
+            str(part) for part in (body.get('type'), order_id, payment.get('cf_payment_id'), transaction_status)
+        )
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    WebhookEvent.objects.create(
+                        event_id=event_id,
+                        order=order,
+                        event_type=body.get('type'),
+                        payment_status=transaction_status,
+                    )
+            except IntegrityError:
+                return JsonResponse({"status": "success"})
+
+            apply_payment_status(order, transaction_status, payment.get('payment_group'))
+        cache_payments(order_id, [payment], refreshed=False)
 
         return JsonResponse({"status": "success"})
 
@@ -673,12 +500,11 @@ class PaymentStatusAPIView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, order_id):
-        try:
-            api_response = Cashfree().PGOrderFetchPayments(x_api_version, order_id, None)
-            print(api_response.data)
-            return Response(api_response.data)
-        except Exception as e:
-            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        order = get_object_or_404(Order.objects.select_related('outlet'), order_id=order_id)
+        if order.user != user and order.outlet.outlet_manager != user:
+            return Response({"detail": "You are not authorized to view this order."}, status=status.HTTP_403_FORBIDDEN)
+        return Response(get_payment_status(order))
 
 
 class SettelmentStatusAPIView(APIView):
@@ -692,28 +518,23 @@ class SettelmentStatusAPIView(APIView):
         # Get orders that are at least 3 days old and payment_status is 'success'
         days_ago = current_date - timedelta(days=days)
         print(days_ago, 'days_ago')
-        successful_orders = Order.objects.filter(
+        # Online revenue per day, read from the daily rollup
+        orders_by_day = DailyOutletStats.objects.filter(
             outlet=outlet,
-            payment_status='success',
-            created_at__date__gte=days_ago,
-        ).exclude(payment_method='cash')
-        
-        print(successful_orders, 'successful_orders')
-
-        # Aggregate by day and calculate total amount
-        orders_by_day = successful_orders.values('created_at__date').annotate(total_amount=Sum('total'))
-        print(orders_by_day)
+            date__gte=days_ago,
+            online_orders__gt=0,
+        ).order_by('date').values('date', 'online_revenue')
         
         formatted_orders = [
-            {"date": str(order['created_at__date']), "totalPayment": order['total_amount']}
+            {"date": str(order['date']), "totalPayment": order['online_revenue']}
             for order in orders_by_day
         ]
         
         payouts_by_day = {}
         # Iterate over each day's orders and create/update Payout instance
         for order_group in orders_by_day:
-            payout_date = order_group['created_at__date']
-            total_amount = order_group['total_amount']
+            payout_date = order_group['date']
+            total_amount = order_group['online_revenue']
             payout = Payouts.objects.filter(date=payout_date, outlet=outlet).first()
             # Check if a Payouts entry exists for this date
             if not payout:
@@ -733,23 +554,50 @@ class SettelmentStatusAPIView(APIView):
         return Response({"orders_by_day": formatted_orders, "payouts_by_day": payouts_by_day}, status=status.HTTP_200_OK)
 
 
-# Custom pagination class
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10  # Default items per page
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
-class OrderList(ListAPIView):
-    permission_classes = [IsAuthenticated]
-    serializer_class = OrderSerializer
-    pagination_class = StandardResultsSetPagination
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    ordering_fields = ['created_at']
-
-    def get_queryset(self):
+class OrderViewMixin:
+    """
+    Serialize orders the way the query parameters ask for:
+
+    - ``view``: ``summary`` (a list row), ``kitchen`` (a kitchen ticket) or
+      ``detail`` (the full order)
+    - ``fields``: comma separated fields to keep
+    - ``expand``: comma separated fields to add, e.g. ``items`` and
+      ``timeline`` of a summary
+    """
+    default_view = 'detail'
+    order_views = {
+        'summary': (OrderSummarySerializer, load_order_summaries),
+        'kitchen': (LiveOrderSerializer, load_live_orders),
+        'detail': (OrderSerializer, load_orders),
+    }
+
+    def _list_param(self, name):
+        value = self.request.query_params.get(name, '')
+        return [part.strip() for part in value.split(',') if part.strip()]
+
+    def get_order_view(self):
+        view = self.request.query_params.get('view', self.default_view)
+        if view not in self.order_views:
+            raise ValidationError({"detail": f"Invalid view: {view}"})
+        return view
+
+    def load_orders(self, queryset):
+        view = self.get_order_view()
+        loader = self.order_views[view][1]
+        if view == 'summary':
+            return loader(queryset, self._list_param('expand'))
+        return loader(queryset)
+
+    def get_order_serializer(self, *args, **kwargs):
+        serializer_class = self.order_views[self.get_order_view()][0]
+        return serializer_class(*args, fields=self._list_param('fields'), expand=self._list_param('expand'), **kwargs)
+
+
+class OrderFilterMixin:
+    """Orders of the user, their outlet's for an owner, of the date or date range in the query parameters."""
+
+    def filter_orders(self, queryset):
         user = self.request.user
-        queryset = Order.objects.all()
 
         # Filtering based on user role
         if user.role == 'owner':
@@ -757,45 +605,129 @@ class OrderList(ListAPIView):
             queryset = queryset.filter(outlet=outlet)
         else:
             queryset = queryset.filter(user=user)
-            
-        print(queryset, 'queryset')
+
         # Date filtering
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
         specific_date = self.request.query_params.get('date')
-        
-        print(start_date, end_date, specific_date, 'dates')
-        
+
         if start_date and end_date:
             # Filter for a date range
-            queryset = queryset.filter(created_at__date__gte=start_date, created_at__date__lte=end_date)
+            start, end = day_range(self._parse_date(start_date), self._parse_date(end_date))
+            queryset = queryset.filter(created_at__gte=start, created_at__lt=end)
         elif specific_date:
             # Filter for a specific date
-            queryset = queryset.filter(created_at__date=parse_date(specific_date))
-        
-        
-        print(queryset, 'queryset')
+            start, end = day_range(self._parse_date(specific_date))
+            queryset = queryset.filter(created_at__gte=start, created_at__lt=end)
+        return queryset
+
+    def _parse_date(self, value):
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError({"detail": f"Invalid date: {value}"})
+        return date
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Pages of orders, newest first, that do not count the orders.
+
+    This is not a keyset over (created_at, order_id): DRF's cursor holds a
+    created_at and an offset among the orders of that exact timestamp, and
+    order_id only breaks ties within a page. Orders sharing a timestamp
+    across a page boundary are paged by offset, so one created or deleted
+    meanwhile may shift them, showing one twice or not at all.
+    """
+    page_size = 10  # Default items per page
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-order_id')
+
+
+class OrderList(OrderViewMixin, OrderFilterMixin, ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        return self.filter_orders(self.load_orders(Order.objects.all()))
+
+    def get_serializer(self, *args, **kwargs):
+        return self.get_order_serializer(*args, **kwargs)
+
+
+class Echo:
+    """File-like object handing back what is written to it, to stream a csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+class OrderExportView(OrderFilterMixin, APIView):
+    """Stream the orders of a date range as CSV or NDJSON, without loading them all at once."""
+    permission_classes = [IsAuthenticated]
+    # Header of each column along with the field it is read from
+    columns = [
+        ('order_id', 'order_id'),
+        ('created_at', 'created_at'),
+        ('status', 'status'),
+        ('payment_status', 'payment_status'),
+        ('payment_method', 'payment_method'),
+        ('order_type', 'order_type'),
+        ('table', 'table__name'),
+        ('customer', 'user__name'),
+        ('phone', 'user__phone_number'),
+        ('total', 'total'),
+    ]
+
+    def get(self, request, export_format):
+        if export_format not in ('csv', 'ndjson'):
+            return Response({"detail": "Invalid format."}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.query_params.get('date') and not (
+                request.query_params.get('start_date') and request.query_params.get('end_date')):
+            return Response({"detail": "A date or a start_date and end_date are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        headers = [header for header, field in self.columns]
+        rows = self.filter_orders(Order.objects.all()).order_by('created_at').values_list(
+            *[field for header, field in self.columns])
+        rows = rows.iterator(chunk_size=2000)
+        if export_format == 'csv':
+            writer = csv.writer(Echo())
+            lines = itertools.chain(
+                [writer.writerow(headers)],
+                (writer.writerow(row) for row in rows),
+            )
+            content_type = 'text/csv'
+        else:
+            lines = (
+                json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+                for row in rows
+            )
+            content_type = 'application/x-ndjson'
 
-        return queryset 
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
 
 
-class OrderDetailAPIView(APIView):
+class OrderDetailAPIView(OrderViewMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, order_id):
         user = request.user
-        order = get_object_or_404(Order, order_id=order_id)
-        try:
-            api_response = Cashfree().PGOrderFetchPayments(x_api_version, order_id, None)
-            print(api_response.data)
-        except:
-            print("Something Wrong")
+        order = get_object_or_404(self.load_orders(Order.objects.all()), order_id=order_id)
 
         if user.role == 'owner' and order.outlet.outlet_manager != user:
             return Response({"detail": "You are not authorized to view this order."}, status=status.HTTP_403_FORBIDDEN)
         elif user.role == 'customer' and order.user != user:
             return Response({"detail": "You are not authorized to view this order."}, status=status.HTTP_403_FORBIDDEN)
-        serializer = OrderSerializer(order)
+        # Refreshes the payment status of an order awaiting its payment in the background
+        get_payment_status(order)
+        serializer = self.get_order_serializer(order)
         return Response(serializer.data)
 
     # to update payment status
@@ -810,22 +742,24 @@ class OrderDetailAPIView(APIView):
         if payment_status not in ['success', 'pending', 'cancelled']:
             return Response({"detail": "Invalid status."}, status=status.HTTP_400_BAD_REQUEST)
 
+        previous_payment_status, previous_status = order.payment_status, order.status
         if payment_status == 'cancelled':
-            order.status = 'cancelled'
-            order.save()
-
-            # Create or update the OrderTimelineItem for "Order Cancelled"
-            timeline_item, created = OrderTimelineItem.objects.get_or_create(
-                order=order,
-                stage="Order Cancelled",
-                defaults={
-                    'content': "Order has been cancelled.",
-                    'done': True
-                }
-            )
-            if not created:
-                timeline_item.updated_at = timezone.now()
-                timeline_item.save()
+            if previous_status == 'cancelled':
+                return Response({"message": "Order cancelled successfully."}, status=status.HTTP_200_OK)
+            with transaction.atomic():
+                # UPDATE ... WHERE status = <as read>, so the order gives its coupon's use back once
+                order.status = 'cancelled'
+                order.updated_at = timezone.now()
+                if not Order.objects.filter(pk=order.pk, status=previous_status).update(
+                        status=order.status, updated_at=order.updated_at):
+                    return Response({"detail": "Order was updated meanwhile, try again."},
+                                    status=status.HTTP_409_CONFLICT)
+                record_order_transition(order, previous_payment_status, previous_status)
+                sync_coupon_use(order, previous_payment_status, previous_status)
+                invalidate_dashboard(order.outlet)
+                publish_order_event(order, 'status')
+
+                update_timeline(order, "Order Cancelled", "Order has been cancelled.")
 
             # Notify the user
             payload = json.dumps({
@@ -836,22 +770,24 @@ class OrderDetailAPIView(APIView):
             send_notification_to_user(order.user, payload)
             return Response({"message": "Order cancelled successfully."}, status=status.HTTP_200_OK)
 
-        order.payment_status = payment_status
-        order.save()
-
-        if payment_status == 'success':
-            # Create or update the OrderTimelineItem for "Payment Success"
-            timeline_item, created = OrderTimelineItem.objects.get_or_create(
-                order=order,
-                stage="Payment Success",
-                defaults={
-                    'content': "Payment recived.",
-                    'done': True
-                }
-            )
-            if not created:
-                timeline_item.updated_at = timezone.now()
-                timeline_item.save()
+        if previous_payment_status == payment_status:
+            return Response({"message": "Payment status updated successfully."}, status=status.HTTP_200_OK)
+        with transaction.atomic():
+            # UPDATE ... WHERE <statuses as read>, so a webhook settling the order meanwhile is not written over
+            order.payment_status = payment_status
+            order.updated_at = timezone.now()
+            if not Order.objects.filter(pk=order.pk, payment_status=previous_payment_status,
+                                        status=previous_status).update(
+                    payment_status=order.payment_status, updated_at=order.updated_at):
+                return Response({"detail": "Order was updated meanwhile, try again."},
+                                status=status.HTTP_409_CONFLICT)
+            record_order_transition(order, previous_payment_status, previous_status)
+            sync_coupon_use(order, previous_payment_status, previous_status)
+            invalidate_dashboard(order.outlet)
+            publish_order_event(order, 'payment')
+
+            if payment_status == 'success':
+                update_timeline(order, "Payment Success", "Payment recived.")
         return Response({"message": "Payment status updated successfully."}, status=status.HTTP_200_OK)
 
 
@@ -862,36 +798,7 @@ class LiveOrders(APIView):
         user = request.user
         outlet = Outlet.objects.filter(outlet_manager=user).first()
 
-        # return all orders of current date categorized by status, with payment_status 'success' or payment_method 'cash'
-        orders = Order.objects.filter(
-            outlet=outlet,
-            created_at__date=datetime.datetime.now().date(),
-            payment_status='success'  # Payment status condition
-        ).order_by('-created_at') | Order.objects.filter(
-            outlet=outlet,
-            created_at__date=datetime.datetime.now().date(),
-            payment_method='cash'  # Payment method condition
-        ).order_by('-created_at') | Order.objects.filter(
-            outlet=outlet,
-            created_at__date=datetime.datetime.now().date(),
-            outlet__outlet_type='lite'
-        ).order_by('-created_at')
-
-        serializer = OrderSerializer(orders, many=True)
-        live_orders = {
-            "new": [],
-            "preparing": [],
-            "completed": []
-        }
-
-        for order in serializer.data:
-            if order['status'] == 'pending':
-                live_orders['new'].append(order)
-            elif order['status'] == 'processing':
-                live_orders['preparing'].append(order)
-            elif order['status'] == 'completed':
-                live_orders['completed'].append(order)
-
+        live_orders = get_live_board(outlet)
         return Response(live_orders, status=status.HTTP_200_OK)
 
 
@@ -913,10 +820,21 @@ class LiveOrders(APIView):
             return Response({"detail": "Invalid status."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Update the order status and timestamps
+        previous_status = order.status
         order.status = new_status
         order.updated_at = timezone.now()
         
-        order.save()
+        with transaction.atomic():
+            # UPDATE ... WHERE <statuses as read>, the rollups and coupon move from the order as it was
+            if not Order.objects.filter(pk=order.pk, payment_status=order.payment_status,
+                                        status=previous_status).update(
+                    status=order.status, updated_at=order.updated_at):
+                return Response({"detail": "Order was updated meanwhile, try again."},
+                                status=status.HTTP_409_CONFLICT)
+            record_order_transition(order, order.payment_status, previous_status)
+            sync_coupon_use(order, order.payment_status, previous_status)
+            invalidate_dashboard(order.outlet)
+            publish_order_event(order, 'status')
 
         # Define the corresponding stage and content
         stage = status_map[new_status]
@@ -926,21 +844,7 @@ class LiveOrders(APIView):
             'pending': "Order has been placed successfully."
         }[new_status]
 
-        # Check if an OrderTimelineItem with the same stage already exists
-        timeline_item, created = OrderTimelineItem.objects.get_or_create(
-            order=order,
-            stage=stage,
-            defaults={
-                'content': content,
-                'done': True
-            }
-        )
-
-        # If the timeline item already exists, update its timestamp and content if needed
-        if not created:
-            timeline_item.content = content
-            timeline_item.updated_at = timezone.now()
-            timeline_item.save()
+        update_timeline(order, stage, content)
 
         # Prepare the notification payload
         payload = json.dumps({
@@ -959,6 +863,7 @@ class LiveOrders(APIView):
 class OutleDetailView(APIView):
     permission_classes = []
 
+    @conditional_get(outlet_scope, outlet_last_modified)
     def get(self, request, menu_slug):
         menu = get_object_or_404(Menu, menu_slug=menu_slug)
         outlet = menu.outlet
@@ -1023,6 +928,7 @@ class OutletDetailView(APIView):
 class TableListView(APIView):
     permission_classes = []
 
+    @conditional_get(tables_scope, tables_last_modified)
     def get(self, request, menu_slug):
         menu = get_object_or_404(Menu, menu_slug=menu_slug)
         tables = Table.objects.filter(outlet=menu.outlet)
@@ -1154,31 +1060,17 @@ class DiscountCouponListCreateView(APIView):
 
 
 class ApplicableOffersAPIView(APIView):
+    permission_classes = [IsAuthenticated]
 
-    def get(self, request):
+    def get(self, request, menu_slug):
         user = request.user
-        cart = Cart.objects.get(user=user)  # Assuming a user can only have one active cart
-
-        print(timezone.now().date())
-        print(DiscountCoupon.objects.first().valid_from)
-        # Get all active discount coupons that haven't expired and haven't reached their use limit.
-        coupons = DiscountCoupon.objects.filter(
-            valid_from__gte=timezone.now().date(),
-            valid_to__lte=timezone.now().date()
-        )
-
-        print(coupons)
-
-        # Create the serializer with context data
-        # serializer = DiscountCouponSerializer(coupons, many=True, context={'user': user, 'cart': cart})
-        # serialized_data = serializer.data
+        outlet_id = get_menu_outlet_id(menu_slug)
 
-        # # Filter to find the best offer based on applicability and discount value
-        # applicable_offers = [offer for offer in serialized_data if offer['is_applicable']]
-        # best_offer = max(applicable_offers, key=lambda x: x['discount_value'], default=None)
-
-        # return Response({
-        #     'offers': serialized_data,
-        #     'best_offer': best_offer
-        # })
-        return Response({"offers": [], "best_offer": None})
+        # The cart is priced once, the outlet's coupons are evaluated against it in memory
+        cart_price = price_cart(menu_slug, get_cart_store().lines(user, outlet_id))
+        offers = get_offers(user, outlet_id, cart_price)
+        best = best_offer(offers)
+        return Response({
+            'offers': DiscountCouponSerializer(offers, many=True).data,
+            'best_offer': DiscountCouponSerializer(best).data if best else None,
+        })
@@ -0,0 +1,420 @@
+"""
+Carts of the customers, by outlet.
+
+A cart is a list of lines, each a plain dict of ids::
+
+    {'id': ..., 'item_id': ..., 'food_item': ..., 'variant': ..., 'addons': [...], 'quantity': ...}
+
+and is kept by the store named by the CART_BACKEND setting:
+
+- DatabaseCartStore (the default) keeps carts in the Cart and CartItem tables.
+- RedisCartStore keeps the cart being filled in a Redis hash, one field per
+  line, so adding to it does not write to the database. It is written to the
+  Cart and CartItem tables at checkout, see persist(), and once it has been
+  left alone for CART_FLUSH_AFTER, see the flush_carts management command.
+
+Lines are priced from the price table of the menu (see shop.pricing) and
+described from the menu snapshot instead of being serialized from the
+database, see compact_cart() for the compact representation of a cart and
+render_cart() for the CartItemSerializer one.
+"""
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from shop.models import Addon, Cart, CartItem, FoodItem, ItemVariant, Menu
+from shop.api.serializers import AddonSerializer, FoodItemSerializer
+from shop.loaders import load_food_items
+from shop.pricing import available_lines, price_cart
+from shop.snapshot import get_menu_snapshot
+from shop.versions import get_menu_version
+
+# Idle carts are written to the database and dropped from Redis after CART_FLUSH_AFTER,
+# CART_TIMEOUT leaves flush_carts plenty of time to get to them before Redis expires them
+CART_TIMEOUT = 7 * 24 * 60 * 60  # 7 days in seconds
+CART_FLUSH_AFTER = 24 * 60 * 60  # 24 hours in seconds
+MENU_OUTLET_TIMEOUT = 60 * 60  # 1 hour in seconds
+
+# Hash field marking a cart as loaded in Redis, even when it has no lines
+LOADED_FIELD = '@'
+
+
+def get_menu_outlet_id(menu_slug):
+    """Return the id of the outlet of a menu, raising Http404 for an unknown menu."""
+    cache_key = f"menu_outlet_{menu_slug}"
+    outlet_id = cache.get(cache_key)
+    if outlet_id is None:
+        outlet_id = get_object_or_404(Menu, menu_slug=menu_slug).outlet_id
+        cache.set(cache_key, outlet_id, MENU_OUTLET_TIMEOUT)
+    return outlet_id
+
+
+def _get_cart(user, outlet_id):
+    try:
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user, outlet_id=outlet_id)
+    except IntegrityError:
+        # Created concurrently by another request of the same customer
+        cart = Cart.objects.get(user=user, outlet_id=outlet_id)
+    return cart
+
+
+def _database_lines(user_id, outlet_id):
+    # In the order of CartItem
+    items = list(CartItem.objects.filter(cart__user_id=user_id, cart__outlet_id=outlet_id).values(
+        'id', 'item_id', 'food_item_id', 'variant_id', 'quantity'))
+    addons = {}
+    for cart_item_id, addon_id in CartItem.addons.through.objects.filter(
+            cartitem_id__in=[item['id'] for item in items]).values_list('cartitem_id', 'addon_id'):
+        addons.setdefault(cart_item_id, []).append(addon_id)
+    return [{
+        'id': item['id'],
+        'item_id': item['item_id'],
+        'food_item': item['food_item_id'],
+        'variant': item['variant_id'],
+        'addons': addons.get(item['id'], []),
+        'quantity': item['quantity'],
+    } for item in items]
+
+
+class DatabaseCartStore:
+    """Keep carts in the Cart and CartItem tables."""
+
+    def lines(self, user, outlet_id):
+        return _database_lines(user.pk, outlet_id)
+
+    def add(self, user, outlet_id, item_id, food_item_id, variant_id, addon_ids, quantity):
+        cart = _get_cart(user, outlet_id)
+        cart_item, item_created = CartItem.objects.get_or_create(
+            item_id=item_id, cart=cart, food_item_id=food_item_id, variant_id=variant_id,
+            defaults={'quantity': quantity}
+        )
+        if not item_created:
+            cart_item.quantity += quantity
+            cart_item.save()
+        cart_item.addons.set(addon_ids)
+
+    def set_quantity(self, user, outlet_id, item_id, quantity):
+        cart = get_object_or_404(Cart, user=user, outlet_id=outlet_id)
+        cart_item = get_object_or_404(CartItem, item_id=item_id, cart=cart)
+        if quantity <= 0:
+            cart_item.delete()
+        else:
+            cart_item.quantity = quantity
+            cart_item.save()
+
+    def remove(self, user, outlet_id, item_id):
+        cart = get_object_or_404(Cart, user=user, outlet_id=outlet_id)
+        get_object_or_404(CartItem, item_id=item_id, cart=cart).delete()
+
+    def persist(self, user, outlet_id):
+        """The cart is in the database already."""
+
+    def discard(self, user, outlet_id):
+        """The cart is deleted from the database by checkout."""
+
+
+class RedisCartStore:
+    """Keep the carts being filled in Redis hashes."""
+
+    def __init__(self):
+        self._redis = get_redis_connection('default')
+
+    def _key(self, user_id, outlet_id):
+        return f"shop:cart:{user_id}:{outlet_id}"
+
+    def _load(self, user_id, outlet_id):
+        # Fields of the cart's hash, loaded from the database if it is not in Redis
+        key = self._key(user_id, outlet_id)
+        fields = self._redis.hgetall(key)
+        if fields:
+            return fields
+        fields = {LOADED_FIELD: '1'}
+        for line in _database_lines(user_id, outlet_id):
+            fields[line['item_id']] = json.dumps(line)
+        with self._redis.pipeline() as pipe:
+            pipe.hsetnx(key, LOADED_FIELD, '1')
+            pipe.expire(key, CART_TIMEOUT)
+            created, _ = pipe.execute()
+        if created:
+            self._redis.hset(key, mapping=fields)
+            return fields
+        # Loaded concurrently by another request of the same customer
+        return self._redis.hgetall(key)
+
+    def _lines(self, fields):
+        # In the order they were added to the cart
+        return sorted(
+            (json.loads(value) for field, value in fields.items()
+             if (field.decode() if isinstance(field, bytes) else field) != LOADED_FIELD),
+            key=lambda line: line['id'],
+        )
+
+    def lines(self, user, outlet_id):
+        return self._lines(self._load(user.pk, outlet_id))
+
+    def _update(self, user, outlet_id, item_id, update):
+        # Read-modify-write of a line, retried if the cart changed in between
+        self._load(user.pk, outlet_id)
+        key = self._key(user.pk, outlet_id)
+
+        def change(pipe):
+            value = pipe.hget(key, item_id)
+            line = update(json.loads(value) if value else None)
+            pipe.multi()
+            if line is None:
+                pipe.hdel(key, item_id)
+            else:
+                pipe.hset(key, item_id, json.dumps(line))
+            pipe.expire(key, CART_TIMEOUT)
+
+        self._redis.transaction(change, key)
+
+    def add(self, user, outlet_id, item_id, food_item_id, variant_id, addon_ids, quantity):
+        def add_line(line):
+            if line is None:
+                line = {'id': self._redis.incr('shop:cart_line_seq'), 'item_id': item_id, 'quantity': 0}
+            line.update(food_item=food_item_id, variant=variant_id, addons=list(addon_ids),
+                        quantity=line['quantity'] + quantity)
+            return line
+        self._update(user, outlet_id, item_id, add_line)
+
+    def set_quantity(self, user, outlet_id, item_id, quantity):
+        def set_line_quantity(line):
+            if line is None:
+                raise Http404
+            if quantity <= 0:
+                return None
+            return dict(line, quantity=quantity)
+        self._update(user, outlet_id, item_id, set_line_quantity)
+
+    def remove(self, user, outlet_id, item_id):
+        self._load(user.pk, outlet_id)
+        if not self._redis.hdel(self._key(user.pk, outlet_id), item_id):
+            raise Http404
+
+    def persist(self, user, outlet_id):
+        """Write the cart to the Cart and CartItem tables, replacing what they held."""
+        write_cart(user.pk, outlet_id, self.lines(user, outlet_id))
+
+    def discard(self, user, outlet_id):
+        """Drop the cart from Redis once the current transaction commits."""
+        key = self._key(user.pk, outlet_id)
+        transaction.on_commit(lambda: self._redis.delete(key))
+
+    def flush_idle(self, idle=CART_FLUSH_AFTER):
+        """Write the carts left alone for ``idle`` seconds to the database and drop them from Redis."""
+        flushed = 0
+        for key in self._redis.scan_iter(match='shop:cart:*', count=500):
+            if self._redis.ttl(key) > CART_TIMEOUT - idle:
+                continue
+            user_id, outlet_id = key.decode().rsplit(':', 2)[1:]
+
+            def flush(pipe):
+                lines = self._lines(pipe.hgetall(key))
+                write_cart(user_id, int(outlet_id), lines)
+                pipe.multi()
+                pipe.delete(key)
+
+            # Retried should the customer come back to the cart meanwhile
+            self._redis.transaction(flush, key)
+            flushed += 1
+        return flushed
+
+
+def _existing_lines(lines):
+    # The lines whose food item and variant still exist, with the addons that still do
+    food_items = set(FoodItem.objects.filter(
+        id__in={line['food_item'] for line in lines}).values_list('id', flat=True))
+    variants = set(ItemVariant.objects.filter(
+        id__in={line['variant'] for line in lines if line['variant']}).values_list('id', flat=True))
+    addons = set(Addon.objects.filter(
+        id__in={addon_id for line in lines for addon_id in line['addons']}).values_list('id', flat=True))
+    return [
+        dict(line, addons=[addon_id for addon_id in line['addons'] if addon_id in addons])
+        for line in lines
+        if line['food_item'] in food_items and (not line['variant'] or line['variant'] in variants)
+    ]
+
+
+def write_cart(user_id, outlet_id, lines):
+    """
+    Replace the items of the customer's Cart with the given lines, leaving
+    out what was deleted from the menu since it was added to the cart.
+    """
+    lines = _existing_lines(lines)
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user_id=user_id, outlet_id=outlet_id)
+        if not created:
+            cart.items.all().delete()
+        cart_items = CartItem.objects.bulk_create([
+            CartItem(
+                cart=cart,
+                item_id=line['item_id'],
+                food_item_id=line['food_item'],
+                variant_id=line['variant'],
+                quantity=line['quantity'],
+            )
+            for line in lines
+        ])
+        CartItem.addons.through.objects.bulk_create([
+            CartItem.addons.through(cartitem_id=cart_item.pk, addon_id=addon_id)
+            for cart_item, line in zip(cart_items, lines)
+            for addon_id in line['addons']
+        ])
+    return cart
+
+
+def get_cart_store():
+    """Return an instance of the configured cart store."""
+    return import_string(getattr(settings, 'CART_BACKEND', 'shop.carts.DatabaseCartStore'))()
+
+
+# Food items of the menu snapshots parsed lately, by menu and version
+_food_item_indexes = {}
+MAX_FOOD_ITEM_INDEXES = 32
+
+
+def get_food_item_index(menu_slug):
+    """Return the serialized food items of the menu's snapshot, by id."""
+    key = (menu_slug, get_menu_version(menu_slug))
+    index = _food_item_indexes.get(key)
+    if index is None:
+        version, blob = get_menu_snapshot(menu_slug, lambda: get_object_or_404(Menu, menu_slug=menu_slug))
+        index = {}
+        for category in json.loads(blob):
+            for food_item in category['food_items']:
+                index[food_item['id']] = food_item
+            for sub_category in category['sub_categories']:
+                for food_item in sub_category['food_items']:
+                    index[food_item['id']] = food_item
+        if len(_food_item_indexes) >= MAX_FOOD_ITEM_INDEXES:
+            _food_item_indexes.clear()
+        _food_item_indexes[key] = index
+    return index
+
+
+def resolve_line(menu_slug, food_item_id, variant_id, addon_ids):
+    """
+    Check the food item and variant of a new line exist and keep the addons
+    that do, from the menu snapshot as far as it knows them. Raises Http404
+    for a missing food item or variant, returns the addon ids kept.
+    """
+    food_item = get_food_item_index(menu_slug).get(food_item_id)
+    if food_item is None:
+        get_object_or_404(FoodItem, id=food_item_id)
+        if variant_id:
+            get_object_or_404(ItemVariant, id=variant_id)
+        return list(Addon.objects.filter(id__in=addon_ids).values_list('id', flat=True))
+
+    if variant_id and not any(variant['id'] == variant_id for variant in food_item['item_variants']):
+        get_object_or_404(ItemVariant, id=variant_id)
+    known_addons = {addon['id'] for addon in food_item['addons'] or []}
+    unknown_addons = [addon_id for addon_id in addon_ids if addon_id not in known_addons]
+    if unknown_addons:
+        known_addons.update(Addon.objects.filter(id__in=unknown_addons).values_list('id', flat=True))
+    return [addon_id for addon_id in addon_ids if addon_id in known_addons]
+
+
+def _describe_lines(menu_slug, lines):
+    # (line, food item, variant, addons) of each line, read from the menu snapshot
+    index = get_food_item_index(menu_slug)
+
+    # Food items and addons the snapshot does not have, e.g. from another menu
+    missing_food_items = {line['food_item'] for line in lines} - set(index)
+    if missing_food_items:
+        food_items = load_food_items(FoodItem.objects.filter(id__in=missing_food_items))
+        index = {**index, **{
+            food_item['id']: food_item for food_item in FoodItemSerializer(food_items, many=True).data
+        }}
+    addons = {}
+    for food_item_id in {line['food_item'] for line in lines}:
+        for addon in index[food_item_id]['addons'] or []:
+            addons[addon['id']] = addon
+    missing_addons = {addon_id for line in lines for addon_id in line['addons']} - set(addons)
+    if missing_addons:
+        for addon in AddonSerializer(Addon.objects.filter(id__in=missing_addons).prefetch_related('item_variant'),
+                                     many=True).data:
+            addons[addon['id']] = addon
+
+    described = []
+    for line in lines:
+        food_item = index[line['food_item']]
+        variant = None
+        if line['variant']:
+            item_variant = next(
+                (item_variant for item_variant in food_item['item_variants'] if item_variant['id'] == line['variant']),
+                None,
+            )
+            if item_variant is None:
+                item_variant = ItemVariant.objects.prefetch_related('variant').get(pk=line['variant'])
+                item_variant = {
+                    'name': '-'.join([str(variant.name) for variant in item_variant.variant.all()]),
+                    'price': item_variant.price,
+                }
+            variant = {"name": item_variant['name'], "price": float(item_variant['price'])}
+        # Addons by id, like the unordered cart_item.addons.all() reads them
+        line_addons = sorted(
+            (addons[addon_id] for addon_id in line['addons'] if addon_id in addons),
+            key=lambda addon: addon['id'],
+        )
+        described.append((line, food_item, variant, line_addons))
+    return described
+
+
+def render_cart(menu_slug, lines):
+    """Return the CartItemSerializer representation of the lines, read from the menu snapshot."""
+    lines = available_lines(menu_slug, lines)
+    priced = price_cart(menu_slug, lines)
+    return [{
+        'id': line['id'],
+        'item_id': line['item_id'],
+        'food_item': food_item,
+        'variant': variant,
+        'quantity': line['quantity'],
+        'addons': line_addons,
+        'totalPrice': priced_line['total'],
+    } for (line, food_item, variant, line_addons), priced_line in zip(_describe_lines(menu_slug, lines),
+                                                                       priced['lines'])]
+
+
+def _compact_line(line, priced_line):
+    return {
+        'item_id': line['item_id'],
+        'food_item': line['food_item'],
+        'variant': line['variant'],
+        'addons': sorted(line['addons']),
+        'quantity': line['quantity'],
+        'price': float(priced_line['price']),
+        'total': float(priced_line['total']),
+    }
+
+
+def compact_cart(menu_slug, lines, item_id=None):
+    """
+    Return the compact representation of the cart: its lines as ids with
+    their prices, and the cart totals.
+
+    Given the ``item_id`` of a line that just changed, only that line is
+    returned along with the totals, None for a line that was removed.
+    """
+    lines = available_lines(menu_slug, lines)
+    priced = price_cart(menu_slug, lines)
+    cart = {
+        'total': float(priced['total']),
+        'count': sum(line['quantity'] for line in lines),
+    }
+    if item_id is None:
+        cart['items'] = [_compact_line(line, priced_line) for line, priced_line in zip(lines, priced['lines'])]
+    else:
+        cart['item_id'] = item_id
+        cart['item'] = next(
+            (_compact_line(line, priced_line) for line, priced_line in zip(lines, priced['lines'])
+             if line['item_id'] == item_id),
+            None,
+        )
+    return cart
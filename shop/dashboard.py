@@ -0,0 +1,97 @@
+from datetime import timedelta
+from django.db.models import Count, Sum, Q
+from django.utils import timezone
+from project.versioning import get_version, invalidate_scopes
+from shop.models import Order, DailyOutletStats
+
+# The cache key changes with the date and on every order change, the
+# timeout only has to reclaim entries nobody reads anymore
+DASHBOARD_TIMEOUT = 24 * 60 * 60  # 24 hours in seconds
+
+
+def dashboard_scope(user_id):
+    """Return the version scope of an owner's dashboard."""
+    return f"dashboard_{user_id}"
+
+
+def dashboard_cache_key(user):
+    """Return the cache key of the current version of an owner's dashboard."""
+    today = timezone.now().date()
+    return f"dashboard_data_{user.id}_{today}_{get_version(dashboard_scope(user.id))}"
+
+
+def invalidate_dashboard(outlet):
+    """Make the cached dashboard of the outlet's owner stale once the current transaction commits."""
+    invalidate_scopes([dashboard_scope(outlet.outlet_manager_id)])
+
+
+def get_dashboard_data(outlets):
+    """
+    Compute the owner dashboard of the given outlets.
+
+    Orders and revenue are read from the DailyOutletStats rollup, so only
+    the per-customer order counts still go over the outlets' orders. The
+    whole dashboard takes three grouped passes.
+    """
+    today = timezone.now().date()
+    start_of_today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_of_last_week = today - timedelta(days=7)
+    start_of_week_before_last = start_of_last_week - timedelta(days=7)
+    start_of_month = today.replace(day=1)
+
+    # Orders and revenue come from the daily rollup, a row per outlet and day
+    stats = DailyOutletStats.objects.filter(outlet__in=outlets, orders__gt=0).order_by()
+
+    totals = stats.aggregate(
+        todays_revenue=Sum('revenue', filter=Q(date=today)),
+        total_orders_last_week=Sum('orders', filter=Q(
+            date__gte=start_of_week_before_last,
+            date__lt=start_of_last_week,
+        )),
+        total_orders_this_month=Sum('orders', filter=Q(date__month=today.month, date__year=today.year)),
+        total_revenue=Sum('revenue'),
+        total_days=Count('date', distinct=True),
+    )
+    total_revenue = totals['total_revenue'] or 0
+    total_days = totals['total_days']
+    average_revenue = total_revenue / total_days if total_days else 0
+
+    # First seven days with paid orders, both graphs share the same grouping
+    daily = (
+        stats.values('date')
+        .annotate(orderCount=Sum('orders'), dailyRevenue=Sum('revenue'))
+        .order_by('date')
+    )[:7]
+    orders_graph = []
+    revenue_graph = []
+    for day in daily:
+        date = day['date'].strftime('%Y-%m-%d')
+        orders_graph.append({'date': date, 'orderCount': day['orderCount']})
+        revenue_graph.append({'date': date, 'revenue': float(day['dailyRevenue'])})
+
+    # Customers with exactly one order this month, customers who ordered before
+    # this month, and all of today's orders whatever their state
+    customers = Order.objects.filter(outlet__in=outlets).order_by().values('user').annotate(
+        orders_this_month=Count('pk', filter=Q(created_at__gte=start_of_month)),
+        previous_orders=Count('pk', filter=Q(created_at__lt=start_of_month)),
+        orders_today=Count('pk', filter=Q(created_at__gte=start_of_today)),
+    ).aggregate(
+        new_users=Count('user', filter=Q(orders_this_month=1)),
+        active_users=Count('user', filter=Q(previous_orders__gt=0)),
+        todays_orders=Sum('orders_today'),
+    )
+
+    return {
+        # graph
+        'orders': orders_graph,
+        'revenue': revenue_graph,
+        # stats
+        'total_revenue': total_revenue,
+        'new_users_this_month': customers['new_users'],
+        'active_users_this_month': customers['active_users'],
+        'total_orders_this_month': totals['total_orders_this_month'] or 0,
+        'todaysRevenue': round(float(totals['todays_revenue'] or 0), 2),
+        'totalOrdersLastWeek': totals['total_orders_last_week'] or 0,
+        'averageRevenue': round(float(average_revenue), 2),
+        'todaysOrders': customers['todays_orders'] or 0,
+    }
@@ -0,0 +1,194 @@
+"""
+Live order board of an outlet, polled from LiveOrders and pushed over the
+seller WebSocket (see SellerConsumer).
+
+Every change to an order on the board is published as a compact event
+numbered with a per-menu sequence. Events are also kept in the cache for a
+while, so a board reconnecting with the last sequence number it has seen
+gets the events it missed replayed, and a full snapshot otherwise.
+"""
+import datetime
+import json
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db.models import Q
+from project.versioning import get_version, bump_version
+from shop.models import Menu, Outlet, Order
+from project.utils import send_notification_to_user
+from shop.api.serializers import LiveOrderSerializer, OrderSerializer
+from shop.loaders import load_live_orders, load_orders
+from shop.outbox import enqueue
+from shop.tracking import send_order_update
+from shop.utils import day_range
+
+# Order status to the column of the live board it is shown in
+LIVE_ORDER_BUCKETS = {
+    'pending': 'new',
+    'processing': 'preparing',
+    'completed': 'completed',
+}
+
+LIVE_EVENT_TIMEOUT = 6 * 60 * 60  # 6 hours in seconds
+# A board further behind than this is sent a snapshot instead of the events it missed
+MAX_REPLAY_EVENTS = 200
+
+
+def _seq_scope(menu_slug):
+    return f"live_{menu_slug}"
+
+
+def _event_key(menu_slug, seq):
+    return f"live_event_{menu_slug}_{seq}"
+
+
+def _takes_unpaid_orders(outlet):
+    # Lite outlets take payment at the counter, their orders go on the board unpaid
+    return outlet.outlet_type == 'lite'
+
+
+def _is_visible(order):
+    # Whatever its status, whether the order is one the board shows
+    start, end = day_range(datetime.datetime.now().date())
+    return start <= order.created_at < end and (
+        _takes_unpaid_orders(order.outlet) or order.payment_status == 'success' or order.payment_method == 'cash'
+    )
+
+
+def is_live(order):
+    """Return whether the order is shown on its outlet's live board."""
+    return order.status in LIVE_ORDER_BUCKETS and _is_visible(order)
+
+
+def get_live_board(outlet):
+    """Return today's orders of the outlet shown on the live board, by column."""
+    live_orders = {bucket: [] for bucket in LIVE_ORDER_BUCKETS.values()}
+    if outlet is None:
+        return live_orders
+
+    # Today's orders in a single query, only the paid or cash ones unless the outlet is a lite one
+    start, end = day_range(datetime.datetime.now().date())
+    orders = Order.objects.filter(
+        outlet=outlet,
+        created_at__gte=start,
+        created_at__lt=end,
+        status__in=LIVE_ORDER_BUCKETS,
+    ).order_by('-created_at')
+    if not _takes_unpaid_orders(outlet):
+        orders = orders.filter(Q(payment_status='success') | Q(payment_method='cash'))
+
+    for order in LiveOrderSerializer(load_live_orders(orders), many=True).data:
+        live_orders[LIVE_ORDER_BUCKETS[order['status']]].append(order)
+    return live_orders
+
+
+def can_watch_board(user, menu_slug):
+    """Return whether the user may watch the menu's live board, its outlet's manager."""
+    if not user.is_authenticated:
+        return False
+    return Menu.objects.filter(menu_slug=menu_slug, outlet__outlet_manager=user).exists()
+
+
+def get_live_snapshot(menu_slug):
+    """Return the current sequence number of the menu's board along with the board itself."""
+    seq = get_version(_seq_scope(menu_slug))
+    return seq, get_live_board(Outlet.objects.filter(menu__menu_slug=menu_slug).first())
+
+
+def get_live_events(menu_slug, last_seq):
+    """
+    Return the events of the menu's board published after last_seq.
+
+    Returns None when they cannot all be replayed, the board then needs a
+    snapshot instead.
+    """
+    if last_seq is None:
+        return None
+    seq = get_version(_seq_scope(menu_slug))
+    if last_seq > seq or seq - last_seq > MAX_REPLAY_EVENTS:
+        return None
+    keys = [_event_key(menu_slug, n) for n in range(last_seq + 1, seq + 1)]
+    events = cache.get_many(keys)
+    if len(events) != len(keys):
+        return None
+    return [events[key] for key in keys]
+
+
+def _order_event(order, event):
+    if event == 'created' or (event == 'payment' and order.payment_status == 'success'
+                              and order.payment_method != 'cash' and not _takes_unpaid_orders(order.outlet)):
+        # The order shows up on the board for the first time
+        order = load_live_orders(Order.objects.filter(pk=order.pk)).get()
+        return {'type': 'order_created', 'order': LiveOrderSerializer(order).data}
+    if event == 'status':
+        return {
+            'type': 'order_status',
+            'order_id': order.order_id,
+            'status': order.status,
+            'updated_at': order.updated_at.isoformat(),
+        }
+    return {
+        'type': 'order_payment',
+        'order_id': order.order_id,
+        'payment_status': order.payment_status,
+        'payment_method': order.payment_method,
+    }
+
+
+def _publish(order, event):
+    # Status changes are sent for orders leaving the board too, e.g. when cancelled
+    if not _is_visible(order) or (event != 'status' and not is_live(order)):
+        return
+    message = _order_event(order, event)
+    channel_layer = get_channel_layer()
+    for menu_slug in Menu.objects.filter(outlet_id=order.outlet_id).values_list('menu_slug', flat=True):
+        seq = bump_version(_seq_scope(menu_slug))
+        menu_message = dict(message, seq=seq)
+        cache.set(_event_key(menu_slug, seq), menu_message, LIVE_EVENT_TIMEOUT)
+        async_to_sync(channel_layer.group_send)(
+            f'seller_{menu_slug}',
+            {
+                'type': 'live_event',
+                'message': menu_message
+            }
+        )
+
+
+def send_live_event(order_id, event):
+    """Outbox handler publishing an order event, see publish_order_event()."""
+    _publish(Order.objects.select_related('outlet').get(pk=order_id), event)
+    if event != 'created':
+        send_order_update(order_id, event)
+
+
+def publish_order_event(order, event):
+    """
+    Publish a change of the order to the live boards of its outlet, and to
+    its tracking pages, once the current transaction commits.
+
+    ``event`` is 'created' for a new order, 'status' for a status change and
+    'payment' for a payment status change.
+    """
+    enqueue('shop.live.send_live_event', order_id=str(order.order_id), event=event)
+
+
+def notify_new_order(order_id):
+    """Outbox handler sending a new order to the seller notification channel and to the outlet owner."""
+    order = load_orders(Order.objects.filter(pk=order_id)).get()
+    order_data = OrderSerializer(order).data
+    channel_layer = get_channel_layer()
+    for menu in Menu.objects.filter(outlet_id=order.outlet_id):
+        async_to_sync(channel_layer.group_send)(
+            f'seller_{menu.menu_slug}',
+            {
+                'type': 'seller_notification',
+                'message': order_data
+            }
+        )
+
+    # notify outlet owner
+    payload = json.dumps({
+        "title": "New Order",
+        "body": "You have received a new order.",
+        "url": "https://seller.tacoza.co/orders"})
+    send_notification_to_user(order.outlet.outlet_manager, payload)
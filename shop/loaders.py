@@ -0,0 +1,97 @@
+"""
+Queryset loaders for the FoodItemSerializer and OrderSerializer families.
+
+Each loader applies the select_related/prefetch_related plan the matching
+serializer reads from, so serializing a list costs a fixed number of
+queries however many rows it holds.
+"""
+from django.db.models import Prefetch, Sum
+from django.db.models.functions import Coalesce
+from shop.models import FoodItem, Menu, OrderItem
+
+FOOD_ITEM_SELECT_RELATED = ('food_category', 'food_subcategory')
+FOOD_ITEM_PREFETCH_RELATED = ('addons__item_variant', 'tags', 'item_variants__variant', 'variant__options')
+
+
+def _prefixed(lookups, prefix):
+    return [f"{prefix}{lookup}" for lookup in lookups]
+
+
+def load_food_items(queryset):
+    """Load what FoodItemSerializer needs."""
+    return queryset.select_related(*FOOD_ITEM_SELECT_RELATED).prefetch_related(*FOOD_ITEM_PREFETCH_RELATED)
+
+
+def load_categories(queryset):
+    """Load what FoodCategorySerializer needs."""
+    food_items = load_food_items(FoodItem.objects.all())
+    return queryset.prefetch_related(
+        Prefetch('food_items', queryset=food_items),
+        'sub_categories',
+        Prefetch('sub_categories__food_items', queryset=food_items),
+    )
+
+
+def _load_line_items(queryset):
+    # CartItem and OrderItem share the same shape
+    return queryset.select_related(
+        'variant',
+        *_prefixed(FOOD_ITEM_SELECT_RELATED, 'food_item__'),
+    ).prefetch_related(
+        'addons__item_variant',
+        'variant__variant',
+        *_prefixed(FOOD_ITEM_PREFETCH_RELATED, 'food_item__'),
+    )
+
+
+def load_cart_items(queryset):
+    """Load what CartItemSerializer needs."""
+    return _load_line_items(queryset)
+
+
+def load_order_items(queryset):
+    """Load what OrderItemSerializer needs."""
+    return _load_line_items(queryset)
+
+
+def load_checkout_items(queryset):
+    """Load what checkout needs to price cart items and copy them into the order."""
+    return queryset.select_related('food_item', 'variant').prefetch_related('addons')
+
+
+def _load_order_outlets(queryset):
+    # Orders of a page mostly share their outlet, its menus are read once per page
+    return queryset.prefetch_related(Prefetch('outlet__menu_set', queryset=Menu.objects.only('outlet', 'menu_slug')))
+
+
+def _load_ticket_items(queryset):
+    # Line items of the kitchen tickets, see LiveOrderItemSerializer
+    items = OrderItem.objects.select_related('food_item', 'variant').prefetch_related('addons', 'variant__variant')
+    return queryset.prefetch_related(Prefetch('items', queryset=items))
+
+
+def load_orders(queryset):
+    """Load what OrderSerializer needs."""
+    queryset = queryset.select_related('user', 'table', 'outlet__shop').prefetch_related(
+        Prefetch('items', queryset=load_order_items(OrderItem.objects.all())),
+        'timeline',
+        'outlet__images',
+    )
+    return _load_order_outlets(queryset)
+
+
+def load_live_orders(queryset):
+    """Load what LiveOrderSerializer needs."""
+    return _load_ticket_items(queryset.select_related('user', 'table', 'outlet'))
+
+
+def load_order_summaries(queryset, expand=()):
+    """Load what OrderSummarySerializer needs, with the given fields expanded."""
+    queryset = queryset.select_related('user', 'table', 'outlet').annotate(
+        item_count=Coalesce(Sum('items__quantity'), 0),
+    )
+    if 'items' in expand:
+        queryset = _load_ticket_items(queryset)
+    if 'timeline' in expand:
+        queryset = queryset.prefetch_related('timeline')
+    return _load_order_outlets(queryset)
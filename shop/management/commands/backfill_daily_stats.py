@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from shop.rollups import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailyOutletStats rollup from the orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--outlet', type=int, action='append', dest='outlets',
+                            help='Only rebuild the given outlet, can be repeated')
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid date: {options['since']}")
+
+        rows = rebuild_daily_stats(outlet_ids=options['outlets'], since=since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily outlet stats rows"))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.outbox import OUTBOX_RETENTION, PRUNE_INTERVAL, drain_outbox, prune_outbox
+
+
+class Command(BaseCommand):
+    help = 'Run the outbox events left pending, e.g. after a crash, and prune the dispatched ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the due events and exit')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=10, help='Seconds to wait when nothing is due')
+        parser.add_argument('--retention', type=int, default=OUTBOX_RETENTION,
+                            help='Seconds dispatched events are kept')
+
+    def handle(self, *args, **options):
+        pruned_at = None
+        while True:
+            if pruned_at is None or time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned = prune_outbox(options['retention'])
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f"{pruned} dispatched events pruned")
+            counts = drain_outbox(options['batch_size'])
+            if any(counts.values()):
+                self.stdout.write(f"{counts['dispatched']} dispatched, {counts['failed']} failed")
+            if not any(counts.values()):
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from shop.carts import get_cart_store, CART_FLUSH_AFTER
+
+
+class Command(BaseCommand):
+    help = 'Write the carts left alone in Redis to the database, with CART_BACKEND set to RedisCartStore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Flush the idle carts and exit')
+        parser.add_argument('--idle', type=int, default=CART_FLUSH_AFTER, help='Seconds a cart is left alone to be flushed')
+        parser.add_argument('--interval', type=float, default=60 * 60, help='Seconds between two runs')
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        if not hasattr(store, 'flush_idle'):
+            raise CommandError(f"{type(store).__name__} keeps its carts in the database already")
+        while True:
+            flushed = store.flush_idle(options['idle'])
+            if flushed:
+                self.stdout.write(f"{flushed} carts flushed")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
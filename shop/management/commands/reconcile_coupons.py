@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from shop.redemptions import rebuild_coupon_counters
+
+
+class Command(BaseCommand):
+    help = 'Count the uses of the discount coupons from the orders into their usage counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--coupon', type=int, action='append', dest='coupons',
+                            help='Only count the uses of the given coupon, can be repeated')
+
+    def handle(self, *args, **options):
+        corrected = rebuild_coupon_counters(coupon_ids=options['coupons'])
+        self.stdout.write(self.style.SUCCESS(f"Corrected {corrected} coupon usage counters"))
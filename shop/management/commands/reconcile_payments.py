@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.payments import PRUNE_INTERVAL, WEBHOOK_EVENT_RETENTION, prune_webhook_events, reconcile_payments
+
+
+class Command(BaseCommand):
+    help = ('Settle the orders whose payment webhook never came from the payment gateway, '
+            'and prune the webhook events handled long ago')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Check the stale orders once and exit')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent gateway lookups')
+        parser.add_argument('--rate', type=float, default=10, help='Gateway lookups per second')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds to wait when nothing is due')
+        parser.add_argument('--retention', type=int, default=WEBHOOK_EVENT_RETENTION,
+                            help='Seconds handled webhook events are kept')
+
+    def handle(self, *args, **options):
+        pruned_at = None
+        while True:
+            if pruned_at is None or time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                pruned = prune_webhook_events(options['retention'])
+                pruned_at = time.monotonic()
+                if pruned:
+                    self.stdout.write(f"{pruned} webhook events pruned")
+            counts = reconcile_payments(
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                per_second=options['rate'],
+            )
+            if any(counts.values()):
+                self.stdout.write(f"{counts['checked']} checked, {counts['settled']} settled, {counts['failed']} failed")
+            if options['once']:
+                break
+            if counts['checked'] + counts['failed'] < options['batch_size']:
+                time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.4 on 2026-10-19 02:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0037_rename_category_image_foodcategory_image_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOutletStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('cash_orders', models.IntegerField(default=0)),
+                ('cash_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('online_orders', models.IntegerField(default=0)),
+                ('online_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('new_customers', models.IntegerField(default=0)),
+                ('returning_customers', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('outlet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='shop.outlet')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Outlet Stats',
+                'ordering': ['-date'],
+                'unique_together': {('outlet', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.4 on 2026-10-19 02:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0038_dailyoutletstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['outlet', 'created_at'], name='order_outlet_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['outlet', 'payment_status', 'created_at'], name='order_outlet_paid_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'outlet'], name='order_user_outlet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_status', 'success')), fields=['created_at'], name='order_success_created_idx'),
+        ),
+    ]
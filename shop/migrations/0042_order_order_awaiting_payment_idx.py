@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-19 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0041_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_session_id__isnull', False), ('payment_status__in', ['active', 'pending'])), fields=['created_at'], name='order_awaiting_payment_idx'),
+        ),
+    ]
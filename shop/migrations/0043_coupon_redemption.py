@@ -0,0 +1,51 @@
+# Generated by Django 4.2.4 on 2026-10-19 02:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_redemptions(apps, schema_editor):
+    # Start the counters at the uses the orders took so far
+    DiscountCoupon = apps.get_model('shop', 'DiscountCoupon')
+    CouponRedemption = apps.get_model('shop', 'CouponRedemption')
+    Order = apps.get_model('shop', 'Order')
+    # Orders cancelled, or whose payment failed or could not be started, hold no use
+    orders = Order.objects.filter(offer__isnull=False).exclude(
+        payment_status__in=('failed', 'terminated')).exclude(status='cancelled').order_by()
+    for row in orders.values('offer_id').annotate(count=models.Count('pk')):
+        DiscountCoupon.objects.filter(pk=row['offer_id']).update(usage_count=row['count'])
+    CouponRedemption.objects.bulk_create([
+        CouponRedemption(coupon_id=row['offer_id'], user_id=row['user_id'], count=row['count'])
+        for row in orders.values('offer_id', 'user_id').annotate(count=models.Count('pk'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0042_order_order_awaiting_payment_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discountcoupon',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CouponRedemption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redemptions', to='shop.discountcoupon')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coupon_redemptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('coupon', 'user')},
+            },
+        ),
+        migrations.RunPython(count_redemptions, migrations.RunPython.noop),
+    ]
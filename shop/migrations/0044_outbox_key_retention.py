@@ -0,0 +1,26 @@
+# Generated by Django 4.2.4 on 2026-10-19 03:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0043_coupon_redemption'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='key',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('dispatched_at__isnull', True)), fields=['key'], name='outbox_pending_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(condition=models.Q(('dispatched_at__isnull', False)), fields=['dispatched_at'], name='outbox_dispatched_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-19 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0044_outbox_key_retention'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['created_at'], name='webhook_event_created_idx'),
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from authentication.models import CustomUser
 from shortener.models import ShortenedURL
@@ -462,6 +462,25 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Owner views: an outlet's orders of a day or date range, optionally by payment status
+            models.Index(fields=['outlet', 'created_at'], name='order_outlet_created_idx'),
+            models.Index(fields=['outlet', 'payment_status', 'created_at'], name='order_outlet_paid_created_idx'),
+            # Customer views: a user's orders at an outlet
+            models.Index(fields=['user', 'outlet'], name='order_user_outlet_idx'),
+            # Rebuilding the daily rollup walks all paid orders by date
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(payment_status='success'),
+                name='order_success_created_idx',
+            ),
+            # Payment reconciliation looks for online orders still awaiting their payment
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(payment_status__in=['active', 'pending'], payment_session_id__isnull=False),
+                name='order_awaiting_payment_idx',
+            ),
+        ]
 
     def get_total_price(self):
         items = OrderItem.objects.filter(order=self)
@@ -491,6 +510,86 @@ class Payouts(models.Model):
         verbose_name_plural = 'Payouts'
 
 
+class DailyOutletStats(models.Model):
+    """Per-day sales rollup of an outlet, kept up to date by shop.rollups."""
+    outlet = models.ForeignKey(Outlet, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_orders = models.IntegerField(default=0)
+    cash_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    online_orders = models.IntegerField(default=0)
+    online_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    new_customers = models.IntegerField(default=0)
+    returning_customers = models.IntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.outlet} - {self.date} - {self.orders} - {self.revenue}"
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('outlet', 'date')
+        verbose_name_plural = 'Daily Outlet Stats'
+
+
+class WebhookEvent(models.Model):
+    """Ledger of the payment gateway webhooks already handled, so retried deliveries are ignored."""
+    event_id = models.CharField(max_length=255, unique=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='webhook_events')
+    event_type = models.CharField(max_length=100, blank=True, null=True)
+    payment_status = models.CharField(max_length=30)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.event_id
+
+    class Meta:
+        indexes = [
+            # Pruning deletes the events handled long ago, see shop.payments.prune_webhook_events
+            models.Index(fields=['created_at'], name='webhook_event_created_idx'),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """A side effect queued in the transaction that caused it, run by shop.outbox once it commits."""
+    handler = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    # Work deferred under the same key is queued once while pending, see shop.outbox.defer
+    key = models.CharField(max_length=255, blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.handler} - {self.created_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['available_at'],
+                condition=models.Q(dispatched_at__isnull=True),
+                name='outbox_pending_idx',
+            ),
+            models.Index(
+                fields=['key'],
+                condition=models.Q(dispatched_at__isnull=True),
+                name='outbox_pending_key_idx',
+            ),
+            # Pruning deletes the events dispatched long ago
+            models.Index(
+                fields=['dispatched_at'],
+                condition=models.Q(dispatched_at__isnull=False),
+                name='outbox_dispatched_idx',
+            ),
+        ]
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE)
@@ -591,6 +690,8 @@ class DiscountCoupon(models.Model):
 
     use_limit = models.PositiveIntegerField(default=1)
     use_limit_per_user = models.PositiveIntegerField(default=1)
+    # Uses taken by orders, see shop.redemptions
+    usage_count = models.PositiveIntegerField(default=0)
 
     products = models.ManyToManyField(FoodItem, related_name='coupons', blank=True)
     application_type = models.CharField(max_length=10, choices=APPLICATION_TYPE_CHOICES, default='alluser')
@@ -609,7 +710,12 @@ class DiscountCoupon(models.Model):
         """
         # Check how many orders this user has made for the specific outlet in the cart
         order_count = Order.objects.filter(user=user, outlet=cart.outlet).count()
+        return self.applies_to_order_count(order_count)
 
+    def applies_to_order_count(self, order_count):
+        """
+        Checks if the coupon is for a user who has made ``order_count`` orders at the outlet.
+        """
         if self.application_type == 'new' and order_count == 0:
             return True
         elif self.application_type == 'second' and order_count == 1:
@@ -622,13 +728,30 @@ class DiscountCoupon(models.Model):
     def get_usage_count(self):
         """
         Counts how many times this coupon has been used across all orders.
+        Orders cancelled or whose payment failed gave their use back.
+        Listings read the usage_count counter instead.
         """
-        return Order.objects.filter(offer=self).count()
+        from shop.redemptions import coupon_holding_orders
+        return coupon_holding_orders().filter(offer=self).count()
 
     class Meta:
         ordering = ['created_at']
 
 
+class CouponRedemption(models.Model):
+    """Uses of a coupon taken by the orders of a user, see shop.redemptions."""
+    coupon = models.ForeignKey(DiscountCoupon, on_delete=models.CASCADE, related_name='redemptions')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='coupon_redemptions')
+    count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.coupon.coupon_code} - {self.user} - {self.count}"
+
+    class Meta:
+        unique_together = (('coupon', 'user'))
+
+
 class ItemRelation(models.Model):
     RELATION_TYPE_CHOICES = [
         ('frequently_bought_together', 'Frequently Bought Together'),
@@ -647,3 +770,63 @@ class ItemRelation(models.Model):
 
     class Meta:
         unique_together = ('item1', 'item2')
+
+
+
+# Version scopes (see shop.versions) each model is part of, with the lookup
+# resolving the slugs of the menus those scopes are keyed on
+VERSIONED_MODELS = {
+    Menu: {'menu': 'menu_slug', 'outlet': 'menu_slug', 'tables': 'menu_slug'},
+    FoodItem: {'menu': 'menu_id'},
+    FoodCategory: {'menu': 'menu_id'},
+    SubCategory: {'menu': 'category__menu_id'},
+    Addon: {'menu': 'menu_id'},
+    ItemVariant: {'menu': 'food_item__menu_id'},
+    VariantCategory: {'menu': 'food_items__menu_id'},
+    Variant: {'menu': 'category__food_items__menu_id'},
+    FoodTag: {'menu': 'food_items__menu_id'},
+    Shop: {'outlet': 'outlet__menu__menu_slug'},
+    Outlet: {'outlet': 'menu__menu_slug', 'tables': 'menu__menu_slug'},
+    OutletImage: {'outlet': 'outlet__menu__menu_slug'},
+    Table: {'tables': 'outlet__menu__menu_slug'},
+    TableArea: {'tables': 'outlet__menu__menu_slug'},
+}
+
+
+def _invalidate_versions(model, pks):
+    """Bump the scopes of the menus affected by a change to the given objects."""
+    from shop.versions import invalidate_menus, menu_scope, outlet_scope, tables_scope
+    if not pks:
+        return
+    scope_funcs = {'menu': menu_scope, 'outlet': outlet_scope, 'tables': tables_scope}
+    for scope, lookup in VERSIONED_MODELS[model].items():
+        menu_slugs = model.objects.filter(pk__in=pks).values_list(lookup, flat=True)
+        invalidate_menus(set(menu_slugs), scope_funcs[scope])
+
+
+@receiver(post_save)
+def invalidate_versions_on_save(sender, instance, **kwargs):
+    if sender in VERSIONED_MODELS:
+        _invalidate_versions(sender, [instance.pk])
+
+
+@receiver(pre_delete)
+def invalidate_versions_on_delete(sender, instance, **kwargs):
+    # pre_delete so the related rows needed to find the menus still exist
+    if sender in VERSIONED_MODELS:
+        _invalidate_versions(sender, [instance.pk])
+
+
+@receiver(m2m_changed, sender=FoodItem.addons.through)
+@receiver(m2m_changed, sender=FoodItem.tags.through)
+@receiver(m2m_changed, sender=FoodItem.variant.through)
+@receiver(m2m_changed, sender=ItemVariant.variant.through)
+@receiver(m2m_changed, sender=Addon.item_variant.through)
+def invalidate_versions_on_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse and pk_set:
+        # e.g. tag.food_items.add(...), the changed objects are the food items
+        _invalidate_versions(model, pk_set)
+    else:
+        _invalidate_versions(type(instance), [instance.pk])
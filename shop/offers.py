@@ -0,0 +1,75 @@
+"""
+Offers of an outlet: the discount coupons a customer may apply to their cart.
+
+The coupons valid today are loaded in one query along with their usage
+counters (see shop.redemptions), the customer's own and how many orders the
+customer placed at the outlet, so checking a coupon against a cart needs
+no query of its own. The cart is priced once (see shop.pricing) and each
+coupon is evaluated against it in memory:
+
+- ``is_applicable``, the customer is one its application_type is for: a new
+  customer of the outlet, one on their second order, or anyone,
+- ``is_active``, it has uses left, overall and for the customer, and
+  discounts the cart within its order values and products,
+- ``discount``, what it takes off the cart.
+
+Offers are ranked by the discount they give, the ones the customer can
+apply first, so the best offer is the first one when it can be applied.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from shop.models import CouponRedemption, DiscountCoupon, Order
+from shop.pricing import ZERO, coupon_discount
+
+
+def load_offers(outlet_id, user, today=None):
+    """Return the coupons of the outlet valid today, annotated with their usage by the user."""
+    today = today or timezone.now().date()
+    user_redemptions = CouponRedemption.objects.filter(coupon_id=OuterRef('pk'), user=user).values('count')
+    user_orders = Order.objects.filter(user=user, outlet_id=OuterRef('outlet_id')).order_by().values(
+        'outlet_id').annotate(count=Count('pk')).values('count')
+    return DiscountCoupon.objects.filter(
+        outlet_id=outlet_id,
+        valid_from__lte=today,
+        valid_to__gte=today,
+    ).annotate(
+        times_used_by_user=Coalesce(Subquery(user_redemptions, output_field=IntegerField()), 0),
+        user_order_count=Coalesce(Subquery(user_orders, output_field=IntegerField()), 0),
+    ).prefetch_related('products')
+
+
+def evaluate_offer(coupon, cart_price):
+    """Set the is_applicable, is_active and discount of a coupon loaded by load_offers() for the priced cart."""
+    coupon.is_applicable = coupon.applies_to_order_count(coupon.user_order_count)
+    coupon.discount = coupon_discount(coupon, cart_price['subtotal'], cart_price['lines'])
+    coupon.is_active = (
+        coupon.usage_count < coupon.use_limit
+        and coupon.times_used_by_user < coupon.use_limit_per_user
+        and coupon.discount > ZERO
+    )
+    return coupon
+
+
+def rank_offers(coupons, cart_price):
+    """Evaluate the coupons for the priced cart, and return them best offer first."""
+    offers = [evaluate_offer(coupon, cart_price) for coupon in coupons]
+    return sorted(offers, key=lambda offer: (offer.is_applicable and offer.is_active, offer.discount), reverse=True)
+
+
+def best_offer(offers):
+    """Return the best of the ranked offers the customer can apply, None if there is none."""
+    if offers and offers[0].is_applicable and offers[0].is_active:
+        return offers[0]
+    return None
+
+
+def get_offers(user, outlet_id, cart_price):
+    """Return the ranked offers of the outlet for the user's priced cart."""
+    return rank_offers(load_offers(outlet_id, user), cart_price)
+
+
+def get_offer(user, outlet_id, coupon_code, cart_price):
+    """Return the offer of the outlet with the coupon code evaluated for the user's priced cart, None if there is none."""
+    coupon = load_offers(outlet_id, user).filter(coupon_code=coupon_code).first()
+    return evaluate_offer(coupon, cart_price) if coupon else None
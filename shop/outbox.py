@@ -0,0 +1,114 @@
+"""
+Transactional outbox for the side effects of order changes.
+
+enqueue() stores the side effect as an OutboxEvent in the current
+transaction, so it exists exactly when the change that caused it was
+committed. It is run right after the commit, and should that fail or the
+process die first, by the drain_outbox command which retries the events
+still pending.
+
+An event names its handler by dotted path, called with the event payload
+as keyword arguments. Handlers may run more than once and should not mind.
+
+defer() queues work that is not a side effect of a change, for the
+drain_outbox worker alone to run. Work deferred with a key is queued once
+while it is pending, however often it is asked for.
+
+Dispatched events are kept for OUTBOX_RETENTION, then deleted by
+prune_outbox(), which the drain_outbox worker runs every PRUNE_INTERVAL.
+Events that ran out of attempts are kept until they are looked into.
+"""
+import datetime
+import logging
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from shop.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# The drainer leaves fresh events to the relay run on commit for this long
+RELAY_DELAY = 60  # seconds
+# How long a claimed event is left to the process running it
+CLAIM_TIMEOUT = 5 * 60  # 5 minutes in seconds
+MAX_ATTEMPTS = 10
+# Retries wait RETRY_DELAY, then twice as long each time
+RETRY_DELAY = 30  # seconds
+# How long dispatched events are kept, and how often they are pruned
+OUTBOX_RETENTION = 7 * 24 * 60 * 60  # 7 days in seconds
+PRUNE_INTERVAL = 60 * 60  # 1 hour in seconds
+
+
+def enqueue(handler, **payload):
+    """Queue a call of the handler, run once the current transaction commits."""
+    event = OutboxEvent.objects.create(
+        handler=handler,
+        payload=payload,
+        available_at=timezone.now() + datetime.timedelta(seconds=RELAY_DELAY),
+    )
+    transaction.on_commit(lambda: dispatch(event.pk))
+    return event
+
+
+def defer(handler, key=None, **payload):
+    """
+    Queue a call of the handler for the drain_outbox worker, not waited on by
+    the current request.
+
+    With a ``key``, nothing is queued while an event deferred under the same
+    key is still pending, and that event is returned instead.
+    """
+    if key is not None:
+        pending = OutboxEvent.objects.filter(key=key, dispatched_at__isnull=True, attempts__lt=MAX_ATTEMPTS).first()
+        if pending is not None:
+            return pending
+    return OutboxEvent.objects.create(handler=handler, payload=payload, key=key, available_at=timezone.now())
+
+
+def _claim(pk, due_only):
+    now = timezone.now()
+    events = OutboxEvent.objects.filter(pk=pk, dispatched_at__isnull=True, attempts__lt=MAX_ATTEMPTS)
+    if due_only:
+        events = events.filter(available_at__lte=now)
+    return events.update(available_at=now + datetime.timedelta(seconds=CLAIM_TIMEOUT)) == 1
+
+
+def dispatch(pk, due_only=False):
+    """Run a pending event unless another process got to it first, return whether it succeeded."""
+    if not _claim(pk, due_only):
+        return False
+    event = OutboxEvent.objects.get(pk=pk)
+    try:
+        import_string(event.handler)(**event.payload)
+    except Exception as e:
+        event.attempts += 1
+        event.last_error = f"{type(e).__name__}: {e}"
+        event.available_at = timezone.now() + datetime.timedelta(seconds=RETRY_DELAY * 2 ** (event.attempts - 1))
+        event.save(update_fields=['attempts', 'last_error', 'available_at'])
+        logger.exception("Outbox event %s (%s) failed, attempt %s", pk, event.handler, event.attempts)
+        return False
+    event.dispatched_at = timezone.now()
+    event.save(update_fields=['dispatched_at'])
+    return True
+
+
+def drain_outbox(limit=100):
+    """Run the pending events that are due, return how many succeeded and failed."""
+    pks = list(
+        OutboxEvent.objects.filter(
+            dispatched_at__isnull=True,
+            available_at__lte=timezone.now(),
+            attempts__lt=MAX_ATTEMPTS,
+        ).order_by('available_at').values_list('pk', flat=True)[:limit]
+    )
+    counts = {'dispatched': 0, 'failed': 0}
+    for pk in pks:
+        counts['dispatched' if dispatch(pk, due_only=True) else 'failed'] += 1
+    return counts
+
+
+def prune_outbox(retention=OUTBOX_RETENTION):
+    """Delete the events dispatched more than ``retention`` seconds ago, return how many."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=retention)
+    deleted, _ = OutboxEvent.objects.filter(dispatched_at__lt=cutoff).delete()
+    return deleted
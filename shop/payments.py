@@ -0,0 +1,317 @@
+"""
+Payments of orders with the payment gateway.
+
+The gateway reports payments to the Cashfree webhook, which moves the order
+through apply_payment_status() and keeps the payments in the payment status
+cache. Views read the cache with get_payment_status() and never wait on the
+gateway: an order still awaiting its payment is refreshed from the gateway
+in the background, by the drain_outbox worker, at most every
+PENDING_REFRESH_INTERVAL.
+
+Orders whose webhook never came are settled by reconcile_payments() (see
+the reconcile_payments management command), which polls the gateway for
+the orders left awaiting their payment.
+
+The webhooks handled are recorded as WebhookEvents, so a retried delivery
+is ignored. They are kept for WEBHOOK_EVENT_RETENTION, well past the last
+retry of a delivery, then deleted by prune_webhook_events(), which the
+reconcile_payments worker runs every PRUNE_INTERVAL.
+
+The gateway is the class named by the PAYMENT_GATEWAY setting:
+
+- CashfreeGateway (the default) calls the Cashfree API.
+- LocalPaymentGateway calls nothing and answers with the payments kept in
+  ``payments``, by order id, to be used offline and by tests.
+"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cashfree_pg.api_client import Cashfree
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from shop.models import Order, WebhookEvent
+from shop.dashboard import invalidate_dashboard
+from shop.live import publish_order_event
+from shop.outbox import enqueue, defer
+from shop.redemptions import sync_coupon_use
+from shop.rollups import record_order_transition
+from shop.tracking import update_timeline
+
+logger = logging.getLogger(__name__)
+
+# Cashfree API credentials
+Cashfree.XClientId = settings.CASHFREE_CLIENT_ID
+Cashfree.XClientSecret = settings.CASHFREE_SECRET_KEY
+Cashfree.XEnvironment = Cashfree.PRODUCTION
+if settings.DEBUG:
+    Cashfree.XEnvironment = Cashfree.SANDBOX
+x_api_version = "2023-08-01"
+
+PAYMENT_STATUS_TIMEOUT = 24 * 60 * 60  # 24 hours in seconds
+# How stale the payments of an order awaiting its payment may be read
+PENDING_REFRESH_INTERVAL = 15  # seconds
+# Payment statuses of an order whose payment may still come in
+AWAITING_PAYMENT = ('active', 'pending')
+
+# Gateway payment status to the order's payment status and its timeline entry
+PAYMENT_TRANSITIONS = {
+    'SUCCESS': ('success', "Payment Success", "Payment has been completed successfully."),
+    'PENDING': ('pending', "Payment Pending", "Payment is pending."),
+}
+FAILED_TRANSITION = ('failed', "Payment Failed", "Payment has failed.")
+
+# Gateway payment statuses an order is moved to when they are found on a refresh
+SETTLED_GATEWAY_STATUSES = ('SUCCESS', 'FAILED', 'USER_DROPPED', 'CANCELLED', 'VOID')
+
+# Reconciliation leaves orders to their webhook for this long
+RECONCILE_GRACE = 5 * 60  # 5 minutes in seconds
+# and gives up on orders older than this, their checkout was abandoned
+RECONCILE_MAX_AGE = 24 * 60 * 60  # 24 hours in seconds
+# An order is polled again after a quarter of its age, within these bounds
+RECONCILE_MIN_INTERVAL = 60  # seconds
+RECONCILE_MAX_INTERVAL = 30 * 60  # 30 minutes in seconds
+
+# Cashfree stops retrying a delivery within a day, its event is kept far longer
+WEBHOOK_EVENT_RETENTION = 30 * 24 * 60 * 60  # 30 days in seconds
+PRUNE_INTERVAL = 60 * 60  # 1 hour in seconds
+
+
+class CashfreeGateway:
+    """Fetch payments from Cashfree."""
+
+    def fetch_payments(self, order_id):
+        api_response = Cashfree().PGOrderFetchPayments(x_api_version, order_id, None)
+        return [payment.to_dict() for payment in api_response.data or []]
+
+
+class LocalPaymentGateway:
+    """Answer with the payments kept in memory instead of calling Cashfree."""
+
+    def __init__(self, payments=None):
+        self.payments = payments if payments is not None else {}
+        self.calls = []
+
+    def fetch_payments(self, order_id):
+        self.calls.append(order_id)
+        return list(self.payments.get(order_id, []))
+
+
+def get_payment_gateway():
+    """Return an instance of the configured payment gateway."""
+    return import_string(getattr(settings, 'PAYMENT_GATEWAY', 'shop.payments.CashfreeGateway'))()
+
+
+def _payment_status_key(order_id):
+    return f"payment_status_{order_id}"
+
+
+def cache_payments(order_id, payments, refreshed=True):
+    """
+    Store payments of the order in the payment status cache.
+
+    ``payments`` are merged into the cached ones by payment id. Unless
+    ``refreshed`` is False they are all the payments of the order, read from
+    the gateway just now.
+    """
+    key = _payment_status_key(order_id)
+    entry = cache.get(key) or {'payments': [], 'refreshed_at': 0}
+    merged = {payment.get('cf_payment_id'): payment for payment in entry['payments']}
+    merged.update((payment.get('cf_payment_id'), payment) for payment in payments)
+    entry = {
+        'payments': list(merged.values()),
+        'refreshed_at': time.time() if refreshed else entry['refreshed_at'],
+    }
+    cache.set(key, entry, PAYMENT_STATUS_TIMEOUT)
+    return entry
+
+
+def _needs_refresh(order, entry):
+    if not order.payment_session_id:
+        # Paid at the outlet, the gateway knows nothing about the order
+        return False
+    if entry is None:
+        return True
+    return (order.payment_status in AWAITING_PAYMENT
+            and time.time() - entry['refreshed_at'] > PENDING_REFRESH_INTERVAL)
+
+
+def get_payment_status(order):
+    """
+    Return the cached payments of the order.
+
+    Schedules a refresh from the gateway when they are missing, or stale
+    while the order awaits its payment, the payments returned are the ones
+    cached until it ran.
+    """
+    entry = cache.get(_payment_status_key(order.order_id))
+    if _needs_refresh(order, entry) and cache.add(
+            f"payment_refresh_{order.order_id}", True, PENDING_REFRESH_INTERVAL):
+        defer('shop.payments.refresh_payment_status', key=f"payment_refresh_{order.order_id}",
+              order_id=str(order.order_id))
+    return entry['payments'] if entry else []
+
+
+def gateway_status(payments):
+    """Return the gateway payment status of an order with the given payments, None without any."""
+    if any(payment.get('payment_status') == 'SUCCESS' for payment in payments):
+        return 'SUCCESS'
+    if not payments:
+        return None
+    return max(payments, key=lambda payment: payment.get('payment_time') or '').get('payment_status')
+
+
+def settle_payments(order_id, payments):
+    """
+    Cache the payments of the order read from the gateway, and move the order
+    if they settled it. Returns whether the order moved.
+    """
+    cache_payments(order_id, payments)
+    status = gateway_status(payments)
+    if status not in SETTLED_GATEWAY_STATUSES:
+        return False
+    order = Order.objects.select_related('outlet').get(pk=order_id)
+    payment_method = next((payment.get('payment_group') for payment in payments
+                           if payment.get('payment_status') == 'SUCCESS'), None)
+    return apply_payment_status(order, status, payment_method)
+
+
+def refresh_payment_status(order_id, gateway=None):
+    """Outbox handler reading the payments of the order from the gateway, see get_payment_status()."""
+    settle_payments(order_id, (gateway or get_payment_gateway()).fetch_payments(order_id))
+
+
+class RateLimiter:
+    """Space out calls to at most ``per_second`` a second, across threads."""
+
+    def __init__(self, per_second):
+        self._interval = 1 / per_second
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _reconcile_interval(order, now):
+    age = (now - order.created_at).total_seconds()
+    return min(max(age / 4, RECONCILE_MIN_INTERVAL), RECONCILE_MAX_INTERVAL)
+
+
+def stale_orders(limit=None):
+    """
+    Return the online orders left awaiting their payment past the grace
+    period, that are due for another look at the gateway.
+    """
+    now = timezone.now()
+    orders = Order.objects.filter(
+        payment_status__in=AWAITING_PAYMENT,
+        payment_session_id__isnull=False,
+        created_at__gte=now - datetime.timedelta(seconds=RECONCILE_MAX_AGE),
+        created_at__lt=now - datetime.timedelta(seconds=RECONCILE_GRACE),
+    ).order_by('created_at').only('order_id', 'created_at')
+
+    # When each order was last read from the gateway, by the cache of its payments
+    orders = list(orders)
+    entries = cache.get_many([_payment_status_key(order.order_id) for order in orders])
+    due = []
+    for order in orders:
+        entry = entries.get(_payment_status_key(order.order_id))
+        refreshed_at = entry['refreshed_at'] if entry else 0
+        if time.time() - refreshed_at > _reconcile_interval(order, now):
+            due.append(order)
+            if len(due) == limit:
+                break
+    return due
+
+
+def reconcile_payments(gateway=None, batch_size=200, workers=8, per_second=10):
+    """
+    Settle the stale orders awaiting their payment from the gateway.
+
+    Up to ``batch_size`` orders are looked up on a pool of ``workers``
+    threads, at most ``per_second`` lookups a second, and moved the way the
+    webhook would have. Returns how many orders were checked, moved and
+    could not be looked up.
+    """
+    gateway = gateway or get_payment_gateway()
+    limiter = RateLimiter(per_second)
+    orders = stale_orders(batch_size)
+    counts = {'checked': 0, 'settled': 0, 'failed': 0}
+
+    def fetch(order_id):
+        limiter.wait()
+        try:
+            return order_id, gateway.fetch_payments(order_id), None
+        except Exception as e:
+            return order_id, None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(fetch, [order.order_id for order in orders])
+        # The lookups run on the pool, the orders are moved from this thread as they come in
+        for order_id, payments, error in results:
+            if error is not None:
+                logger.warning("Payment lookup of order %s failed: %s: %s", order_id, type(error).__name__, error)
+                counts['failed'] += 1
+                continue
+            counts['checked'] += 1
+            if settle_payments(order_id, payments):
+                counts['settled'] += 1
+    return counts
+
+
+def prune_webhook_events(retention=WEBHOOK_EVENT_RETENTION):
+    """Delete the webhook events handled more than ``retention`` seconds ago, return how many."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=retention)
+    deleted, _ = WebhookEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def apply_payment_status(order, gateway_status, payment_method=None):
+    """
+    Move the order to the payment status reported by the gateway.
+
+    The order only moves if it is not paid yet and still in the state it was
+    read in, so a report that is repeated, arrives late or races another one
+    changes nothing. Returns whether the order moved.
+    """
+    payment_status, stage, content = PAYMENT_TRANSITIONS.get(gateway_status, FAILED_TRANSITION)
+    previous_payment_status, previous_status = order.payment_status, order.status
+    if previous_payment_status in ('success', payment_status):
+        return False
+
+    changes = {'payment_status': payment_status, 'updated_at': timezone.now()}
+    if payment_status == 'success' and payment_method:
+        changes['payment_method'] = payment_method
+
+    with transaction.atomic():
+        # UPDATE ... WHERE payment_status = <as read>, never away from success
+        moved = Order.objects.filter(
+            pk=order.pk,
+            payment_status=previous_payment_status,
+        ).exclude(payment_status='success').update(**changes)
+        if not moved:
+            return False
+        for field, value in changes.items():
+            setattr(order, field, value)
+
+        record_order_transition(order, previous_payment_status, previous_status)
+        sync_coupon_use(order, previous_payment_status, previous_status)
+        invalidate_dashboard(order.outlet)
+        publish_order_event(order, 'payment')
+
+        update_timeline(order, stage, content)
+
+        # Notify the shop owner if payment was successful
+        if payment_status == 'success':
+            enqueue('shop.live.notify_new_order', order_id=str(order.order_id))
+    return True
@@ -0,0 +1,157 @@
+"""
+Pricing of carts from the price tables of the menus.
+
+A menu's price table holds the prices of its food items, item variants and
+addons, by id. It is read from the database in one query a kind, cached
+under the menu version so a change to the menu builds a new one, and kept
+parsed in the process for the version it was built for. A cart is then
+priced in one pass of dict lookups and Decimal sums, instead of walking the
+food item, variant and addons of each line:
+
+- the unit price of a line is the price of its variant, or of its food item
+  without one, plus the prices of its addons,
+- its total is the unit price times its quantity,
+- and the subtotal of the cart the sum of the line totals, from which the
+  discount of a coupon is taken to get the total.
+
+Lines are the plain dicts of shop.carts. Ids a price table does not know,
+e.g. of a food item of another menu, are priced from the database. A cart
+kept out of the database can outlive what it holds: lines whose food item
+or variant no longer exists are left out, and addons that no longer exist
+are not charged.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache
+from shop.models import Addon, FoodItem, ItemVariant
+from shop.versions import get_menu_version
+
+# Price tables are keyed by version, old ones only need to live long
+# enough to be evicted naturally
+PRICE_TABLE_TIMEOUT = 24 * 60 * 60  # 24 hours in seconds
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# Price tables built lately, by menu and version
+_price_tables = {}
+MAX_PRICE_TABLES = 32
+
+
+def build_price_table(menu_slug):
+    """Read the prices of the food items, item variants and addons of a menu from the database."""
+    return {
+        'food_items': dict(FoodItem.objects.filter(menu_id=menu_slug).values_list('id', 'price')),
+        'variants': dict(ItemVariant.objects.filter(food_item__menu_id=menu_slug).values_list('id', 'price')),
+        'addons': dict(Addon.objects.filter(menu_id=menu_slug).values_list('id', 'price')),
+    }
+
+
+def get_price_table(menu_slug):
+    """Return the price table of the current version of a menu."""
+    version = get_menu_version(menu_slug)
+    key = (menu_slug, version)
+    table = _price_tables.get(key)
+    if table is None:
+        cache_key = f"price_table_{menu_slug}_{version}"
+        table = cache.get(cache_key)
+        if table is None:
+            table = build_price_table(menu_slug)
+            cache.set(cache_key, table, PRICE_TABLE_TIMEOUT)
+        if len(_price_tables) >= MAX_PRICE_TABLES:
+            _price_tables.clear()
+        _price_tables[key] = table
+    return table
+
+
+def _complete_table(table, lines):
+    # The table with the prices of the ids of the lines it does not know read from the database
+    missing = {
+        'food_items': {line['food_item'] for line in lines} - set(table['food_items']),
+        'variants': {line['variant'] for line in lines if line['variant']} - set(table['variants']),
+        'addons': {addon_id for line in lines for addon_id in line['addons']} - set(table['addons']),
+    }
+    if not any(missing.values()):
+        return table
+    models = {'food_items': FoodItem, 'variants': ItemVariant, 'addons': Addon}
+    table = dict(table)
+    for kind, ids in missing.items():
+        if ids:
+            table[kind] = {**table[kind], **dict(models[kind].objects.filter(id__in=ids).values_list('id', 'price'))}
+    return table
+
+
+def _is_available(table, line):
+    return line['food_item'] in table['food_items'] and (not line['variant'] or line['variant'] in table['variants'])
+
+
+def available_lines(menu_slug, lines):
+    """Return the lines whose food item and variant still exist."""
+    table = _complete_table(get_price_table(menu_slug), lines)
+    return [line for line in lines if _is_available(table, line)]
+
+
+def coupon_discount(coupon, subtotal, priced_lines):
+    """
+    Return the discount of the coupon on a cart priced to ``subtotal``, zero
+    if the subtotal is outside the coupon's order values.
+
+    A coupon restricted to products only discounts the lines of those
+    products. A max_order_value of zero sets no maximum.
+    """
+    if subtotal < coupon.minimum_order_value:
+        return ZERO
+    if coupon.max_order_value and subtotal > coupon.max_order_value:
+        return ZERO
+    products = {product.pk for product in coupon.products.all()}
+    if products:
+        eligible = sum((line['total'] for line in priced_lines if line['food_item'] in products), ZERO)
+    else:
+        eligible = subtotal
+    if coupon.discount_type == 'percentage':
+        discount = (eligible * coupon.discount_value / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+    else:
+        discount = coupon.discount_value
+    return min(discount, eligible)
+
+
+def price_cart(menu_slug, lines, coupon=None):
+    """
+    Price the lines of a cart from the price table of the menu.
+
+    Returns the priced lines, each with the ``item_id`` and ``food_item`` of
+    the line and its unit ``price`` and ``total``, and the ``subtotal``,
+    ``discount`` of the coupon and ``total`` of the cart, all Decimals.
+    """
+    table = _complete_table(get_price_table(menu_slug), lines)
+    food_items, variants, addons = table['food_items'], table['variants'], table['addons']
+    priced_lines = []
+    for line in lines:
+        if not _is_available(table, line):
+            continue
+        price = variants[line['variant']] if line['variant'] else food_items[line['food_item']]
+        price = sum((addons.get(addon_id, ZERO) for addon_id in line['addons']), price)
+        priced_lines.append({
+            'item_id': line.get('item_id'),
+            'food_item': line['food_item'],
+            'price': price,
+            'total': price * line['quantity'],
+        })
+    subtotal = sum((line['total'] for line in priced_lines), ZERO)
+    discount = coupon_discount(coupon, subtotal, priced_lines) if coupon is not None else ZERO
+    return {
+        'lines': priced_lines,
+        'subtotal': subtotal,
+        'discount': discount,
+        'total': subtotal - discount,
+    }
+
+
+def item_lines(items):
+    """Return the lines of loaded cart or order items, their addons prefetched."""
+    return [{
+        'item_id': getattr(item, 'item_id', None),
+        'food_item': item.food_item_id,
+        'variant': item.variant_id,
+        'addons': [addon.pk for addon in item.addons.all()],
+        'quantity': item.quantity,
+    } for item in items]
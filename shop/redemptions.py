@@ -0,0 +1,136 @@
+"""
+Redemptions of discount coupons.
+
+The uses orders took of a coupon are counted in DiscountCoupon.usage_count,
+and those of each customer in their CouponRedemption row, so offers and
+coupon listings read counters instead of counting orders.
+
+Checkout takes a use with reserve_coupon(), in the transaction creating the
+order. Both counters are moved by conditional UPDATEs:
+
+    UPDATE ... SET usage_count = usage_count + 1 WHERE usage_count < use_limit
+
+so concurrent checkouts never take more uses than the coupon has: the
+UPDATE locks the row, the later checkout waits for the earlier one to
+commit and sees the count it left.
+
+An order cancelled, or whose payment failed or could not be started, gives
+its use back: sync_coupon_use() is called in the transaction moving an
+order, and releases the use, or takes it again should the order come back,
+e.g. paid after a failed attempt.
+
+rebuild_coupon_counters() counts the uses again from the orders, should the
+counters ever drift from them (see the reconcile_coupons management
+command).
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from shop.models import CouponRedemption, DiscountCoupon, Order
+
+# Orders in these statuses hold no use of their coupon
+RELEASED_PAYMENT_STATUSES = ('failed', 'terminated')
+RELEASED_STATUSES = ('cancelled',)
+
+
+def holds_coupon(payment_status, status):
+    """Return whether an order in these statuses holds a use of its coupon."""
+    return payment_status not in RELEASED_PAYMENT_STATUSES and status not in RELEASED_STATUSES
+
+
+def coupon_holding_orders():
+    """Return the orders holding a use of their coupon."""
+    return Order.objects.filter(offer__isnull=False).exclude(
+        payment_status__in=RELEASED_PAYMENT_STATUSES).exclude(status__in=RELEASED_STATUSES)
+
+
+def reserve_coupon(coupon, user):
+    """Take a use of the coupon for an order of the user. Returns False if it has none left, overall or for the user."""
+    now = timezone.now()
+    with transaction.atomic():
+        if not DiscountCoupon.objects.filter(pk=coupon.pk, usage_count__lt=F('use_limit')).update(
+                usage_count=F('usage_count') + 1, updated_at=now):
+            return False
+        redemption, created = CouponRedemption.objects.get_or_create(coupon=coupon, user=user)
+        if not CouponRedemption.objects.filter(pk=redemption.pk, count__lt=coupon.use_limit_per_user).update(
+                count=F('count') + 1, updated_at=now):
+            # Give the coupon's use back
+            transaction.set_rollback(True)
+            return False
+    return True
+
+
+def release_coupon(order):
+    """Give back the use of its coupon taken by the order."""
+    if order.offer_id is None:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        DiscountCoupon.objects.filter(pk=order.offer_id, usage_count__gt=0).update(
+            usage_count=F('usage_count') - 1, updated_at=now)
+        CouponRedemption.objects.filter(coupon_id=order.offer_id, user_id=order.user_id, count__gt=0).update(
+            count=F('count') - 1, updated_at=now)
+
+
+def retake_coupon(order):
+    """Take again the use of its coupon given back by the order, past the coupon's limits if need be."""
+    if order.offer_id is None:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        DiscountCoupon.objects.filter(pk=order.offer_id).update(usage_count=F('usage_count') + 1, updated_at=now)
+        redemption, created = CouponRedemption.objects.get_or_create(coupon_id=order.offer_id, user_id=order.user_id)
+        CouponRedemption.objects.filter(pk=redemption.pk).update(count=F('count') + 1, updated_at=now)
+
+
+def sync_coupon_use(order, previous_payment_status, previous_status):
+    """Give back or take again the use of its coupon as the order moved from the given statuses."""
+    if order.offer_id is None:
+        return
+    held = holds_coupon(previous_payment_status, previous_status)
+    holds = holds_coupon(order.payment_status, order.status)
+    if held and not holds:
+        release_coupon(order)
+    elif holds and not held:
+        retake_coupon(order)
+
+
+def rebuild_coupon_counters(coupon_ids=None):
+    """
+    Count the uses of the coupons, all of them by default, from their orders
+    into their counters. Returns how many counters were corrected.
+    """
+    corrected = 0
+    with transaction.atomic():
+        # The coupons are locked, checkouts taking a use wait for the counts and
+        # the counts for the checkouts under way to commit
+        coupons = DiscountCoupon.objects.select_for_update().only('id', 'usage_count')
+        if coupon_ids is not None:
+            coupons = coupons.filter(id__in=coupon_ids)
+        coupons = {coupon.pk: coupon for coupon in coupons}
+        orders = coupon_holding_orders().filter(offer_id__in=list(coupons)).order_by()
+
+        usage = dict(orders.values_list('offer_id').annotate(count=Count('pk')))
+        for coupon in coupons.values():
+            if coupon.usage_count != usage.get(coupon.pk, 0):
+                DiscountCoupon.objects.filter(pk=coupon.pk).update(
+                    usage_count=usage.get(coupon.pk, 0), updated_at=timezone.now())
+                corrected += 1
+
+        user_usage = {
+            (coupon_id, user_id): count
+            for coupon_id, user_id, count in orders.values_list('offer_id', 'user_id').annotate(count=Count('pk'))
+        }
+        redemptions = CouponRedemption.objects.filter(coupon_id__in=list(coupons))
+        for redemption in redemptions:
+            count = user_usage.pop((redemption.coupon_id, redemption.user_id), 0)
+            if redemption.count != count:
+                redemption.count = count
+                redemption.save(update_fields=['count', 'updated_at'])
+                corrected += 1
+        CouponRedemption.objects.bulk_create([
+            CouponRedemption(coupon_id=coupon_id, user_id=user_id, count=count)
+            for (coupon_id, user_id), count in user_usage.items()
+        ])
+        corrected += len(user_usage)
+    return corrected
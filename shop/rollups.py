@@ -0,0 +1,125 @@
+"""
+Daily outlet sales rollup.
+
+An order counts towards the DailyOutletStats row of the day it was placed
+while it is paid and not cancelled. The views report every transition
+through record_order_transition(), which moves the row's counters in place,
+and rebuild_daily_stats() recomputes the rows from the raw orders (see the
+backfill_daily_stats management command).
+
+The new/returning customer split is taken at transition time: an earlier
+order that only gets paid later does not reclassify the ones after it
+until the rows are rebuilt.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from shop.models import Order, DailyOutletStats
+
+
+def is_counted(payment_status, status):
+    """Return whether an order in the given state counts towards the rollup."""
+    return payment_status == 'success' and status != 'cancelled'
+
+
+def _is_new_customer(order):
+    """A customer is new on their first paid order at the outlet."""
+    return not Order.objects.filter(
+        user_id=order.user_id,
+        outlet_id=order.outlet_id,
+        payment_status='success',
+        created_at__lt=order.created_at,
+    ).exclude(pk=order.pk).exists()
+
+
+def _get_stats_row(outlet_id, date):
+    try:
+        with transaction.atomic():
+            stats, created = DailyOutletStats.objects.get_or_create(outlet_id=outlet_id, date=date)
+    except IntegrityError:
+        # Created concurrently by another order of the same day
+        stats = DailyOutletStats.objects.get(outlet_id=outlet_id, date=date)
+    return stats
+
+
+def _apply(order, sign):
+    date = order.created_at.date()
+    amount = order.total * sign
+    cash = order.payment_method == 'cash'
+    new_customer = _is_new_customer(order)
+    stats = _get_stats_row(order.outlet_id, date)
+    DailyOutletStats.objects.filter(pk=stats.pk).update(
+        orders=F('orders') + sign,
+        revenue=F('revenue') + amount,
+        cash_orders=F('cash_orders') + (sign if cash else 0),
+        cash_revenue=F('cash_revenue') + (amount if cash else 0),
+        online_orders=F('online_orders') + (0 if cash else sign),
+        online_revenue=F('online_revenue') + (0 if cash else amount),
+        new_customers=F('new_customers') + (sign if new_customer else 0),
+        returning_customers=F('returning_customers') + (0 if new_customer else sign),
+    )
+
+
+def record_order_transition(order, previous_payment_status, previous_status):
+    """Update the rollup after an order moved from the given previous state to its current one."""
+    was_counted = is_counted(previous_payment_status, previous_status)
+    now_counted = is_counted(order.payment_status, order.status)
+    if now_counted and not was_counted:
+        _apply(order, 1)
+    elif was_counted and not now_counted:
+        _apply(order, -1)
+
+
+def _empty_row():
+    return {
+        'orders': 0, 'revenue': Decimal(0),
+        'cash_orders': 0, 'cash_revenue': Decimal(0),
+        'online_orders': 0, 'online_revenue': Decimal(0),
+        'new_customers': 0, 'returning_customers': 0,
+    }
+
+
+def rebuild_daily_stats(outlet_ids=None, since=None):
+    """
+    Recompute the rollup rows from the raw orders.
+
+    Only rows of the given outlets, from the given date on, are rewritten,
+    earlier orders are still read to tell new customers from returning ones.
+    Returns the number of rows written.
+    """
+    orders = Order.objects.filter(payment_status='success')
+    if outlet_ids is not None:
+        orders = orders.filter(outlet_id__in=outlet_ids)
+    orders = orders.order_by('created_at').values_list(
+        'outlet_id', 'user_id', 'created_at', 'total', 'payment_method', 'status')
+
+    rows = defaultdict(_empty_row)
+    seen_customers = set()
+    for outlet_id, user_id, created_at, total, payment_method, status in orders.iterator(chunk_size=2000):
+        new_customer = (outlet_id, user_id) not in seen_customers
+        seen_customers.add((outlet_id, user_id))
+        date = created_at.date()
+        if not is_counted('success', status) or (since and date < since):
+            continue
+        row = rows[(outlet_id, date)]
+        channel = 'cash' if payment_method == 'cash' else 'online'
+        row['orders'] += 1
+        row['revenue'] += total
+        row[f'{channel}_orders'] += 1
+        row[f'{channel}_revenue'] += total
+        row['new_customers' if new_customer else 'returning_customers'] += 1
+
+    stale = DailyOutletStats.objects.all()
+    if outlet_ids is not None:
+        stale = stale.filter(outlet_id__in=outlet_ids)
+    if since:
+        stale = stale.filter(date__gte=since)
+
+    with transaction.atomic():
+        stale.delete()
+        DailyOutletStats.objects.bulk_create([
+            DailyOutletStats(outlet_id=outlet_id, date=date, **row)
+            for (outlet_id, date), row in rows.items()
+        ], batch_size=500)
+    return len(rows)
@@ -1,10 +1,27 @@
 import json
+import logging
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from shop.live import can_watch_board, get_live_snapshot, get_live_events
+from shop.tracking import order_group, can_track, get_order_state
+
+logger = logging.getLogger(__name__)
+
 
 class OrderConsumer(AsyncWebsocketConsumer):
+    """
+    Tracking of an order by its customer or its outlet's manager.
+
+    The order's state is sent on connect, then an order_update event on each
+    change, see shop.tracking. {"type": "sync"} asks for the state again.
+    """
     async def connect(self):
         self.order_id = self.scope['url_route']['kwargs']['order_id']
-        self.room_group_name = f'order_{self.order_id}'
+        self.room_group_name = order_group(self.order_id)
+
+        if not await database_sync_to_async(can_track)(self.scope['user'], self.order_id):
+            await self.close(code=4403)
+            return
 
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -12,6 +29,7 @@ class OrderConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        await self.send_state()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
@@ -21,33 +39,45 @@ class OrderConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         data = json.loads(text_data)
-        message = data['message']
+        if data.get('type') == 'sync':
+            await self.send_state()
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'order_update',
-                'message': message
-            }
-        )
+    async def send_state(self):
+        state = await database_sync_to_async(get_order_state)(self.order_id)
+        await self.send(text_data=json.dumps(state))
 
     async def order_update(self, event):
         message = event['message']
 
-        await self.send(text_data=json.dumps({
-            'message': message
-        }))
+        await self.send(text_data=json.dumps(message))
 
 class SellerConsumer(AsyncWebsocketConsumer):
+    """
+    Seller notifications and the live order board of a menu.
+
+    A board sends {"type": "subscribe", "last_seq": <seq or null>} and gets
+    the events it missed since last_seq, or a snapshot of the board if they
+    cannot be replayed, then each new event as it is published. Events carry
+    consecutive "seq" numbers, on a gap the board is resynced the same way.
+    Connections that never subscribe keep receiving the full order payloads.
+
+    Only the manager of the menu's outlet may connect.
+    """
     async def connect(self):
         self.seller_id = self.scope['url_route']['kwargs']['menu_slug']
         self.room_group_name = f'seller_{self.seller_id}'
+        # Last sequence number sent to a subscribed board, None until it subscribes
+        self.last_seq = None
+
+        if not await database_sync_to_async(can_watch_board)(self.scope['user'], self.seller_id):
+            await self.close(code=4403)
+            return
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        print(f"Added {self.channel_name} channel to {self.room_group_name}")
+        logger.debug("Added %s channel to %s", self.channel_name, self.room_group_name)
         await self.accept()
 
     async def disconnect(self, close_code):
@@ -57,20 +87,45 @@ class SellerConsumer(AsyncWebsocketConsumer):
         )
 
     async def receive(self, text_data):
-        print("Received message", text_data)
+        logger.debug("Received message %s", text_data)
         data = json.loads(text_data)
-        message = data['message']
+        # Notifications are published by the server, see shop.live, never relayed from a board
+        if data.get('type') == 'subscribe':
+            await self.subscribe(data.get('last_seq'))
 
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'seller_notification',
-                'message': message
-            }
-        )
+    async def subscribe(self, last_seq):
+        events = await database_sync_to_async(get_live_events)(self.seller_id, last_seq)
+        if events is None:
+            seq, orders = await database_sync_to_async(get_live_snapshot)(self.seller_id)
+            self.last_seq = seq
+            await self.send(text_data=json.dumps({
+                'type': 'snapshot',
+                'seq': seq,
+                'orders': orders
+            }))
+            return
+        self.last_seq = last_seq
+        for message in events:
+            self.last_seq = message['seq']
+            await self.send(text_data=json.dumps(message))
+
+    async def live_event(self, event):
+        message = event['message']
+        if self.last_seq is None or message['seq'] <= self.last_seq:
+            # Not subscribed, or already part of the snapshot or replay sent
+            return
+        if message['seq'] > self.last_seq + 1:
+            # Events were lost on the way, catch up from the replay log
+            await self.subscribe(self.last_seq)
+            return
+        self.last_seq = message['seq']
+        await self.send(text_data=json.dumps(message))
 
     async def seller_notification(self, event):
-        print("Received notification")
+        logger.debug("Received notification")
+        if self.last_seq is not None:
+            # Subscribed boards get the compact events instead
+            return
         message = event['message']
         await self.send(text_data=json.dumps({
             'message': message
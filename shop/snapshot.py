@@ -0,0 +1,50 @@
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from shop.versions import get_menu_version
+from shop.models import FoodCategory, FoodItem
+from shop.api.serializers import FoodCategorySerializer, FoodItemSerializer
+from shop.loaders import load_categories, load_food_items
+
+# Compiled snapshots are keyed by version, so old ones only need to live
+# long enough to be evicted naturally.
+SNAPSHOT_TIMEOUT = 24 * 60 * 60  # 24 hours in seconds
+
+
+def build_menu_data(menu):
+    """Serialize the public menu: the "Recommended" category followed by the menu categories."""
+    categories = load_categories(FoodCategory.objects.filter(menu=menu).order_by('order', 'name'))
+    category_data = list(FoodCategorySerializer(categories, many=True).data)
+
+    # Add the recommended category with all featured food items
+    featured_items = load_food_items(FoodItem.objects.filter(menu=menu, featured=True))
+    food_items_data = FoodItemSerializer(featured_items, many=True).data
+    if food_items_data:
+        category_data.insert(0, {
+            "id": -1,
+            "name": "Recommended",
+            "sub_categories": [],  # No subcategories in recommended
+            "food_items": food_items_data
+        })
+    return category_data
+
+
+def compile_menu(menu):
+    """Compile the public menu into a JSON blob."""
+    return JSONRenderer().render(build_menu_data(menu))
+
+
+def get_menu_snapshot(menu_slug, get_menu):
+    """
+    Return the (version, blob) snapshot of a menu.
+
+    The snapshot is compiled on a cache miss only, ``get_menu`` is called to
+    load the Menu in that case, so a cached menu is served without touching
+    the database.
+    """
+    version = get_menu_version(menu_slug)
+    cache_key = f"menu_snapshot_{menu_slug}_{version}"
+    blob = cache.get(cache_key)
+    if blob is None:
+        blob = compile_menu(get_menu())
+        cache.set(cache_key, blob, SNAPSHOT_TIMEOUT)
+    return version, blob
@@ -1,3 +1,1051 @@
-from django.test import TestCase
+import datetime
+from decimal import Decimal
+from unittest import mock
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+from authentication.models import CustomUser
+from shop.api.serializers import CartItemSerializer, FoodItemSerializer
+from shop.carts import RedisCartStore
+from shop.dashboard import get_dashboard_data
+from shop.loaders import load_cart_items
+from shop.outbox import MAX_ATTEMPTS, OUTBOX_RETENTION, defer, dispatch, prune_outbox
+from shop.pricing import coupon_discount, price_cart
+from shop.payments import (
+    WEBHOOK_EVENT_RETENTION,
+    LocalPaymentGateway,
+    apply_payment_status,
+    get_payment_status,
+    prune_webhook_events,
+    reconcile_payments,
+    stale_orders,
+)
+from shop.routes.routing import websocket_urlpatterns
+from shop.redemptions import rebuild_coupon_counters, release_coupon, reserve_coupon
+from shop.rollups import rebuild_daily_stats
+from shop.utils import day_range
+from shop.models import (
+    Addon,
+    Cart,
+    CartItem,
+    CouponRedemption,
+    DailyOutletStats,
+    DiscountCoupon,
+    FoodCategory,
+    FoodItem,
+    ItemVariant,
+    Menu,
+    Order,
+    OrderItem,
+    OrderTimelineItem,
+    OutboxEvent,
+    Outlet,
+    Shop,
+    Table,
+    TableArea,
+    Variant,
+    VariantCategory,
+    WebhookEvent,
+)
 
-# Create your tests here.
+
+class ShopTestCase(TestCase):
+    """An outlet with its menu, its owner and a customer."""
+
+    def setUp(self):
+        # Versions, snapshots and Redis carts live in the cache
+        cache.clear()
+        self.owner = CustomUser.objects.create_user(
+            email='owner@example.com', phone_number='+911111111111', password='p', role='owner', name='Owner')
+        self.customer = CustomUser.objects.create_user(
+            email='customer@example.com', phone_number='+912222222222', password='p', role='customer',
+            name='Customer')
+        shop = Shop.objects.create(name='Cafe', owner='owner')
+        self.outlet = Outlet.objects.create(shop=shop, name='Main', location='x', phone='1', outlet_manager=self.owner)
+        self.menu = Menu.objects.create(menu_slug='cafe-main', outlet=self.outlet)
+        area = TableArea.objects.create(outlet=self.outlet, name='Hall')
+        self.table = Table.objects.create(outlet=self.outlet, name='T1', capacity=4, area=area)
+        self.size = VariantCategory.objects.create(name='Size')
+        self.sizes = [Variant.objects.create(name=name, category=self.size) for name in ('Small', 'Large')]
+        self.addons = [Addon.objects.create(name=f'Addon {i}', menu=self.menu, price=Decimal('10.00') + i)
+                       for i in range(2)]
+        self.categories = [FoodCategory.objects.create(menu=self.menu, name=f'Category {i}', order=i)
+                           for i in range(2)]
+        self.food_items = []
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def add_food_items(self, count):
+        """Add ``count`` food items to the menu, every other one with sizes and addons."""
+        for i in range(len(self.food_items), len(self.food_items) + count):
+            food_item = FoodItem.objects.create(
+                menu=self.menu, name=f'Item {i}', food_type='veg', food_category=self.categories[i % 2],
+                description='d', price=Decimal('100.00') + i, featured=i % 3 == 1, order=i,
+            )
+            if i % 2:
+                food_item.variant.set([self.size])
+                for j, size in enumerate(self.sizes):
+                    item_variant = ItemVariant.objects.create(food_item=food_item, price=Decimal('120.00') + j)
+                    item_variant.variant.set([size])
+                food_item.addons.set(self.addons)
+            self.food_items.append(food_item)
+        return self.food_items
+
+    def add_to_cart(self, food_item, item_id, variant=None, addons=(), quantity=1):
+        return self.client.post(f'/api/shop/cart/{self.menu.menu_slug}/', {
+            'id': item_id,
+            'food_item_id': food_item.pk,
+            'variant_id': variant.pk if variant else None,
+            'addons': [addon.pk for addon in addons],
+            'quantity': quantity,
+        }, format='json')
+
+    def checkout(self, **data):
+        return self.client.post(f'/api/shop/checkout/{self.menu.menu_slug}/', {
+            'payment_method': 'cash',
+            'order_type': 'dine_in',
+            'table_id': str(self.table.table_id),
+            **data,
+        }, format='json')
+
+
+
+class QueryCountTests(ShopTestCase):
+    """Serializing food items costs the same queries however many there are."""
+
+    def assertConstantQueries(self, request, fill=None):
+        # The request with the menu at 3 then 30 food items, from a cold cache
+        expected = None
+        for size in (3, 30):
+            self.add_food_items(size - len(self.food_items))
+            if fill:
+                fill()
+            cache.clear()
+            if expected is None:
+                with CaptureQueriesContext(connection) as queries:
+                    request()
+                expected = len(queries)
+            else:
+                with self.assertNumQueries(expected):
+                    request()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def line_fields(self, food_item):
+        return {'food_item': food_item, 'variant': food_item.item_variants.first(), 'quantity': 1}
+
+    def fill_cart(self):
+        cart, created = Cart.objects.get_or_create(user=self.customer, outlet=self.outlet)
+        cart.items.all().delete()
+        for food_item in self.food_items:
+            cart_item = CartItem.objects.create(cart=cart, item_id=str(food_item.pk), **self.line_fields(food_item))
+            cart_item.addons.set(food_item.addons.all())
+
+    def add_order(self):
+        self.order = Order.objects.create(user=self.customer, outlet=self.outlet, total=Decimal('100.00'))
+        for food_item in self.food_items:
+            order_item = OrderItem.objects.create(order=self.order, **self.line_fields(food_item))
+            order_item.addons.set(food_item.addons.all())
+
+    def test_menu(self):
+        self.assertConstantQueries(lambda: self.get(f'/api/shop/menu/{self.menu.menu_slug}/'))
+
+    def test_food_items_by_category(self):
+        category = self.categories[1]
+        self.assertConstantQueries(lambda: self.get(f'/api/shop/food-items-category/{category.slug}'))
+
+    def test_food_item_list(self):
+        self.client.force_authenticate(self.owner)
+        self.assertConstantQueries(lambda: self.get('/api/shop/food-items/'))
+
+    def test_cart(self):
+        self.assertConstantQueries(lambda: self.get(f'/api/shop/cart/{self.menu.menu_slug}/?full=1'), self.fill_cart)
+
+    def test_cart_item_serializer(self):
+        def serialize():
+            items = load_cart_items(CartItem.objects.filter(cart__user=self.customer))
+            self.assertEqual(len(CartItemSerializer(items, many=True).data), len(self.food_items))
+        self.assertConstantQueries(serialize, self.fill_cart)
+
+    def test_order_detail(self):
+        self.assertConstantQueries(lambda: self.get(f'/api/shop/order/{self.order.order_id}/'), self.add_order)
+
+    def test_order_list(self):
+        self.client.force_authenticate(self.owner)
+        self.assertConstantQueries(lambda: self.get('/api/shop/orders/'), self.add_order)
+
+    def test_order_list_default_view(self):
+        # Orders are listed in full unless a summary is asked for
+        self.client.force_authenticate(self.owner)
+        self.add_food_items(3)
+        self.add_order()
+        detail = self.get('/api/shop/orders/?view=detail').json()
+        self.assertEqual(self.get('/api/shop/orders/').json(), detail)
+        self.assertNotEqual(self.get('/api/shop/orders/?view=summary').json(), detail)
+
+    def test_order_list_summary(self):
+        self.client.force_authenticate(self.owner)
+        self.assertConstantQueries(lambda: self.get('/api/shop/orders/?view=summary&expand=items'), self.add_order)
+
+
+@override_settings(CART_BACKEND='shop.carts.RedisCartStore')
+class RedisCartStoreTests(ShopTestCase):
+
+    def setUp(self):
+        try:
+            get_redis_connection('default').ping()
+        except Exception:
+            self.skipTest("Redis is not available")
+        super().setUp()
+
+    def test_deleted_food_item_is_left_out_of_the_cart(self):
+        kept, deleted, other, deleted_variant = self.add_food_items(4)
+        self.add_to_cart(kept, 'kept', quantity=2)
+        self.add_to_cart(deleted, 'deleted', variant=deleted.item_variants.first(), addons=self.addons)
+        variant = deleted_variant.item_variants.first()
+        self.add_to_cart(deleted_variant, 'deleted-variant', variant=variant)
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+            variant.delete()
+
+        response = self.client.get(f'/api/shop/cart/{self.menu.menu_slug}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['item_id'] for item in response.json()['items']], ['kept'])
+        self.assertEqual(response.json()['total'], float(kept.price * 2))
+
+        response = self.client.get(f'/api/shop/cart/{self.menu.menu_slug}/?full=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['item_id'] for item in response.json()], ['kept'])
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.total, kept.price * 2)
+        self.assertEqual([item.food_item_id for item in order.items.all()], [kept.pk])
+
+    def test_flush_leaves_out_deleted_food_items(self):
+        kept, deleted = self.add_food_items(2)
+        self.add_to_cart(kept, 'kept')
+        self.add_to_cart(deleted, 'deleted', variant=deleted.item_variants.first(), addons=self.addons)
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.delete()
+
+        self.assertEqual(RedisCartStore().flush_idle(idle=0), 1)
+        cart = Cart.objects.get(user=self.customer, outlet=self.outlet)
+        self.assertEqual([item.item_id for item in cart.items.all()], ['kept'])
+
+
+class CouponRedemptionTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        today = datetime.date.today()
+        self.coupon = DiscountCoupon.objects.create(
+            coupon_code='TEN', outlet=self.outlet, discount_type='percentage', discount_value=Decimal('10'),
+            valid_from=today, valid_to=today, use_limit=2, use_limit_per_user=1,
+        )
+        self.other_customer = CustomUser.objects.create_user(
+            email='other@example.com', phone_number='+913333333333', password='p', role='customer', name='Other')
+
+    def assertUsage(self, usage_count, **user_counts):
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, usage_count)
+        self.assertEqual(self.coupon.get_usage_count(), usage_count)
+        for user, count in user_counts.items():
+            redemption = CouponRedemption.objects.filter(coupon=self.coupon, user=getattr(self, user)).first()
+            self.assertEqual(redemption.count if redemption else 0, count)
+
+    def order_with_coupon(self, user, **fields):
+        order = Order.objects.create(user=user, outlet=self.outlet, offer=self.coupon, total=Decimal('100.00'),
+                                     **fields)
+        self.assertTrue(reserve_coupon(self.coupon, user))
+        return order
+
+    def test_reserve_within_limits(self):
+        self.order_with_coupon(self.customer)
+        self.assertUsage(1, customer=1)
+
+    def test_reserve_per_user_limit(self):
+        self.assertTrue(reserve_coupon(self.coupon, self.customer))
+        self.assertFalse(reserve_coupon(self.coupon, self.customer))
+        # The coupon's use taken before the user's limit was hit is given back
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 1)
+        self.assertEqual(CouponRedemption.objects.get(coupon=self.coupon, user=self.customer).count, 1)
+
+    def test_reserve_use_limit(self):
+        self.coupon.use_limit_per_user = 5
+        self.coupon.save()
+        self.assertTrue(reserve_coupon(self.coupon, self.customer))
+        self.assertTrue(reserve_coupon(self.coupon, self.other_customer))
+        self.assertFalse(reserve_coupon(self.coupon, self.customer))
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 2)
+        self.assertEqual(CouponRedemption.objects.get(coupon=self.coupon, user=self.customer).count, 1)
+
+    def test_release(self):
+        order = self.order_with_coupon(self.customer)
+        release_coupon(order)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 0)
+        self.assertTrue(reserve_coupon(self.coupon, self.customer))
+
+    def test_failed_payment_releases_use(self):
+        order = self.order_with_coupon(self.customer, payment_session_id='session')
+        self.assertTrue(apply_payment_status(order, 'FAILED'))
+        self.assertUsage(0, customer=0)
+        # Paid on a later attempt, the order takes its use again
+        self.assertTrue(apply_payment_status(order, 'SUCCESS'))
+        self.assertUsage(1, customer=1)
+
+    def test_cancelled_order_releases_use(self):
+        order = self.order_with_coupon(self.customer)
+        self.client.force_authenticate(self.owner)
+        response = self.client.put(f'/api/shop/order/{order.order_id}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertUsage(0, customer=0)
+        # Cancelling again gives nothing back
+        response = self.client.put(f'/api/shop/order/{order.order_id}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertUsage(0, customer=0)
+
+    def test_checkout_with_coupon(self):
+        food_item, = self.add_food_items(1)
+        self.add_to_cart(food_item, 'line', quantity=2)
+        response = self.checkout(coupon_code='TEN')
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.offer, self.coupon)
+        self.assertEqual(order.total, food_item.price * 2 * Decimal('0.9'))
+        self.assertUsage(1, customer=1)
+
+        # Over the customer's limit
+        self.add_to_cart(food_item, 'line')
+        response = self.checkout(coupon_code='TEN')
+        self.assertEqual(response.status_code, 400)
+        self.assertUsage(1, customer=1)
+
+    def test_rebuild_counters(self):
+        self.order_with_coupon(self.customer)
+        self.order_with_coupon(self.other_customer, status='cancelled')
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, 2)
+        self.assertEqual(rebuild_coupon_counters(), 2)
+        self.assertUsage(1, customer=1, other_customer=0)
+        self.assertEqual(rebuild_coupon_counters(), 0)
+
+
+class FailingPaymentGateway(LocalPaymentGateway):
+    """A local gateway whose lookups of the orders in ``failing`` raise."""
+
+    def __init__(self, payments=None, failing=()):
+        super().__init__(payments)
+        self.failing = set(failing)
+
+    def fetch_payments(self, order_id):
+        if order_id in self.failing:
+            self.calls.append(order_id)
+            raise ConnectionError("gateway unreachable")
+        return super().fetch_payments(order_id)
+
+
+class ReconcilePaymentsTests(ShopTestCase):
+    """Orders whose webhook never came are settled from the gateway, once."""
+
+    def setUp(self):
+        super().setUp()
+        orders = [
+            Order.objects.create(user=self.customer, outlet=self.outlet, total=Decimal('100.00'),
+                                 payment_session_id=f'session_{i}')
+            for i in range(5)
+        ]
+        # All but the last order are past the grace period left to the webhook
+        Order.objects.exclude(pk=orders[-1].pk).update(
+            created_at=datetime.datetime.now() - datetime.timedelta(minutes=10))
+        # Read back for their order ids as stored, not the UUIDs they were created with
+        self.paid, self.failed, self.pending, self.unreachable, self.recent = [
+            Order.objects.get(pk=order.pk) for order in orders]
+        self.gateway = FailingPaymentGateway({
+            self.paid.order_id: [{'cf_payment_id': 1, 'payment_status': 'SUCCESS', 'payment_group': 'upi'}],
+            self.failed.order_id: [{'cf_payment_id': 2, 'payment_status': 'FAILED'}],
+            self.pending.order_id: [{'cf_payment_id': 3, 'payment_status': 'PENDING'}],
+        }, failing=[self.unreachable.order_id])
+
+    def reconcile(self):
+        with self.assertLogs('shop.payments', 'WARNING') as logs:
+            counts = reconcile_payments(self.gateway, workers=2, per_second=1000)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn(self.unreachable.order_id, logs.output[0])
+        return counts
+
+    def payment_statuses(self):
+        return dict(Order.objects.values_list('order_id', 'payment_status'))
+
+    def test_stale_orders(self):
+        self.assertEqual(
+            {order.order_id for order in stale_orders()},
+            {self.paid.order_id, self.failed.order_id, self.pending.order_id, self.unreachable.order_id},
+        )
+
+    def test_reconcile(self):
+        self.assertEqual(self.reconcile(), {'checked': 3, 'settled': 2, 'failed': 1})
+        self.assertEqual(self.payment_statuses(), {
+            self.paid.order_id: 'success',
+            self.failed.order_id: 'failed',
+            # A pending payment is cached, not settled
+            self.pending.order_id: 'active',
+            self.unreachable.order_id: 'active',
+            self.recent.order_id: 'active',
+        })
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.payment_method, 'upi')
+
+    def test_reconcile_again(self):
+        self.reconcile()
+        statuses = self.payment_statuses()
+        self.gateway.calls.clear()
+        # Only the order that could not be looked up is due again, and still cannot be
+        self.assertEqual(self.reconcile(), {'checked': 0, 'settled': 0, 'failed': 1})
+        self.assertEqual(self.gateway.calls, [self.unreachable.order_id])
+        self.assertEqual(self.payment_statuses(), statuses)
+
+
+class OrderIndexTests(ShopTestCase):
+    """The owner views' order filters are planned on the Order indexes."""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest("EXPLAIN output is only checked on PostgreSQL and SQLite")
+        if connection.vendor == 'postgresql':
+            # A test table is too small for the planner to prefer an index over a scan
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        self.start, self.end = day_range(datetime.date.today())
+
+    def test_outlet_day(self):
+        plan = Order.objects.filter(
+            outlet=self.outlet, created_at__gte=self.start, created_at__lt=self.end).explain()
+        self.assertIn('order_outlet_created_idx', plan)
+
+    def test_outlet_payment_status_day(self):
+        plan = Order.objects.filter(
+            outlet=self.outlet, payment_status='success', created_at__gte=self.start, created_at__lt=self.end,
+        ).explain()
+        self.assertIn('order_outlet_paid_created_idx', plan)
+
+
+class SellerConsumerTests(ShopTestCase):
+    """Only the manager of the menu's outlet can watch its live board."""
+
+    def setUp(self):
+        super().setUp()
+        self.stranger = CustomUser.objects.create_user(
+            email='stranger@example.com', phone_number='+914444444444', password='p', role='owner',
+            name='Stranger')
+        Order.objects.create(user=self.customer, outlet=self.outlet, total=Decimal('100.00'), payment_method='cash')
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/sellers/{self.menu.menu_slug}/')
+        communicator.scope['user'] = user
+        connected, close_code = await communicator.connect()
+        return communicator, connected, close_code
+
+    async def test_refused(self):
+        for user in (AnonymousUser(), self.stranger, self.customer):
+            communicator, connected, close_code = await self.connect(user)
+            self.assertFalse(connected)
+            self.assertEqual(close_code, 4403)
+
+    async def test_manager_subscribes(self):
+        communicator, connected, close_code = await self.connect(self.owner)
+        self.assertTrue(connected)
+        await communicator.send_json_to({'type': 'subscribe', 'last_seq': None})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(len(snapshot['orders']['new']), 1)
+        await communicator.disconnect()
+
+    async def test_messages_not_relayed(self):
+        board, connected, close_code = await self.connect(self.owner)
+        other, connected, close_code = await self.connect(self.owner)
+        await board.send_json_to({'message': {'order_id': 'forged'}})
+        self.assertTrue(await other.receive_nothing())
+        await board.disconnect()
+        await other.disconnect()
+
+
+class OrderStatusRaceTests(ShopTestCase):
+    """Webhooks and owners move an order once, from the state it is really in."""
+
+    def setUp(self):
+        super().setUp()
+        today = datetime.date.today()
+        self.coupon = DiscountCoupon.objects.create(
+            coupon_code='TEN', outlet=self.outlet, discount_type='percentage', discount_value=Decimal('10'),
+            valid_from=today, valid_to=today, use_limit=5, use_limit_per_user=5,
+        )
+        self.order = Order.objects.create(user=self.customer, outlet=self.outlet, offer=self.coupon,
+                                          total=Decimal('100.00'), payment_status='pending')
+        self.order = Order.objects.select_related('outlet').get(pk=self.order.pk)
+        reserve_coupon(self.coupon, self.customer)
+        self.owner_client = APIClient()
+        self.owner_client.force_authenticate(self.owner)
+
+    def webhook(self, payment_status, payment_id):
+        with mock.patch('shop.api.views.Cashfree.PGVerifyWebhookSignature'):
+            response = APIClient().post('/api/shop/cashfree/webhook/', {
+                'type': 'PAYMENT_WEBHOOK',
+                'data': {
+                    'order': {'order_id': self.order.order_id},
+                    'payment': {'payment_status': payment_status, 'cf_payment_id': payment_id, 'payment_group': 'upi'},
+                },
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def assertState(self, payment_status, status, orders, usage_count):
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.payment_status, order.status), (payment_status, status))
+        stats = DailyOutletStats.objects.filter(outlet=self.outlet).first()
+        self.assertEqual(stats.orders if stats else 0, orders)
+        self.coupon.refresh_from_db()
+        self.assertEqual(self.coupon.usage_count, usage_count)
+
+    def test_duplicate_webhook(self):
+        self.webhook('SUCCESS', 1)
+        self.webhook('SUCCESS', 1)
+        self.assertEqual(WebhookEvent.objects.filter(order=self.order).count(), 1)
+        self.assertEqual(OrderTimelineItem.objects.filter(order=self.order, stage='Payment Success').count(), 1)
+        self.assertState('success', 'pending', orders=1, usage_count=1)
+        self.assertEqual(DailyOutletStats.objects.get(outlet=self.outlet).revenue, Decimal('100.00'))
+
+    def test_late_failed_webhook(self):
+        self.webhook('SUCCESS', 1)
+        self.webhook('FAILED', 2)
+        self.assertState('success', 'pending', orders=1, usage_count=1)
+        self.assertFalse(OrderTimelineItem.objects.filter(order=self.order, stage='Payment Failed').exists())
+
+    def test_prune_webhook_events(self):
+        self.webhook('SUCCESS', 1)
+        WebhookEvent.objects.update(
+            created_at=datetime.datetime.now() - datetime.timedelta(seconds=WEBHOOK_EVENT_RETENTION + 60))
+        self.webhook('FAILED', 2)
+        self.assertEqual(prune_webhook_events(), 1)
+        self.assertEqual(list(WebhookEvent.objects.values_list('payment_status', flat=True)), ['FAILED'])
+        self.assertEqual(prune_webhook_events(), 0)
+
+    def test_owner_payment_update_after_webhook(self):
+        # The owner's request read the order before the webhook settled it
+        stale = Order.objects.get(pk=self.order.pk)
+        self.webhook('SUCCESS', 1)
+        with mock.patch('shop.api.views.get_object_or_404', return_value=stale):
+            response = self.owner_client.put(f'/api/shop/order/{self.order.order_id}/', {'status': 'success'},
+                                             format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertState('success', 'pending', orders=1, usage_count=1)
+
+    def test_live_order_update_after_cancellation(self):
+        self.webhook('SUCCESS', 1)
+        stale = Order.objects.get(pk=self.order.pk)
+        response = self.owner_client.put(f'/api/shop/order/{self.order.order_id}/', {'status': 'cancelled'},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertState('success', 'cancelled', orders=0, usage_count=0)
+        with mock.patch('shop.api.views.get_object_or_404', return_value=stale):
+            response = self.owner_client.put(f'/api/shop/live-orders/{self.order.order_id}/',
+                                             {'status': 'processing'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertState('success', 'cancelled', orders=0, usage_count=0)
+
+    def test_live_order_update(self):
+        self.webhook('SUCCESS', 1)
+        response = self.owner_client.put(f'/api/shop/live-orders/{self.order.order_id}/', {'status': 'processing'},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertState('success', 'processing', orders=1, usage_count=1)
+
+
+class OutboxTests(ShopTestCase):
+    """Keyed work is queued once while pending, and dispatched events are pruned."""
+
+    def test_defer_once_by_key(self):
+        first = defer('shop.tests.noop', key='refresh_1', value=1)
+        self.assertEqual(defer('shop.tests.noop', key='refresh_1', value=1), first)
+        defer('shop.tests.noop', key='refresh_2', value=2)
+        self.assertEqual(OutboxEvent.objects.count(), 2)
+        self.assertTrue(dispatch(first.pk))
+        # Once run, the work can be deferred again
+        self.assertNotEqual(defer('shop.tests.noop', key='refresh_1', value=1), first)
+        self.assertEqual(OutboxEvent.objects.filter(key='refresh_1').count(), 2)
+
+    def test_payment_status_reads_queue_one_refresh(self):
+        order = Order.objects.create(user=self.customer, outlet=self.outlet, total=Decimal('100.00'),
+                                     payment_session_id='session')
+        for _ in range(3):
+            # Past the throttle of the refreshes
+            cache.delete(f"payment_refresh_{order.order_id}")
+            self.assertEqual(get_payment_status(order), [])
+        self.assertEqual(OutboxEvent.objects.filter(handler='shop.payments.refresh_payment_status').count(), 1)
+
+    def test_prune(self):
+        now = datetime.datetime.now()
+        old = now - datetime.timedelta(seconds=OUTBOX_RETENTION + 60)
+        expired = OutboxEvent.objects.create(handler='shop.tests.noop', dispatched_at=old)
+        recent = OutboxEvent.objects.create(handler='shop.tests.noop', dispatched_at=now)
+        pending = OutboxEvent.objects.create(handler='shop.tests.noop', available_at=old)
+        dead = OutboxEvent.objects.create(handler='shop.tests.noop', available_at=old, attempts=MAX_ATTEMPTS)
+        self.assertEqual(prune_outbox(), 1)
+        self.assertFalse(OutboxEvent.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(set(OutboxEvent.objects.values_list('pk', flat=True)), {recent.pk, pending.pk, dead.pk})
+        self.assertEqual(prune_outbox(), 0)
+
+
+def noop(**payload):
+    """Outbox handler of the tests, doing nothing."""
+
+
+class VariantTreeTests(ShopTestCase):
+    """The variant tree of a food item keeps the exact shape the apps were built against."""
+
+    def setUp(self):
+        super().setUp()
+        self.variant_categories = {'Size': self.size}
+        self.options = {size.name: size for size in self.sizes}
+        for name, options in (('Crust', ('Thin', 'Thick')), ('Cheese', ('Single', 'Double'))):
+            self.variant_categories[name] = VariantCategory.objects.create(name=name)
+            for option in options:
+                self.options[option] = Variant.objects.create(name=option, category=self.variant_categories[name])
+
+    def add_item(self, categories, variants):
+        food_item = FoodItem.objects.create(
+            menu=self.menu, name=' '.join(categories), food_type='veg', food_category=self.categories[0],
+            description='d', price=Decimal('100.00'))
+        food_item.variant.set([self.variant_categories[name] for name in categories])
+        for options, price in variants:
+            item_variant = ItemVariant.objects.create(food_item=food_item, price=Decimal(price))
+            item_variant.variant.set([self.options[name] for name in options])
+        return FoodItem.objects.get(pk=food_item.pk)
+
+    def category(self, name, *options):
+        return {'id': self.variant_categories[name].pk, 'name': name, 'options': list(options)}
+
+    def option(self, name, price=None, variant=None):
+        return {'id': self.options[name].pk, 'name': name, 'price': price, 'variant': variant}
+
+    def variant_tree(self, categories, variants):
+        return FoodItemSerializer(self.add_item(categories, variants)).data['variant']
+
+    def test_no_variants(self):
+        self.assertIsNone(self.variant_tree([], []))
+
+    def test_one_category(self):
+        self.assertEqual(self.variant_tree(['Size'], [(['Small'], '120.00'), (['Large'], '150.50')]), self.category(
+            'Size', self.option('Large', 150.5), self.option('Small', 120.0)))
+
+    def test_two_categories(self):
+        tree = self.variant_tree(['Size', 'Crust'], [
+            (['Small', 'Thin'], '120.00'), (['Small', 'Thick'], '130.00'), (['Large', 'Thin'], '150.00')])
+        self.assertEqual(tree, self.category(
+            'Crust',
+            self.option('Thick', variant=self.category('Size', self.option('Small', 130.0))),
+            self.option('Thin', variant=self.category(
+                'Size', self.option('Large', 150.0), self.option('Small', 120.0))),
+        ))
+
+    def test_three_categories(self):
+        tree = self.variant_tree(['Size', 'Crust', 'Cheese'], [
+            (['Small', 'Thin', 'Single'], '120.00'), (['Small', 'Thin', 'Double'], '135.00'),
+            (['Small', 'Thick', 'Double'], '140.00'), (['Large', 'Thick', 'Single'], '160.00'),
+            (['Large', 'Thin'], '155.00'),
+        ])
+        # The categories walked are shared by the options of a level: once the first one walked
+        # the last level, the middle level shows prices, and its next options end the tree
+        self.assertEqual(tree, self.category(
+            'Cheese',
+            self.option('Double', variant=self.category(
+                'Crust',
+                self.option('Thick', 140.0, self.category('Size', self.option('Small', 140.0))),
+                self.option('Thin', 135.0),
+            )),
+            self.option('Single', variant=self.category(
+                'Crust',
+                self.option('Thick', 160.0, self.category('Size', self.option('Large', 160.0))),
+                self.option('Thin', 120.0),
+            )),
+        ))
+
+
+class ConditionalGetTests(ShopTestCase):
+    """Public menu endpoints answer 304 to a client holding their current version."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_food_items(2)
+        self.client = APIClient()
+
+    def get(self, url, **headers):
+        return self.client.get(url, **headers)
+
+    def assertNotModified(self, url, response):
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_menu(self):
+        url = f'/api/shop/menu/{self.menu.menu_slug}/'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            food_item = self.food_items[0]
+            food_item.price = Decimal('99.00')
+            food_item.save()
+        edited = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(edited.status_code, 200)
+        self.assertNotEqual(edited['ETag'], response['ETag'])
+        self.assertIn('99.00', edited.content.decode())
+        self.assertNotModified(url, edited)
+
+    def test_outlet(self):
+        url = f'/api/shop/outlet/{self.menu.menu_slug}'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outlet.name = 'Renamed'
+            self.outlet.save()
+        edited = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(edited.status_code, 200)
+        self.assertEqual(edited.json()['name'], 'Renamed')
+
+    def test_tables(self):
+        tables_url = f'/api/shop/tables/{self.menu.menu_slug}/'
+        menu_url = f'/api/shop/menu/{self.menu.menu_slug}/'
+        tables, menu = self.get(tables_url), self.get(menu_url)
+        self.assertEqual(tables.status_code, 200)
+        self.assertNotModified(tables_url, tables)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Table.objects.create(outlet=self.outlet, name='T2', capacity=2, area=self.table.area)
+        self.assertEqual(self.get(tables_url, HTTP_IF_NONE_MATCH=tables['ETag']).status_code, 200)
+        # Other scopes keep their version
+        self.assertEqual(self.get(menu_url, HTTP_IF_NONE_MATCH=menu['ETag']).status_code, 304)
+
+
+class DashboardTests(ShopTestCase):
+    """The owner dashboard, from the daily rollup and the orders of the outlet."""
+
+    def setUp(self):
+        super().setUp()
+        self.other_customer = CustomUser.objects.create_user(
+            email='other@example.com', phone_number='+913333333333', password='p', role='customer', name='Other')
+        self.today = datetime.date.today()
+
+    def add_order(self, user, total, days_ago=0, payment_status='success'):
+        order = Order.objects.create(user=user, outlet=self.outlet, total=Decimal(total),
+                                     payment_status=payment_status)
+        Order.objects.filter(pk=order.pk).update(
+            created_at=datetime.datetime.now() - datetime.timedelta(days=days_ago))
+        return order
+
+    def test_dashboard_data(self):
+        self.add_order(self.customer, '30.00', days_ago=40)
+        self.add_order(self.customer, '50.00', days_ago=10)
+        self.add_order(self.customer, '100.00')
+        self.add_order(self.other_customer, '200.00')
+        self.add_order(self.other_customer, '70.00', payment_status='active')
+        rebuild_daily_stats()
+
+        # Only the orders of ten days ago may fall in the previous month
+        ten_days_ago = self.today - datetime.timedelta(days=10)
+        same_month = (ten_days_ago.year, ten_days_ago.month) == (self.today.year, self.today.month)
+        with self.assertNumQueries(3):
+            data = get_dashboard_data(Outlet.objects.filter(pk=self.outlet.pk))
+        self.assertEqual(data, {
+            'orders': [
+                {'date': str(self.today - datetime.timedelta(days=40)), 'orderCount': 1},
+                {'date': str(ten_days_ago), 'orderCount': 1},
+                {'date': str(self.today), 'orderCount': 2},
+            ],
+            'revenue': [
+                {'date': str(self.today - datetime.timedelta(days=40)), 'revenue': 30.0},
+                {'date': str(ten_days_ago), 'revenue': 50.0},
+                {'date': str(self.today), 'revenue': 300.0},
+            ],
+            'total_revenue': Decimal('380.00'),
+            # The customer's single order of the month, the other customer has two today
+            'new_users_this_month': 0 if same_month else 1,
+            'active_users_this_month': 1,
+            'total_orders_this_month': 3 if same_month else 2,
+            'todaysRevenue': 300.0,
+            'totalOrdersLastWeek': 1,
+            'averageRevenue': 126.67,
+            # All of today's orders, paid or not
+            'todaysOrders': 3,
+        })
+
+    def test_cached_until_an_order_changes(self):
+        self.client.force_authenticate(self.owner)
+        order = Order.objects.select_related('outlet').get(pk=self.add_order(self.customer, '100.00',
+                                                                             payment_status='active').pk)
+        self.assertEqual(self.client.get('/api/shop/dashboard/').json()['todaysRevenue'], 0)
+        # Served from the cache, without computing the dashboard again
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/shop/dashboard/').json()['todaysRevenue'], 0)
+        self.assertFalse([query for query in queries if 'shop_dailyoutletstats' in query['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_payment_status(order, 'SUCCESS', 'upi')
+        self.assertEqual(self.client.get('/api/shop/dashboard/').json()['todaysRevenue'], 100.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f'/api/shop/order/{order.order_id}/', {'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/shop/dashboard/').json()['todaysRevenue'], 0)
+
+    def test_empty_dashboard(self):
+        data = get_dashboard_data(Outlet.objects.filter(pk=self.outlet.pk))
+        self.assertEqual((data['orders'], data['total_revenue'], data['averageRevenue'], data['todaysOrders']),
+                         ([], 0, 0.0, 0))
+
+
+class DailyStatsTests(ShopTestCase):
+    """The daily rollup follows orders as they are placed, paid, cancelled and failed."""
+
+    def setUp(self):
+        super().setUp()
+        self.owner_client = APIClient()
+        self.owner_client.force_authenticate(self.owner)
+
+    def add_order(self, total, payment_method='online'):
+        return Order.objects.select_related('outlet').get(pk=Order.objects.create(
+            user=self.customer, outlet=self.outlet, total=Decimal(total), payment_method=payment_method).pk)
+
+    def stats(self):
+        row = DailyOutletStats.objects.filter(outlet=self.outlet, date=datetime.date.today()).values(
+            'orders', 'revenue', 'cash_orders', 'cash_revenue', 'online_orders', 'online_revenue',
+            'new_customers', 'returning_customers').first()
+        return row and {field: value for field, value in row.items() if value}
+
+    def assertMatchesRebuild(self):
+        stats = self.stats()
+        rebuild_daily_stats()
+        self.assertEqual(self.stats(), stats)
+
+    def test_transitions(self):
+        online = self.add_order('100.00')
+        # Placed orders are not counted until paid
+        self.assertIsNone(self.stats())
+
+        self.assertTrue(apply_payment_status(online, 'SUCCESS', 'upi'))
+        self.assertEqual(self.stats(), {
+            'orders': 1, 'revenue': Decimal('100.00'), 'online_orders': 1, 'online_revenue': Decimal('100.00'),
+            'new_customers': 1})
+
+        cash = self.add_order('40.00', payment_method='cash')
+        self.assertTrue(apply_payment_status(cash, 'SUCCESS'))
+        self.assertEqual(self.stats(), {
+            'orders': 2, 'revenue': Decimal('140.00'), 'cash_orders': 1, 'cash_revenue': Decimal('40.00'),
+            'online_orders': 1, 'online_revenue': Decimal('100.00'), 'new_customers': 1, 'returning_customers': 1})
+        self.assertMatchesRebuild()
+
+        response = self.owner_client.put(f'/api/shop/order/{online.order_id}/', {'status': 'cancelled'},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stats(), {
+            'orders': 1, 'revenue': Decimal('40.00'), 'cash_orders': 1, 'cash_revenue': Decimal('40.00'),
+            'returning_customers': 1})
+        self.assertMatchesRebuild()
+
+        failed = self.add_order('60.00')
+        self.assertTrue(apply_payment_status(failed, 'FAILED'))
+        self.assertEqual(self.stats()['orders'], 1)
+        # Paid after a failed attempt
+        self.assertTrue(apply_payment_status(failed, 'SUCCESS', 'card'))
+        self.assertEqual(self.stats()['orders'], 2)
+        self.assertEqual(self.stats()['online_revenue'], Decimal('60.00'))
+        self.assertMatchesRebuild()
+
+
+class CompactCartTests(ShopTestCase):
+    """A cart change answers with the line changed and the new totals only."""
+
+    def setUp(self):
+        super().setUp()
+        self.plain, self.sized = self.add_food_items(2)
+        self.small = self.sized.item_variants.get(variant=self.sizes[0])
+        self.url = f'/api/shop/cart/{self.menu.menu_slug}/'
+
+    def test_deltas(self):
+        response = self.add_to_cart(self.plain, 'a', quantity=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {
+            'total': 200.0, 'count': 2, 'item_id': 'a',
+            'item': {'item_id': 'a', 'food_item': self.plain.pk, 'variant': None, 'addons': [], 'quantity': 2,
+                     'price': 100.0, 'total': 200.0},
+        })
+
+        response = self.add_to_cart(self.sized, 'b', variant=self.small, addons=reversed(self.addons))
+        # The variant's price with both addons, addons listed by id
+        self.assertEqual(response.json(), {
+            'total': 341.0, 'count': 3, 'item_id': 'b',
+            'item': {'item_id': 'b', 'food_item': self.sized.pk, 'variant': self.small.pk,
+                     'addons': sorted(addon.pk for addon in self.addons), 'quantity': 1, 'price': 141.0,
+                     'total': 141.0},
+        })
+
+        response = self.client.put(f'{self.url}b/', {'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['total'], response.json()['count']), (623.0, 5))
+        self.assertEqual((response.json()['item']['quantity'], response.json()['item']['total']), (3, 423.0))
+
+        response = self.client.delete(f'{self.url}a/')
+        self.assertEqual(response.json(), {'total': 423.0, 'count': 3, 'item_id': 'a', 'item': None})
+
+    def test_whole_cart(self):
+        self.add_to_cart(self.plain, 'a', quantity=2)
+        self.add_to_cart(self.sized, 'b', variant=self.small, addons=self.addons[:1])
+        cart = self.client.get(self.url).json()
+        self.assertEqual((cart['total'], cart['count']), (330.0, 3))
+        self.assertEqual([(item['item_id'], item['total']) for item in cart['items']], [('a', 200.0), ('b', 130.0)])
+        # The full form prices the lines the same way
+        full = self.client.get(f'{self.url}?full=1').json()
+        self.assertEqual([(item['item_id'], float(item['totalPrice'])) for item in full], [('a', 200.0), ('b', 130.0)])
+
+
+class PricingTests(ShopTestCase):
+    """Carts are priced from the price table of the menu, coupons discount them."""
+
+    def setUp(self):
+        super().setUp()
+        self.plain, self.sized, self.other = self.add_food_items(3)
+        self.small = self.sized.item_variants.get(variant=self.sizes[0])
+
+    def line(self, food_item, variant=None, addons=(), quantity=1):
+        return {'item_id': str(food_item.pk), 'food_item': food_item.pk, 'variant': variant.pk if variant else None,
+                'addons': [addon.pk for addon in addons], 'quantity': quantity}
+
+    def coupon(self, discount_type='percentage', discount_value='10', products=(), **fields):
+        today = datetime.date.today()
+        coupon = DiscountCoupon.objects.create(
+            coupon_code=f'C{DiscountCoupon.objects.count()}', outlet=self.outlet, discount_type=discount_type,
+            discount_value=Decimal(discount_value), valid_from=today, valid_to=today, **fields)
+        coupon.products.set(products)
+        return coupon
+
+    def test_price_cart(self):
+        price = price_cart(self.menu.menu_slug, [
+            self.line(self.plain, quantity=2),
+            self.line(self.sized, self.small, self.addons[:1]),
+        ])
+        self.assertEqual([(line['price'], line['total']) for line in price['lines']],
+                         [(Decimal('100.00'), Decimal('200.00')), (Decimal('130.00'), Decimal('130.00'))])
+        self.assertEqual((price['subtotal'], price['discount'], price['total']),
+                         (Decimal('330.00'), Decimal('0.00'), Decimal('330.00')))
+
+    def test_coupon_on_cart(self):
+        price = price_cart(self.menu.menu_slug, [self.line(self.plain), self.line(self.other)], self.coupon())
+        self.assertEqual((price['subtotal'], price['discount'], price['total']),
+                         (Decimal('202.00'), Decimal('20.20'), Decimal('181.80')))
+
+    def test_percentage_rounding(self):
+        # 1.545 is rounded half up
+        self.assertEqual(coupon_discount(self.coupon(discount_value='15'), Decimal('10.30'), []), Decimal('1.55'))
+        self.assertEqual(coupon_discount(self.coupon(discount_value='3.33'), Decimal('102.00'), []), Decimal('3.40'))
+
+    def test_product_restricted_coupon(self):
+        price = price_cart(self.menu.menu_slug, [self.line(self.plain, quantity=2), self.line(self.other)])
+        # Only the lines of the coupon's products are discounted
+        coupon = self.coupon(products=[self.plain])
+        self.assertEqual(coupon_discount(coupon, price['subtotal'], price['lines']), Decimal('20.00'))
+        flat = self.coupon('flat', '500', products=[self.plain])
+        self.assertEqual(coupon_discount(flat, price['subtotal'], price['lines']), Decimal('200.00'))
+        elsewhere = self.coupon(products=[self.sized])
+        self.assertEqual(coupon_discount(elsewhere, price['subtotal'], price['lines']), Decimal('0.00'))
+
+    def test_order_values(self):
+        subtotal = Decimal('302.00')
+        # A max_order_value of zero sets no maximum
+        self.assertEqual(coupon_discount(self.coupon('flat', '50'), subtotal, []), Decimal('50'))
+        self.assertEqual(coupon_discount(self.coupon('flat', '50', max_order_value=Decimal('300')), subtotal, []),
+                         Decimal('0.00'))
+        self.assertEqual(coupon_discount(self.coupon('flat', '50', minimum_order_value=Decimal('400')), subtotal, []),
+                         Decimal('0.00'))
+        self.assertEqual(coupon_discount(self.coupon('flat', '50', max_order_value=Decimal('302')), subtotal, []),
+                         Decimal('50'))
+
+    def test_deleted_lines(self):
+        lines = [self.line(self.plain), self.line(self.sized, self.small, self.addons), self.line(self.other)]
+        self.assertEqual(price_cart(self.menu.menu_slug, lines)['subtotal'], Decimal('343.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+            self.addons[1].delete()
+        price = price_cart(self.menu.menu_slug, lines)
+        # The deleted food item's line is left out, the deleted addon is not charged
+        self.assertEqual([line['food_item'] for line in price['lines']], [self.plain.pk, self.sized.pk])
+        self.assertEqual(price['subtotal'], Decimal('230.00'))
+
+
+class ApplicableOffersTests(ShopTestCase):
+    """The outlet's offers are ranked by discount on the cart, the ones the customer can apply first."""
+
+    def setUp(self):
+        super().setUp()
+        plain, sized, other = self.add_food_items(3)
+        self.add_to_cart(plain, 'a', quantity=2)
+        self.add_to_cart(other, 'b')
+        # The customer's first order at the outlet
+        Order.objects.create(user=self.customer, outlet=self.outlet, total=Decimal('100.00'))
+        self.url = f'/api/shop/offers/{self.menu.menu_slug}/'
+
+    def coupon(self, code, discount_type, discount_value, valid_to=None, **fields):
+        today = datetime.date.today()
+        return DiscountCoupon.objects.create(
+            coupon_code=code, outlet=self.outlet, discount_type=discount_type, discount_value=Decimal(discount_value),
+            valid_from=today, valid_to=valid_to or today, **fields)
+
+    def offers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        offers = [(offer['coupon_code'], offer['is_applicable'], offer['is_active'], offer['discount'])
+                  for offer in data['offers']]
+        return offers, data['best_offer'] and data['best_offer']['coupon_code']
+
+    def test_ranking(self):
+        self.coupon('TEN', 'percentage', '10')
+        self.coupon('FLAT50', 'flat', '50')
+        self.coupon('SECOND', 'percentage', '20', application_type='second')
+        self.coupon('NEW', 'percentage', '50', application_type='new')
+        self.coupon('USED', 'flat', '80', usage_count=1)
+        self.coupon('BIG', 'flat', '100', minimum_order_value=Decimal('500'))
+        self.coupon('EXPIRED', 'flat', '90', valid_to=datetime.date.today() - datetime.timedelta(days=1))
+        # On a cart of 302.00
+        self.assertEqual(self.offers(), ([
+            ('SECOND', True, True, '60.40'),
+            ('FLAT50', True, True, '50.00'),
+            ('TEN', True, True, '30.20'),
+            # For new customers only
+            ('NEW', False, True, '151.00'),
+            # Out of uses
+            ('USED', True, False, '80.00'),
+            # Below its minimum order value
+            ('BIG', True, False, '0.00'),
+        ], 'SECOND'))
+
+    def test_used_by_customer(self):
+        coupon = self.coupon('TEN', 'percentage', '10', use_limit=5)
+        self.assertEqual(self.offers(), ([('TEN', True, True, '30.20')], 'TEN'))
+        reserve_coupon(coupon, self.customer)
+        # The customer used their one use of it
+        self.assertEqual(self.offers(), ([('TEN', True, False, '30.20')], None))
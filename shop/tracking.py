@@ -0,0 +1,99 @@
+"""
+Order tracking for customers, pushed over the order WebSocket (see
+OrderConsumer).
+
+A tracking page connecting gets the order's state, then an order_update
+event each time its status, payment status or timeline changes. Events only
+carry what changed along with the order's statuses, the page never needs
+to fetch the order again.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import Q
+from django.utils import timezone
+from shop.models import Order, OrderTimelineItem
+from shop.outbox import enqueue
+
+
+def order_group(order_id):
+    """Return the channel group of the order's tracking pages."""
+    return f"order_{order_id}"
+
+
+def _timeline_item(item):
+    return {
+        "stage": item.stage,
+        "done": item.done,
+        "content": item.content,
+        "created_at": item.created_at.isoformat()
+    }
+
+
+def get_order_state(order_id):
+    """Return the statuses and timeline of the order sent to a tracking page as it connects."""
+    order = Order.objects.prefetch_related('timeline').get(pk=order_id)
+    return {
+        'type': 'order_state',
+        'order_id': order.order_id,
+        'status': order.status,
+        'payment_status': order.payment_status,
+        'payment_method': order.payment_method,
+        'updated_at': order.updated_at.isoformat(),
+        'timeline': [_timeline_item(item) for item in order.timeline.all()],
+    }
+
+
+def can_track(user, order_id):
+    """Return whether the user may track the order, its customer or its outlet's manager."""
+    if not user.is_authenticated:
+        return False
+    return Order.objects.filter(Q(user=user) | Q(outlet__outlet_manager=user), pk=order_id).exists()
+
+
+def send_order_update(order_id, event, stage=None):
+    """
+    Outbox handler sending a change of the order to its tracking pages.
+
+    ``event`` is 'status', 'payment' or 'timeline', a timeline change names
+    the ``stage`` that changed.
+    """
+    order = Order.objects.only('order_id', 'status', 'payment_status', 'payment_method', 'updated_at').get(pk=order_id)
+    message = {
+        'type': 'order_update',
+        'event': event,
+        'order_id': order.order_id,
+        'status': order.status,
+        'payment_status': order.payment_status,
+        'payment_method': order.payment_method,
+        'updated_at': order.updated_at.isoformat(),
+    }
+    if stage is not None:
+        item = OrderTimelineItem.objects.filter(order_id=order_id, stage=stage).first()
+        if item is not None:
+            message['timeline_item'] = _timeline_item(item)
+    async_to_sync(get_channel_layer().group_send)(
+        order_group(order_id),
+        {
+            'type': 'order_update',
+            'message': message
+        }
+    )
+
+
+def update_timeline(order, stage, content):
+    """Mark the stage of the order's timeline as done, and tell its tracking pages once the transaction commits."""
+    timeline_item, created = OrderTimelineItem.objects.get_or_create(
+        order=order,
+        stage=stage,
+        defaults={
+            'content': content,
+            'done': True
+        }
+    )
+    # If the timeline item already exists, update its timestamp and content if needed
+    if not created:
+        timeline_item.content = content
+        timeline_item.updated_at = timezone.now()
+        timeline_item.save()
+    enqueue('shop.tracking.send_order_update', order_id=str(order.order_id), event='timeline', stage=stage)
+    return timeline_item
@@ -0,0 +1,17 @@
+import datetime
+from django.conf import settings
+from django.utils import timezone
+
+
+def day_range(start_date, end_date=None):
+    """
+    Return the [start, end) datetimes covering the given day, or days up to end_date included.
+
+    Filtering ``created_at__gte``/``created_at__lt`` on these, instead of
+    ``created_at__date``, lets the database use the created_at indexes.
+    """
+    start = datetime.datetime.combine(start_date, datetime.time.min)
+    end = datetime.datetime.combine((end_date or start_date) + datetime.timedelta(days=1), datetime.time.min)
+    if settings.USE_TZ:
+        start, end = timezone.make_aware(start), timezone.make_aware(end)
+    return start, end
@@ -0,0 +1,110 @@
+from django.db.models import prefetch_related_objects
+
+# Relations the variant tree of a food item is built from
+VARIANT_PREFETCH = ('variant__options', 'item_variants__variant')
+
+
+def prefetch_variant_data(food_items):
+    """Load the variant categories, options and item variants of a batch of food items in a constant number of queries."""
+    prefetch_related_objects(list(food_items), *VARIANT_PREFETCH)
+
+
+class VariantTree:
+    """
+    In-memory variant tree of a food item.
+
+    Every option of the item gets a bit, every ItemVariant the mask of its
+    options, so finding the ItemVariant of a combination of options is a
+    mask test instead of a query.
+    """
+
+    def __init__(self, food_item):
+        prefetch_variant_data([food_item])
+        self.categories = list(food_item.variant.all())
+        self.options = {category.pk: list(category.options.all()) for category in self.categories}
+        self.bits = {}
+        self.item_variants = []
+        for item_variant in food_item.item_variants.all():
+            mask = 0
+            for variant in item_variant.variant.all():
+                mask |= self.bits.setdefault(variant.pk, 1 << len(self.bits))
+            self.item_variants.append((mask, item_variant))
+
+    def match(self, options):
+        """Return the first ItemVariant including all of the given options, if any."""
+        mask = 0
+        for option in options:
+            if option.pk not in self.bits:
+                return None
+            mask |= self.bits[option.pk]
+        for item_variant_mask, item_variant in self.item_variants:
+            if item_variant_mask & mask == mask:
+                return item_variant
+        return None
+
+    def build(self):
+        """Return the nested variant data of the food item, None if it has no variants."""
+        if not self.categories:
+            return None
+        category = self.categories[0]
+
+        options_data = []
+        for option in self.options[category.pk]:
+            included_categories = [category]
+            included_options = [option]
+            related_item_variant = self.match(included_options)
+            if related_item_variant:
+                next_variants_data = self._build_next(included_categories, included_options)
+                options_data.append({
+                    "id": option.id,
+                    "name": option.name,
+                    "price": float(related_item_variant.price) if len(self.categories) == 1 else None,  # Only show price at the final level
+                    "variant": next_variants_data
+                })
+
+        return {
+            "id": category.id,
+            "name": category.name,
+            "options": options_data
+        }
+
+    def _build_next(self, included_categories, included_options):
+        """
+        Build the options of the next variant category.
+
+        ``included_categories`` is shared across sibling options on purpose:
+        the apps rely on the exact shape this produces.
+        """
+        if len(included_categories) == len(self.categories):
+            return None
+
+        # Find the next category that has not been included yet
+        next_category = None
+        for category in self.categories:
+            if category not in included_categories:
+                next_category = category
+                break
+        if not next_category:
+            return None
+
+        included_categories.append(next_category)
+
+        options_data = []
+        for option in self.options[next_category.pk]:
+            included_options.append(option)
+            related_item_variant = self.match(included_options)
+            if related_item_variant:
+                next_variants_data = self._build_next(included_categories, included_options)
+                options_data.append({
+                    "id": option.id,
+                    "name": option.name,
+                    "price": float(related_item_variant.price) if len(self.categories) == len(included_categories) else None,  # Show price only at the final level
+                    "variant": next_variants_data
+                })
+            included_options.pop()
+
+        return {
+            "id": next_category.id,
+            "name": next_category.name,
+            "options": options_data
+        }
@@ -0,0 +1,65 @@
+"""
+Version scopes of the public, per-menu data the customer app caches.
+
+Each scope is bumped from the signal handlers in shop.models when a row it
+is built from changes, and drives the menu snapshot and the ETags of the
+public endpoints.
+"""
+from django.db.models import Max
+from project.versioning import get_version, invalidate_scopes
+from shop.models import Menu, FoodItem, FoodCategory, Outlet, Shop, Table, TableArea
+
+
+def menu_scope(menu_slug):
+    """Return the version scope of a menu."""
+    return f"menu_{menu_slug}"
+
+
+def outlet_scope(menu_slug):
+    """Return the version scope of the outlet served under a menu."""
+    return f"outlet_{menu_slug}"
+
+
+def tables_scope(menu_slug):
+    """Return the version scope of the tables of the outlet served under a menu."""
+    return f"tables_{menu_slug}"
+
+
+def get_menu_version(menu_slug):
+    """Return the current version of a menu."""
+    return get_version(menu_scope(menu_slug))
+
+
+def invalidate_menus(menu_slugs, scope_func=menu_scope):
+    """Bump the given scope of the given menus once the current transaction commits."""
+    invalidate_scopes(scope_func(menu_slug) for menu_slug in menu_slugs if menu_slug)
+
+
+def _latest(*querysets):
+    dates = [queryset.aggregate(latest=Max('updated_at'))['latest'] for queryset in querysets]
+    return max([date for date in dates if date], default=None)
+
+
+def menu_last_modified(menu_slug):
+    """Return when the menu was last updated, according to the database."""
+    return _latest(
+        Menu.objects.filter(menu_slug=menu_slug),
+        FoodItem.objects.filter(menu_id=menu_slug),
+        FoodCategory.objects.filter(menu_id=menu_slug),
+    )
+
+
+def outlet_last_modified(menu_slug):
+    """Return when the outlet served under a menu was last updated, according to the database."""
+    return _latest(
+        Outlet.objects.filter(menu__menu_slug=menu_slug),
+        Shop.objects.filter(outlet__menu__menu_slug=menu_slug),
+    )
+
+
+def tables_last_modified(menu_slug):
+    """Return when the tables of the outlet served under a menu were last updated, according to the database."""
+    return _latest(
+        Table.objects.filter(outlet__menu__menu_slug=menu_slug),
+        TableArea.objects.filter(outlet__menu__menu_slug=menu_slug),
+    )
@@ -3,7 +3,9 @@ from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404, redirect
 from django.http import HttpResponseRedirect
-from shortener.models import ShortenedURL, AdGallery
+from django.db.models import Max
+from shortener.models import ShortenedURL, AdGallery, AD_GALLERY_SCOPE
+from project.versioning import conditional_get
 from shortener.api.serializers import URLShortenSerializer
 
 class CreateShortURL(APIView):
@@ -24,6 +26,8 @@ class RedirectShortURL(APIView):
 
 class AdGalleryList(APIView):
     permission_classes = []
+
+    @conditional_get(lambda: AD_GALLERY_SCOPE, lambda: AdGallery.objects.aggregate(latest=Max('created_at'))['latest'])
     def get(self, request, *args, **kwargs):
         ads = AdGallery.objects.filter(active=True)
         ad_list = []
@@ -1,7 +1,12 @@
 import string
 import random
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.crypto import get_random_string
+from project.versioning import invalidate_scopes
+
+AD_GALLERY_SCOPE = 'ad_gallery'
 
 class ShortenedURL(models.Model):
     original_url = models.URLField(max_length=500)
@@ -37,4 +42,10 @@ class AdGallery(models.Model):
     
     def save(self, *args, **kwargs):
         self.url = f"https://api.tacoza.co/ad_gallery/{self.image.url}"
-        super(AdGallery, self).save(*args, **kwargs)
\ No newline at end of file
+        super(AdGallery, self).save(*args, **kwargs)
+
+
+@receiver(post_save, sender=AdGallery)
+@receiver(post_delete, sender=AdGallery)
+def invalidate_ad_gallery(sender, instance, **kwargs):
+    invalidate_scopes([AD_GALLERY_SCOPE])